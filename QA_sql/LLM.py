@@ -1,145 +1,544 @@
 import requests
-from openai import OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+import openai
+from openai import OpenAI, DefaultHttpxClient
+import httpx
 import json
-from utils import API_KEY
+import re
+import threading
+from urllib.parse import urlsplit
+from utils import (
+    API_KEY, OLLAMA_URL, OLLAMA_KEEP_ALIVE, LLM_POOL_CONNECTIONS, LLM_POOL_MAXSIZE, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT
+)
 import os
+import socket
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from metrics import span, record
+from cancellation import Cancelled, current_token
+import llm_backends
+from llm_backends import (
+    Backend, LLMError, LLMTimeout, LLMUnavailable, LLMRequestError, register_backend, get_backend
+)
 
-def LLM_response(
-        messages: list[dict], 
-        model_name: str, 
-        stream: bool = True, 
-        url: str = "http://localhost:11434/api/generate"
-    ) -> str:
+# long-lived HTTP clients, reused across calls so connections stay alive
+_sessions: dict[str, requests.Session] = {}
+_openai_clients: dict[str, OpenAI] = {}
+_clients_lock = threading.Lock()
+
+_TIMEOUT = (LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+
+# connections checked out by the requests of the current thread, see `_cancellable`
+_checkouts = threading.local()
+
+
+class _TrackedPoolMixin:
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        watched = getattr(_checkouts, "connections", None)
+        if watched is not None:
+            watched.append(conn)
+        return conn
+
+
+class _TrackedHTTPConnectionPool(_TrackedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _TrackedHTTPSConnectionPool(_TrackedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CancellableAdapter(HTTPAdapter):
     """
-    Fetch responses from LLM
+    Keep-alive adapter whose connections in use can be shut down from
+    another thread, which interrupts a request blocked waiting for the server.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool, "https": _TrackedHTTPSConnectionPool
+        }
+
+
+def _shutdown(connections: list):
+    for conn in connections:
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+@contextmanager
+def _cancellable(session: requests.Session) -> Iterator:
+    """
+    `session.post`, with the connections of the requests sent in the `with`
+    block shut down when the current cancellation token is cancelled. This
+    interrupts a request blocked waiting for the server, which sees the
+    client going away and stops generating.
+    """
+    token = current_token()
+    if token is None:
+        yield session.post
+        return
+    token.raise_if_cancelled("llm")
+    connections = []
+
+    def post(**kwargs):
+        _checkouts.connections = connections
+        try:
+            return session.post(**kwargs)
+        finally:
+            _checkouts.connections = None
+
+    with token.on_cancel(lambda: _shutdown(connections)):
+        yield post
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Get the keep-alive HTTP session for the host serving `url`.
 
     Args:
-        messages (list[dict]): list of message dictionaries following ChatCompletion format
-        model_name (str): name of the LLM model
-        url (str): endpoint where LLM is hosted
+        url (str): endpoint of the LLM server
+
     Returns:
-        str: The LLM output.
+        requests.Session: a session with a connection pool of `pool_maxsize` connections
+    """
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+
+    session = _sessions.get(key)
+    if session is None:
+        with _clients_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = _CancellableAdapter(pool_connections=LLM_POOL_CONNECTIONS, pool_maxsize=LLM_POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _sessions[key] = session
+    return session
+
+
+def get_openai_client(api_key: str) -> OpenAI:
     """
-    
-    if model_name[:3].lower() == 'gpt':
-        if 'OPENAI_API_KEY' in os.environ:
-            api_key = os.getenv('OPENAI_API_KEY')
+    Get the long-lived OpenAI client for an API key.
+
+    Args:
+        api_key (str): the api key to access openai model
+
+    Returns:
+        OpenAI: a client sharing one connection pool across calls
+    """
+    client = _openai_clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _openai_clients.get(api_key)
+            if client is None:
+                client = OpenAI(
+                    api_key=api_key,
+                    timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                    # retried by `llm_backends`, with failover
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=LLM_POOL_MAXSIZE,
+                            max_keepalive_connections=LLM_POOL_MAXSIZE,
+                        )
+                    ),
+                )
+                _openai_clients[api_key] = client
+    return client
+
+
+def close_clients():
+    """
+    Close every cached HTTP session and OpenAI client.
+    """
+    with _clients_lock:
+        sessions = list(_sessions.values())
+        clients = list(_openai_clients.values())
+        _sessions.clear()
+        _openai_clients.clear()
+    for session in sessions:
+        session.close()
+    for client in clients:
+        client.close()
+
+
+def _ollama_content(chunk: dict) -> str:
+    """Text of an Ollama chat or completion response (chunk)."""
+    if "message" in chunk:
+        return chunk["message"].get("content", "")
+    return chunk.get("response", "")
+
+
+def _ollama_stats(chunk: dict) -> dict:
+    """Prompt evaluation statistics of the final Ollama response chunk."""
+    stats = {"prompt_tokens": chunk.get("prompt_eval_count")}
+    if chunk.get("prompt_eval_duration") is not None:
+        # time spent processing the prompt tokens not served from the cache
+        stats["prefill"] = chunk["prompt_eval_duration"] / 1e9
+    return stats
+
+
+def _request_error(e: Exception, backend: str) -> LLMError:
+    """The typed error of a failed HTTP request."""
+    if isinstance(e, requests.ConnectTimeout):
+        return LLMTimeout(f"no connection within {LLM_CONNECT_TIMEOUT:.0f}s", backend, "connect")
+    if isinstance(e, requests.ReadTimeout):
+        return LLMTimeout(f"no data within {LLM_READ_TIMEOUT:.0f}s", backend, "read")
+    if isinstance(e, (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+        return LLMUnavailable(str(e), backend)
+    return LLMError(f"{type(e).__name__}: {e}", backend)
+
+
+def _status_error(response: requests.Response, backend: str) -> LLMError:
+    """The typed error of an HTTP error response, 429 and 5xx may succeed if sent again."""
+    try:
+        detail = response.json().get("error", response.text)
+    except ValueError:
+        detail = response.text
+    message = f"HTTP {response.status_code}: {detail}"
+    if response.status_code == 429 or response.status_code >= 500:
+        return LLMUnavailable(message, backend)
+    return LLMRequestError(message, backend)
+
+
+def _openai_error(e: Exception, backend: str) -> LLMError:
+    """The typed error of a failed OpenAI request."""
+    if isinstance(e, openai.APITimeoutError):
+        return LLMTimeout(str(e), backend, "read")
+    if isinstance(e, openai.APIConnectionError):
+        return LLMUnavailable(str(e), backend)
+    if isinstance(e, openai.APIStatusError):
+        if e.status_code == 429 or e.status_code >= 500:
+            return LLMUnavailable(str(e), backend)
+        return LLMRequestError(str(e), backend)
+    return LLMError(f"{type(e).__name__}: {e}", backend)
+
+
+class OllamaBackend(Backend):
+    """
+    A model served by Ollama, through its chat endpoint (`/api/chat`) or its
+    completion endpoint (`/api/generate`), see the `ollama_url` setting.
+    """
+
+    kind = "ollama"
+
+    @classmethod
+    def server(cls, endpoint: str = None) -> str:
+        return endpoint or OLLAMA_URL
+
+    def _data(self, messages: list[dict], stream: bool, temperature: float) -> dict:
+        if self.endpoint.rstrip("/").endswith("/api/generate"):
+            # completion endpoint, the conversation is flattened into a single prompt
+            prompt = "\n".join(
+                [f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages]
+            )
+            data = {
+                "model": self.model_name,
+                "prompt": prompt,
+                "stream": stream,
+            }
         else:
-            api_key = API_KEY
+            # chat endpoint, the server applies the model's chat template and reuses
+            # the cached prefix of the previous prompt
+            data = {
+                "model": self.model_name,
+                "messages": list(messages),
+                "stream": stream,
+            }
+        if OLLAMA_KEEP_ALIVE:
+            # keep the model, and its prompt cache, loaded between questions
+            data["keep_alive"] = OLLAMA_KEEP_ALIVE
+        if temperature is not None:
+            data["options"] = {"temperature": temperature}
+        return data
 
-        if api_key is None:
-           raise ValueError('API key not found. Make sure to add your api key to the config file.')
-
-        response = GPT_response(messages, model_name, stream=stream, api_key=api_key)
-        
-        return response
-    
-    prompt = "\n".join(
-        [f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages]
-    )
-    data = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": stream,
-    }
-
-    def _stream_response(data, url):
+    def stream(self, messages: list[dict], temperature: float = None) -> Iterator[str]:
+        data = self._data(messages, True, temperature)
+        session = get_session(self.endpoint)
+        start = time.perf_counter()
+        stats = {"model": self.model_name, "backend": self.name, "stream": True, "bytes": 0, "completion_tokens": 0}
+        token = current_token()
         try:
             # LLM streaming
             print('Streaming')
-            response = requests.post(url=url, json=data, stream=True)
-            if response.status_code == 200:
+            # closing the response hands the connection back to the session pool
+            with _cancellable(session) as post, \
+                    post(url=self.endpoint, json=data, stream=True, timeout=_TIMEOUT) as response:
+                if response.status_code != 200:
+                    raise _status_error(response, self.name)
                 for line in response.iter_lines():
+                    if token is not None and token.cancelled:
+                        raise Cancelled("llm")
                     if line:
+                        stats["bytes"] += len(line)
                         try:
                             chunk = json.loads(line.decode('utf-8'))
-                            # yield the result as they come in
-                            yield chunk.get("response", "")
-
-                            if chunk.get("done", False):
-                                break
                         except json.JSONDecodeError:
                             continue
-            else:
-                print("Error:", response.status_code, response.json())
-                return None
+                        if "error" in chunk:
+                            # the server failed in the middle of the response
+                            raise LLMUnavailable(str(chunk["error"]), self.name)
+                        if chunk.get("done"):
+                            stats.update(_ollama_stats(chunk))
+                            stats["completion_tokens"] = chunk.get("eval_count", stats["completion_tokens"])
+                        elif "ttft" not in stats:
+                            stats["ttft"] = time.perf_counter() - start
+                            stats["completion_tokens"] += 1
+                        else:
+                            stats["completion_tokens"] += 1
+                        # yield the result as they come in
+                        yield _ollama_content(chunk)
+
+                        # keep reading after the final chunk so the body is fully
+                        # consumed and the connection can be reused
+            if token is not None and token.cancelled:
+                # the stream ended early because its connection was shut down
+                raise Cancelled("llm")
 
+        except Cancelled:
+            stats["error"] = "cancelled"
+            raise
+        except LLMError as e:
+            stats["error"] = type(e).__name__
+            raise
         except Exception as e:
-            print(f"API call failed: {e}")
-            raise Exception
+            if token is not None and token.cancelled:
+                stats["error"] = "cancelled"
+                raise Cancelled("llm") from e
+            stats["error"] = type(e).__name__
+            raise _request_error(e, self.name) from e
+        finally:
+            record("llm", start, **stats)
 
-    def _response(data, url):
-        try:
-            response = requests.post(url=url, json=data)
-            if response.status_code == 200:
-                response_text = response.json().get("response", "")
-                return response_text
-            else:
-                print("Error:", response.status_code, response.json())
-                return None
+    def complete(self, messages: list[dict], temperature: float = None) -> str:
+        data = self._data(messages, False, temperature)
+        session = get_session(self.endpoint)
+        token = current_token()
+        with span("llm", model=self.model_name, backend=self.name, stream=False) as llm_span:
+            try:
+                with _cancellable(session) as post:
+                    response = post(url=self.endpoint, json=data, timeout=_TIMEOUT)
+            except Exception as e:
+                if token is not None and token.cancelled:
+                    raise Cancelled("llm") from e
+                llm_span.set(error=type(e).__name__)
+                raise _request_error(e, self.name) from e
 
-        except Exception as e:
-            print(f"API call failed: {e}")
-            raise Exception
-        
-    if stream:
-        return _stream_response(data, url)
-    else:
-        return _response(data, url)
+            if response.status_code != 200:
+                llm_span.set(error=f"HTTP {response.status_code}")
+                raise _status_error(response, self.name)
+            body = response.json()
+            llm_span.set(
+                bytes=len(response.content), completion_tokens=body.get("eval_count"), **_ollama_stats(body)
+            )
+            return _ollama_content(body)
 
 
-def GPT_response(
-        messages: str, 
-        model_name: str, 
-        stream: bool = True, 
-        api_key: str = None
-    ) -> str:
+class OpenAIBackend(Backend):
     """
-    Fetch response from openai LLM model
-
-    Args:
-        messages (str): raw messages
-        model_name (str): name of the openai model
-        api_key (str): the api key to access openai model
-    Returns:
-        str: The openai LLM output.
+    An OpenAI model, with the API key of the `OPENAI_API_KEY` environment
+    variable or of the config file unless given.
     """
-    if api_key is None:
-        api_key = API_KEY
 
-    client = OpenAI(api_key=api_key)
+    kind = "openai"
+
+    def __init__(self, model_name: str, endpoint: str = None, api_key: str = None):
+        super().__init__(model_name, endpoint)
+        self.api_key = api_key
+
+    @classmethod
+    def server(cls, endpoint: str = None) -> None:
+        return None
 
-    def _stream_response(client, messages, model_name):
+    def _client(self) -> OpenAI:
+        api_key = self.api_key or os.getenv('OPENAI_API_KEY') or API_KEY
+        if api_key is None:
+            raise LLMRequestError('API key not found. Make sure to add your api key to the config file.', self.name)
+        return get_openai_client(api_key)
+
+    def stream(self, messages: list[dict], temperature: float = None) -> Iterator[str]:
+        client = self._client()
+        options = {} if temperature is None else {"temperature": temperature}
         print('Streaming')
+        start = time.perf_counter()
+        stats = {"model": self.model_name, "backend": self.name, "stream": True, "bytes": 0, "completion_tokens": 0}
+        token = current_token()
+        handle = None
         try:
             response = client.chat.completions.create(
-                model=model_name,
-                messages=messages,
+                model=self.model_name,
+                messages=list(messages),
                 stream=True,
+                **options,
             )
+            if token is not None:
+                # closing the stream drops its connection
+                handle = token.add_callback(response.close)
 
             for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+                if token is not None and token.cancelled:
+                    raise Cancelled("llm")
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    content = chunk.choices[0].delta.content
+                    if "ttft" not in stats:
+                        stats["ttft"] = time.perf_counter() - start
+                    # one content delta per generated token
+                    stats["completion_tokens"] += 1
+                    stats["bytes"] += len(content.encode("utf-8"))
+                    yield content
+            if token is not None and token.cancelled:
+                raise Cancelled("llm")
+        except Cancelled:
+            stats["error"] = "cancelled"
+            raise
         except Exception as e:
-            print(f"API call failed: {e}")
-            raise Exception
+            if token is not None and token.cancelled:
+                stats["error"] = "cancelled"
+                raise Cancelled("llm") from e
+            stats["error"] = type(e).__name__
+            raise _openai_error(e, self.name) from e
+        finally:
+            if handle is not None:
+                token.remove_callback(handle)
+            record("llm", start, **stats)
+
+    def complete(self, messages: list[dict], temperature: float = None) -> str:
+        client = self._client()
+        options = {} if temperature is None else {"temperature": temperature}
+        token = current_token()
+        with span("llm", model=self.model_name, backend=self.name, stream=False) as llm_span:
+            try:
+                result = client.chat.completions.create(
+                    model=self.model_name,
+                    messages=list(messages),
+                    stream=False,
+                    **options,
+                )
+            except Exception as e:
+                llm_span.set(error=type(e).__name__)
+                raise _openai_error(e, self.name) from e
+            content = result.choices[0].message.content
+            if result.usage is not None:
+                llm_span.set(
+                    prompt_tokens=result.usage.prompt_tokens,
+                    completion_tokens=result.usage.completion_tokens,
+                )
+            llm_span.set(bytes=len((content or "").encode("utf-8")))
+            if token is not None:
+                # the request cannot be interrupted, drop its response
+                token.raise_if_cancelled("llm")
+            return content
+
 
-    def _response(client, messages, model_name):
+class StubBackend(Backend):
+    """
+    A local model answering every prompt with `response`, for running the
+    application without an LLM server. Serves the `stub:<name>` models.
+    """
+
+    kind = "stub"
+    response = "```sql\nSELECT 1;\n```"
+    tokens_per_sec = 200.0
+
+    @classmethod
+    def server(cls, endpoint: str = None) -> None:
+        return None
+
+    def stream(self, messages: list[dict], temperature: float = None) -> Iterator[str]:
+        start = time.perf_counter()
+        stats = {"model": self.model_name, "backend": self.name, "stream": True, "completion_tokens": 0}
+        token = current_token()
         try:
-            result = client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                stream=stream,
-            )
-            return result.choices[0].message.content
+            for word in re.findall(r"\S*\s*", self.response):
+                if not word:
+                    continue
+                if token is not None:
+                    woken = threading.Event()
+                    with token.on_cancel(woken.set):
+                        woken.wait(1 / self.tokens_per_sec)
+                    token.raise_if_cancelled("llm")
+                else:
+                    time.sleep(1 / self.tokens_per_sec)
+                stats.setdefault("ttft", time.perf_counter() - start)
+                stats["completion_tokens"] += 1
+                yield word
+        except Cancelled:
+            stats["error"] = "cancelled"
+            raise
+        finally:
+            record("llm", start, **stats)
 
-        except Exception as e:
-            print(f"API call failed: {e}")
-            raise Exception
-    
+    def complete(self, messages: list[dict], temperature: float = None) -> str:
+        return "".join(self.stream(messages, temperature))
+
+
+register_backend(OllamaBackend, lambda model_name: True)
+register_backend(OpenAIBackend, lambda model_name: model_name[:3].lower() == 'gpt')
+register_backend(StubBackend, lambda model_name: model_name.startswith("stub:"))
+
+
+def LLM_response(
+        messages: list[dict], 
+        model_name: str, 
+        stream: bool = True, 
+        url: str = OLLAMA_URL,
+        temperature: float = None,
+        fallbacks: list[str] = None
+    ) -> Iterator[str] | str:
+    """
+    Fetch responses from LLM
+
+    Requests failing with a timeout or an unavailable server are retried with
+    backoff, then sent to the fallback models, see `llm_backends.stream`.
+
+    Args:
+        messages (list[dict]): list of message dictionaries following ChatCompletion format
+        model_name (str): name of the LLM model
+        url (str): endpoint where LLM is hosted, for Ollama models
+        temperature (float): sampling temperature, the model's default if None
+        fallbacks (list[str]): models to fail over to, `model` or `model@url`, the `fallback_models` setting if None
+    Returns:
+        str: The LLM output, or an iterator over its chunks if streamed.
+
+    Raises:
+        LLMError: if every backend failed
+    """
+    messages = list(messages)
     if stream:
-        return _stream_response(client, messages, model_name)
-    else:
-        return _response(client, messages, model_name)
+        return llm_backends.stream(messages, model_name, url, temperature, fallbacks)
+    return llm_backends.complete(messages, model_name, url, temperature, fallbacks)
+
+
+def GPT_response(
+        messages: str, 
+        model_name: str, 
+        stream: bool = True, 
+        api_key: str = None,
+        temperature: float = None
+    ) -> str:
+    """
+    Fetch response from openai LLM model, without retries nor failover
 
+    Args:
+        messages (str): raw messages
+        model_name (str): name of the openai model
+        api_key (str): the api key to access openai model, the configured one if None
+        temperature (float): sampling temperature, the model's default if None
+    Returns:
+        str: The openai LLM output.
+    """
+    backend = get_backend(model_name) if api_key is None else OpenAIBackend(model_name, api_key=api_key)
+    if stream:
+        return backend.stream(messages, temperature)
+    return backend.complete(messages, temperature)
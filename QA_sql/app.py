@@ -1,18 +1,67 @@
 import tkinter as tk
 from tkinter import messagebox
-import re
-import time
-import copy
 
 # local files
-from LLM import LLM_response
-from prompt import *
+from LLM import close_clients
 from db_utils import *
-from utils import MAX_RETRY
+from db_pool import close_pools
+from metrics import trace
+from cancellation import CancelToken, Cancelled, cancellation
+from pipeline import QAPipeline, Conversation, PipelineObserver, extract_sql
+from worker import BackgroundWorker
+from stream_renderer import StreamRenderer
+from utils import DISPLAY_ROWS, PAGE_SIZE
+
+SEPARATOR = "\n\n--------------------------------------------------------------------------------------------------\n"
+
+
+class _AppObserver(PipelineObserver):
+    """
+    Displays the progress of the pipeline, called from the worker threads.
+    """
+
+    def __init__(self, app: "App"):
+        self.app = app
+
+    def _header(self, question: str) -> str:
+        separator = SEPARATOR if self.app.conversation.num_conversation > 0 else ""
+        return f"{separator}User Question: {question}\n\n"
+
+    def status(self, text: str):
+        self.app.worker.call_soon(self.app.set_status, text)
+
+    def answered_without_sql(self, question: str, response: str):
+        self.app.response_stream.write(f"{self._header(question)}Answer: {response}")
+
+    def sql_generated(self, question: str, sql_statement: str):
+        self.app.response_stream.write(
+            f"{self._header(question)}Generated SQL queries: \n```\n{sql_statement}\n```"
+        )
+        self.app.worker.call_soon(self.app.show_sql, sql_statement)
+
+    def result(self, rows, col_header, row_count, truncated, cache_age):
+        self.app.worker.call_soon(self.app.show_result, rows, col_header, row_count, truncated, cache_age)
+
+    def answer_started(self):
+        self.app.response_stream.write("\n\nAnswer: ")
+        self.app.response_stream.begin()
+
+    def token(self, chunk: str):
+        self.app.response_stream.write(chunk, token=True)
+
+    def answer_finished(self):
+        self.app.response_stream.end()
+
+    def error(self, title: str, message: str):
+        self.app.worker.call_soon(self.app.show_error, title, message)
+
+    def confirm(self, title: str, message: str) -> bool:
+        return self.app.worker.run_on_main(messagebox.askokcancel, title, message)
+
 
 class App:
 
-    def __init__(self, model_name, db_name):
+    def __init__(self, model_name, db_name, refresh_schema=False):
         '''UI Initialization'''
         self.root = tk.Tk()
         self.root.title("SQL Q&A Tool")
@@ -20,6 +69,8 @@ class App:
         self.root.configure(bg="#f5f5f5")
         icon = tk.PhotoImage(file="assets/icon.png")
         self.root.iconphoto(False, icon)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.worker = BackgroundWorker(self.root)
 
         # Description
         description_label = tk.Label(
@@ -49,6 +100,7 @@ class App:
         self.response_box = tk.Text(left_frame, wrap=tk.WORD, height=20, width=58, font=("Helvetica", 14))
         self.response_box.pack(fill=tk.BOTH)
         self.response_box.config(state=tk.DISABLED)
+        self.response_stream = StreamRenderer(self.root, self.response_box)
 
         tk.Label(left_frame, text="Enter Your Question:", font=("Helvetica", 14), bg="#f5f5f5").pack(anchor="nw")
         self.question_entry = tk.Text(left_frame, wrap=tk.WORD, height=5, width=58, font=("Helvetica", 14))
@@ -73,296 +125,410 @@ class App:
 
         self.extract_execute_button = tk.Button(left_frame, text="Extract & Execute SQL", font=("Helvetica", 14), bg="#4CAF50", command=self.extract_and_execute_sql_button)
 
-        execute_button = tk.Button(right_frame, text="Execute SQL Statement", font=("Helvetica", 14), bg="#2196F3", command=self.execute_sql_button)
-        execute_button.place(x=5, y=480)
+        self.execute_button = tk.Button(right_frame, text="Execute SQL Statement", font=("Helvetica", 14), bg="#2196F3", command=self.execute_sql_button)
+        self.execute_button.place(x=5, y=480)
+
+        self.prev_page_button = tk.Button(right_frame, text="<", font=("Helvetica", 14), command=lambda: self.show_result_page(self.result_page - 1))
+        self.next_page_button = tk.Button(right_frame, text=">", font=("Helvetica", 14), command=lambda: self.show_result_page(self.result_page + 1))
 
         self.open_session_button = tk.Button(left_frame, text="Open New Session", font=("Helvetica", 14), bg="#2196F3", command=self.open_new_session)
 
+        # shown while questions or SQL statements are running
+        self.stop_button = tk.Button(left_frame, text="Cancel", font=("Helvetica", 14), bg="#f44336", command=self.cancel_button)
+
         '''Variable initialization'''
         self.db_name = db_name
         self.model_name = model_name
 
-        # save the first question and user prompt 
-        self.question = None
-        self.response = None
-        self.num_conservation = 0
-        self.history = None
-
-        self.SCHEMA_PROMPT = f"\nThis query will run on a database whose schema is represented as:\n\n{get_schema_info(self.db_name)}"
+        # schema, caches and the question answering stages, shared with the batch mode,
+        # built on the pipeline worker since loading the schema may introspect the whole database
+        self.pipeline = None
+        self.observer = _AppObserver(self)
+        # current conversation, only touched by the serial pipeline worker
+        self.conversation = Conversation()
+
+        # displayed query result, paged in the SQL result box
+        self.result_rows = []
+        self.result_header = []
+        self.result_count = 0
+        self.result_truncated = False
+        self.result_cache_age = None
+        self.result_page = 0
+
+        # cancellation tokens of the running and queued jobs, only touched on the main thread
+        self.cancel_tokens = set()
+
+        # the buttons using the pipeline are enabled once it is built
+        self.pipeline_buttons = (self.generate_button, self.answer_button, self.execute_button)
+        for button in self.pipeline_buttons:
+            button.config(state=tk.DISABLED)
+        self.set_status("loading the database schema...")
+        self.worker.submit(
+            QAPipeline, model_name, db_name, refresh_schema=refresh_schema, serial=True,
+            on_done=self.pipeline_ready,
+            on_error=self.pipeline_failed
+        )
 
 
     def run(self):
         self.root.mainloop()
 
 
+    def pipeline_ready(self, pipeline: QAPipeline):
+        """
+        Enable the questions once the pipeline is built. Must be called on the main thread.
+        """
+        self.pipeline = pipeline
+        for button in self.pipeline_buttons:
+            button.config(state=tk.NORMAL)
+        self.set_status()
+
+
+    def pipeline_failed(self, e: Exception):
+        """
+        Report a pipeline that could not be built, the buttons using it stay disabled.
+        Must be called on the main thread.
+        """
+        self.set_status("no database schema")
+        self.show_error("Error", f"Failed to load the schema of {self.db_name}.\n{e}")
+
+
+    def close(self):
+        """
+        Close the window, stop the background workers and release the pooled database connections.
+        """
+        for token in list(self.cancel_tokens):
+            token.cancel()
+        self.worker.shutdown()
+        self.response_stream.close()
+        close_pools()
+        close_clients()
+        if self.pipeline is not None:
+            self.pipeline.close()
+        self.root.destroy()
+
+
+    def set_status(self, text: str = ""):
+        """
+        Update the status bar, showing how many questions are still queued.
+        Must be called on the main thread.
+        """
+        queued = self.worker.pending - 1
+        if text and queued > 0:
+            text += f" ({queued} more queued)"
+        self.status_label.config(text=f"Status: {text}")
+
+
+    def show_error(self, title: str, message: str):
+        """
+        Reset the status bar and show an error dialog. Must be called on the main thread.
+        """
+        self.set_status()
+        messagebox.showerror(title, message)
+
+
+    def submit_cancellable(
+            self, fn, *args, serial: bool = False, on_done=None, on_error=None
+        ):
+        """
+        Run a job on the background worker that the Cancel button can stop:
+        its LLM streams are closed and its SQL statements cancelled on the server.
+        """
+        token = CancelToken()
+        self.cancel_tokens.add(token)
+        self.stop_button.place(x=420, y=480)
+
+        def _run():
+            with cancellation(token):
+                try:
+                    return fn(*args)
+                except Cancelled as e:
+                    token.stopped(e.stage)
+
+        def _finished() -> bool:
+            self.cancel_tokens.discard(token)
+            if not self.cancel_tokens:
+                self.stop_button.place_forget()
+            if token.cancelled:
+                self.set_status("cancelled")
+            return not token.cancelled
+
+        def _done(result):
+            if _finished() and on_done is not None:
+                on_done(result)
+
+        def _error(error: BaseException):
+            _finished()
+            if on_error is not None:
+                on_error(error)
+            else:
+                print(f"Background job failed: {error!r}")
+
+        self.worker.submit(_run, serial=serial, on_done=_done, on_error=_error)
+
+
+    def cancel_button(self):
+        """
+        Function to stop the running and queued questions and SQL statements.
+        """
+        for token in list(self.cancel_tokens):
+            token.cancel()
+        self.set_status("cancelling...")
+
+
     def generate_response_button(self):
         """
         Function to send the question to the LLM and display the SQL response.
         """
-        self.question = self.question_entry.get("1.0", tk.END).strip()
+        question = self.question_entry.get("1.0", tk.END).strip()
 
-        if not self.question:
+        if not question:
             messagebox.showwarning("Input Error", "Please enter a question.")
             return
 
-        try:
-            # disable button while generating response
-            self.extract_execute_button.place_forget()
-            self.status_label.config(text="Status: generating response...")
+        # disable button while generating response
+        self.extract_execute_button.place_forget()
+        self.question_entry.delete("1.0", tk.END)
+        self.submit_cancellable(
+            self._generate_response, question, serial=True,
+            on_error=lambda e: self.show_error("Error", f"API call error, failed to connect to LLM.\n{e}")
+        )
+        self.set_status("question queued...")
 
-            new_history = SQL_question_message(
-                self.question, history=self.history, model_name=self.model_name
-            )
 
-            # append schema info
-            prompt = copy.deepcopy(new_history)
-            prompt[-1]['content'] += self.SCHEMA_PROMPT
-
-            self.response_box.config(state=tk.NORMAL)   # Make the box editable
-            if self.num_conservation > 0:
-                self.response_box.insert(tk.END, "\n\n--------------------------------------------------------------------------------------------------\n")
-            self.response_box.insert(tk.END, f"User Question: {self.question}\n\nAnswer: ")
-            self.response_box.yview(tk.END)
-            self.response_box.update()
-
-            LLM_answer = []
-            # LLM streaming response
-            for chunk in LLM_response(prompt, self.model_name, stream=True):
-                self.response_box.insert(tk.END, chunk) 
-                self.response_box.yview(tk.END) 
-                self.response_box.update()
+    def _generate_response(self, question: str):
+        """
+        Worker side of `generate_response_button`.
+
+        Chunks are buffered and drawn at a bounded rate by the response box renderer.
+        """
+        with trace("generate_response", model=self.model_name, db=self.db_name) as response_trace:
+            self._stream_sql_response(question)
+        self.worker.call_soon(self._response_generated, self.conversation.num_conversation <= 1, response_trace.summary())
+
+
+    def _stream_sql_response(self, question: str):
+        self.worker.call_soon(self.set_status, "generating response...")
+        conversation = self.conversation
+
+        new_history, _ = self.pipeline.sql_prompt(question, conversation)
+
+        header = SEPARATOR if conversation.num_conversation > 0 else ""
+        header += f"User Question: {question}\n\nAnswer: "
+        self.response_stream.write(header)
+
+        LLM_answer = []
+        self.response_stream.begin()
+        try:
+            for chunk in self.pipeline.llm(new_history, stream=True):
+                self.response_stream.write(chunk, token=True)
                 LLM_answer.append(chunk)
-            self.response_box.config(state=tk.DISABLED)  # Disable editing
-            self.response = "".join(LLM_answer)
+        finally:
+            self.response_stream.end()
 
-            # update history
-            self.history = new_history
-            self.history.append({"role": "assistant", "content": self.response})
+        # update history
+        conversation.question = question
+        conversation.response = "".join(LLM_answer)
+        conversation.history = new_history
+        conversation.history.append({"role": "assistant", "content": conversation.response})
 
-            # make extract sql button available
-            self.extract_execute_button.place(x=200, y=480)
-            self.status_label.config(text="Status: ")
+        conversation.num_conversation += 1
 
-            self.num_conservation += 1
 
-            if self.num_conservation <= 1:
-                self.answer_button.place_forget()
-                self.open_session_button.place(x=200, y=510)
+    def _response_generated(self, first_conversation: bool, timings: str):
+        # make extract sql button available
+        self.extract_execute_button.place(x=200, y=480)
+        self.set_status(timings)
 
-        except Exception as e:
-            self.status_label.config(text="Status: ")
-            messagebox.showerror("Error", f"API call error, failed to connect to LLM.\n{e}")
+        if first_conversation:
+            self.answer_button.place_forget()
+            self.open_session_button.place(x=200, y=510)
 
 
-    def execute_sql_button(self, return_result: bool = False):
+    def execute_sql_button(self):
         """
-        Function to execute the sql statement. 
-
-        Args:
-            return_result (bool): whether return the query result or not
-        
-        Returns:
-            str: the query result if return_result is True
+        Function to execute the sql statement.
         """
         sql_statement = self.sql_entry_box.get("1.0", tk.END).strip()  # Get text from the Text widget
         if not sql_statement:
             messagebox.showwarning("Input Error", "Please enter a SQL statement.")
             return
 
-        try:
-            keyword = detect_keyword(sql_statement)
+        keyword = detect_keyword(sql_statement)
+
+        # if detected keyword, show warning
+        if keyword is not None:
+            result = messagebox.askokcancel(
+                "Confirmation",
+                f"The query is attempted to perform '{keyword}' statement. Would you like to proceed?"
+            )
+            if not result:
+                return
 
-            # if detected keyword, show warning
-            if keyword is not None:
-                result = messagebox.askokcancel(
-                    "Confirmation", 
-                    f"The query is attempted to perform '{keyword}' statement. Would you like to proceed?"
-                )
-                if not result:
-                    return
+        self.set_status("executing SQL queries...")
+        self.submit_cancellable(
+            self._execute_sql, sql_statement,
+            on_done=lambda _: self.set_status(),
+            on_error=lambda e: self.show_error("Error", f"Failed to execute the SQL statement.\n{e}")
+        )
 
-            self.status_label.config(text="Status: executing SQL queries...")
 
-            query_result, col_header = execute_sql(sql_statement, self.db_name)
-            table = format_output(query_result, col_header)
+    def _execute_sql(self, sql_statement: str):
+        """
+        Execute a SQL statement on a worker thread and display the result.
 
-            self.sql_result_box.config(state=tk.NORMAL) 
-            self.sql_result_box.delete("1.0", tk.END) 
-            self.sql_result_box.insert(tk.END, table)
-            self.sql_result_box.config(state=tk.DISABLED) 
+        Only the first rows of the result are kept in memory and displayed,
+        the rest is streamed from the database and counted.
+        """
+        query_result, col_header, row_count, truncated, cache_age, _ = self.pipeline.execute(sql_statement)
+        self.worker.call_soon(
+            self.show_result, query_result[:DISPLAY_ROWS], col_header, row_count, truncated, cache_age
+        )
 
-            self.status_label.config(text="Status: ")
 
-            if return_result:
-                return query_result
+    def show_result(
+            self, rows: list[Tuple], col_header: list[str], row_count: int, truncated: bool, cache_age: float = None
+        ):
+        """
+        Display a query result in the SQL result box. Must be called on the main thread.
 
-        except Exception as e:
-            self.status_label.config(text="Status: ")
-            messagebox.showerror("Error", f"Failed to execute the SQL statement.\n{e}")
+        Args:
+            cache_age (float): age in seconds of the result if it was served from the cache
+        """
+        self.result_rows = rows
+        self.result_header = col_header
+        self.result_count = row_count
+        self.result_truncated = truncated
+        self.result_cache_age = cache_age
+        self.show_result_page(0)
 
 
-    def extract_and_execute_sql_button(self, extracted_sql: str = None):
+    def show_result_page(self, page: int):
         """
-        Function to extract the sql statement from LLM response. 
+        Render one page of the current query result into the SQL result box.
 
         Args:
-            extracted_sql (str): the extracted SQL statement from LLM response
+            page (int): zero-based page number, clamped to the available pages
         """
-        try:
-            self.status_label.config(text="Status: Extracting and executing SQL queries...")
-            self.status_label.update()
+        num_pages = max(1, -(-len(self.result_rows) // PAGE_SIZE))
+        self.result_page = min(max(page, 0), num_pages - 1)
 
-            if extracted_sql is None:
+        table = render_page(
+            self.result_rows, self.result_header, self.result_page, PAGE_SIZE, total_rows=self.result_count
+        )
+        if self.result_truncated:
+            table += " (truncated at the row limit)"
+        if self.result_cache_age is not None:
+            table += f"\n\nServed from cache, {self.result_cache_age:.0f}s old."
 
-                sql_query = re.search(r"```sql(.*?)```", self.response, re.DOTALL)
+        self.sql_result_box.config(state=tk.NORMAL)
+        self.sql_result_box.delete("1.0", tk.END)
+        self.sql_result_box.insert(tk.END, table)
+        self.sql_result_box.config(state=tk.DISABLED)
 
-                if sql_query:
-                    extracted_sql = sql_query.group(1).strip()
-                else:
-                    raise Exception
-            
-            # execute extracted SQL statements and retrieve the results
-            self.sql_entry_box.delete("1.0", tk.END)
-            self.sql_entry_box.insert(tk.END, extracted_sql)
-            self.sql_entry_box.update()
-            time.sleep(1)
-            query_result = self.execute_sql_button(return_result=True)
-
-            # add history method if not first time conservation
-            #if self.num_conservation > 0:
-            new_history = question_answer_message(
-                self.question, extracted_sql, query_result, history=self.history, model_name=self.model_name
-            )
-            prompt = copy.deepcopy(new_history)
-            prompt[0] = {"role": "system", "content": "You are a helpful assistant for answering user questions."} # update system prompt
-            #else:
-            #    prompt = question_answer_message(
-            #        self.question, extracted_sql, query_result
-            #    )
-            
-            self.status_label.config(text="Status: generating answers...")
-            self.status_label.update()
-
-            # continue answering user's question
-            self.response_box.config(state=tk.NORMAL)
-            self.response_box.insert(tk.END, "\n\nAnswer: ")
-
-            LLM_answer = []
-            # LLM streaming response
-            for chunk in LLM_response(prompt, self.model_name, stream=True):
-                self.response_box.insert(tk.END, chunk)
-                self.response_box.yview(tk.END) 
-                self.response_box.update()
-                LLM_answer.append(chunk)
-            self.response_box.config(state=tk.DISABLED)
+        if num_pages > 1:
+            self.prev_page_button.place(x=250, y=480)
+            self.next_page_button.place(x=290, y=480)
+        else:
+            self.prev_page_button.place_forget()
+            self.next_page_button.place_forget()
 
-            # update history
-            #self.history.append(prompt[-1])     # retrieve the user question
-            self.history.append({"role": "assistant", "content": "".join(LLM_answer)})
 
-            self.extract_execute_button.place_forget()
-            self.status_label.config(text="Status: ")
+    def show_sql(self, sql_statement: str):
+        """
+        Put a SQL statement into the SQL entry box. Must be called on the main thread.
+        """
+        self.sql_entry_box.delete("1.0", tk.END)
+        self.sql_entry_box.insert(tk.END, sql_statement)
 
-            self.num_conservation += 1
 
-        except Exception as e:
-            self.status_label.config(text="Status: ")
-            messagebox.showerror("Error", f"Failed to extract and execute SQL statement.\n{e}")
+    def extract_and_execute_sql_button(self):
+        """
+        Function to extract the sql statement from LLM response.
+        """
+        self.extract_execute_button.place_forget()
+        self.submit_cancellable(self._extract_and_execute_sql, serial=True)
+        self.set_status("question queued...")
+
+
+    def _extract_and_execute_sql(self) -> bool:
+        """
+        Worker side of `extract_and_execute_sql_button`: extract the sql statement
+        from LLM response, execute it and answer the user's question.
+
+        Returns:
+            bool: whether the SQL statement was executed and the question answered
+        """
+        extracted_sql = extract_sql(self.conversation.response)
+        if extracted_sql is None:
+            self.observer.error("Error", "Failed to extract and execute SQL statement.\nNo SQL query found in the response.")
+            return False
+
+        keyword = detect_keyword(extracted_sql)
+
+        # if detected keyword, ask the user before executing
+        if keyword is not None:
+            proceed = self.worker.run_on_main(
+                messagebox.askokcancel,
+                "Confirmation",
+                f"The query is attempted to perform '{keyword}' statement. Would you like to proceed?"
+            )
+            if not proceed:
+                self.worker.call_soon(self.set_status)
+                return False
+
+        verdict = self.pipeline.guard(extracted_sql, self.observer)
+        if verdict.action == "reject":
+            self.observer.error("Error", f"The SQL statement was not executed, {verdict.reason}.")
+            return False
+        extracted_sql = verdict.sql
+
+        # execute extracted SQL statements and answer the user's question
+        self.worker.call_soon(self.show_sql, extracted_sql)
+        with trace("extract_and_execute", model=self.model_name, db=self.db_name) as execute_trace:
+            succeeded = self.pipeline.execute_and_answer(extracted_sql, self.conversation, self.observer)
+        if succeeded:
+            self.worker.call_soon(self.set_status, execute_trace.summary())
+        return succeeded
+
 
-    
     def generate_answer_button(self):
         """
-        Function to automatically generate resposen, extract sql statement, and answer the user's question.  
+        Function to automatically generate resposen, extract sql statement, and answer the user's question.
 
         LLM response -> extract SQL -> execute SQL -> display result -> answer question
 
-        The agent is capable to regenerate response with feedback if exception arises
+        Questions are answered on a background worker, a question asked while the
+        previous one is still running is queued behind it.
         """
-        current_retry = 1
-        feedback = None     # LLM feedback prompt
-
-        self.question = self.question_entry.get("1.0", tk.END).strip()
-        if not self.question:
+        question = self.question_entry.get("1.0", tk.END).strip()
+        if not question:
             messagebox.showwarning("Input Error", "Please enter a question.")
             return
 
-        # LLM regenerate response
-        while (current_retry <= MAX_RETRY):
-            # ---generate response---
-            try:
-                self.status_label.config(text="Status: generating SQL queries...")
-                self.status_label.update()
-
-                new_history = SQL_question_message(
-                    self.question, history=self.history, model_name=self.model_name
-                )
-
-                # append schema info
-                prompt = copy.deepcopy(new_history)
-                prompt[-1]['content'] += self.SCHEMA_PROMPT
-                self.response = LLM_response(prompt, self.model_name, stream=False)
-                feedback = None
-
-            except Exception as e:
-                self.status_label.config(text="Status: ")
-                messagebox.showerror("Error", f"API call error, failed to connect to LLM.\n{e}")
-                break
-            
-            try:
-                self.response_box.config(state=tk.NORMAL)
-                if self.num_conservation > 0:
-                    self.response_box.insert(tk.END, "\n\n--------------------------------------------------------------------------------------------------\n")
-                
-                # ---extract SQL---
-                sql_query = re.search(r"```sql(.*?)```", self.response, re.DOTALL)
-
-                if sql_query:
-                    extracted_sql = sql_query.group(1).strip()
-                else: # in case where answering the question does not require SQL query
-                    self.response_box.insert(tk.END, f"User Question: {self.question}\n\nAnswer: {self.response}")
-                    self.response_box.yview(tk.END) 
-                    self.response_box.update()
-                    self.response_box.config(state=tk.DISABLED)
-                    self.status_label.config(text="Status: ")
-                    self.history = new_history
-                    self.history.append({"role": "assistant", "content": self.response})
-                    break
-                
-                # ---keyword detection---
-                keyword = detect_keyword(extracted_sql)
-
-                # raise exception if sql statement tries to do something other than query
-                if keyword is not None:
-                    feedback = f"""
-    The generated SQL query is attempted to perform '{keyword}' statement. 
-    Please ensure that queries are limited to SELECT query statements only."""
-                    raise Exception
-                
-                self.response_box.insert(tk.END, f"User Question: {self.question}\n\nGenerated SQL queries: \n```\n{extracted_sql}\n```")
-                self.response_box.yview(tk.END) 
-                self.response_box.update()
-                self.response_box.config(state=tk.DISABLED)
-                
-                # Update history
-                self.history = new_history
-                self.history.append({"role": "assistant", "content": extracted_sql})
-
-                self.extract_and_execute_sql_button(extracted_sql=extracted_sql)
-                #if self.num_conservation 
-                if self.num_conservation <= 1:
-                    self.generate_button.place_forget()
-                    self.open_session_button.place(x=200, y=510)
-
-                break
-
-            except Exception as e:
-                self.status_label.config(text=f"Status: generation failed for error {e}, retrying...")
-                self.status_label.update()
-                if feedback is None:
-                    feedback = f"Generation failed for error: {e}."
-                time.sleep(2)
-                current_retry += 1
-                continue
+        self.question_entry.delete("1.0", tk.END)
+        self.submit_cancellable(self._generate_answer, question, serial=True)
+        self.set_status("question queued...")
+
+
+    def _generate_answer(self, question: str):
+        """
+        Worker side of `generate_answer_button`.
+
+        The agent is capable to regenerate response with feedback if exception arises
+        """
+        result = self.pipeline.ask(question, self.conversation, self.observer)
+        if result["error"] is None:
+            # where the time went, e.g. "llm 1.84s (ttft 0.21s, 312 tokens) · sql 0.04s (1,234 rows)"
+            self.worker.call_soon(self.set_status, result["trace"])
+
+        if result["sql"] is not None and self.conversation.num_conversation <= 1:
+            self.worker.call_soon(self._answer_generated)
+
+
+    def _answer_generated(self):
+        self.generate_button.place_forget()
+        self.open_session_button.place(x=200, y=510)
 
 
     def open_new_session(self):
@@ -370,20 +536,24 @@ class App:
         Function to open a new conservation session
         """
         # Clear previous content
-        self.response_box.config(state=tk.NORMAL)
-        self.response_box.delete("1.0", tk.END)
-        self.response_box.config(state=tk.DISABLED)
+        self.response_stream.clear()
         self.sql_result_box.config(state=tk.NORMAL)
         self.sql_result_box.delete("1.0", tk.END)
         self.sql_result_box.config(state=tk.DISABLED)
+        self.prev_page_button.place_forget()
+        self.next_page_button.place_forget()
+        self.result_rows = []
         self.question_entry.delete("1.0", tk.END)
         self.sql_entry_box.delete("1.0", tk.END)
-        
+
         self.generate_button.place(x=5, y=480)
         self.answer_button.place(x=5, y=510)
         self.open_session_button.place_forget()
         self.extract_execute_button.place_forget()
 
-        self.history = None
-        self.num_conservation = 0
+        # conversation state belongs to the pipeline worker, reset it after the queued questions
+        self.worker.submit(self._reset_conversation, serial=True)
+
 
+    def _reset_conversation(self):
+        self.conversation = Conversation()
@@ -0,0 +1,130 @@
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# local files
+from LLM import close_clients
+from db_pool import close_pools
+from pipeline import QAPipeline
+from utils import BATCH_WORKERS
+
+STAGES = ("generate_sql", "execute", "answer", "total")
+
+
+def read_questions(path: str) -> list[dict]:
+    """
+    Read the questions of a JSONL file.
+
+    Every line is either a JSON object with a `question` key (other keys, e.g. an
+    `id`, are copied to the output) or a JSON string. Blank lines are skipped.
+
+    Returns:
+        list[dict]: one record per question
+    """
+    records = []
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"question": record}
+            if not isinstance(record, dict) or not record.get("question"):
+                raise ValueError(f"{path}:{line_number}: expected a question, got {line}")
+            records.append(record)
+    return records
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def summarize(results: list[dict], elapsed: float) -> dict:
+    """
+    Summarize a batch run: number of answered and failed questions, throughput
+    and p50/p95 latency of every stage in seconds.
+    """
+    summary = {
+        "questions": len(results),
+        "failed": sum(result["error"] is not None for result in results),
+        "elapsed": elapsed,
+        "questions_per_sec": len(results) / elapsed if elapsed else 0.0,
+    }
+    for stage in STAGES:
+        samples = [result["timings"][stage] for result in results if stage in result["timings"]]
+        if samples:
+            summary[stage] = {"p50": statistics.median(samples), "p95": _percentile(samples, 0.95)}
+    return summary
+
+
+def run_batch(
+        model_name: str,
+        db_name: str,
+        input_path: str,
+        output_path: str = None,
+        workers: int = BATCH_WORKERS,
+        refresh_schema: bool = False,
+        pipeline: QAPipeline = None
+    ) -> dict:
+    """
+    Answer every question of a JSONL file without a display.
+
+    Questions are answered concurrently by `workers` threads, each as a
+    standalone conversation, while the pipeline keeps the requests sent to
+    each LLM backend and to the database within their concurrency limits.
+    The results are written in the order of the questions.
+
+    Args:
+        model_name (str): the LLM model generating SQL and answers
+        db_name (str): the database to query
+        input_path (str): the JSONL file of questions
+        output_path (str): the JSONL file of results, defaults to `<input>_answers.jsonl`
+        workers (int): number of questions answered concurrently
+        refresh_schema (bool): ignore the cached database schema
+        pipeline (QAPipeline): an existing pipeline to use instead of creating one
+
+    Returns:
+        dict: the run summary, see `summarize`
+    """
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + "_answers.jsonl"
+    records = read_questions(input_path)
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = QAPipeline(model_name, db_name, refresh_schema=refresh_schema)
+
+    def _answer(record: dict) -> dict:
+        try:
+            result = pipeline.ask(record["question"])
+        except Exception as e:
+            result = {"question": record["question"], "error": str(e), "timings": {}}
+        return {**record, **result}
+
+    results = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="qa-batch") as executor, \
+                open(output_path, "w", encoding="utf-8") as output:
+            for result in executor.map(_answer, records):
+                output.write(json.dumps(result, default=str) + "\n")
+                output.flush()
+                results.append(result)
+                status = "failed: " + result["error"] if result["error"] else "answered"
+                print(f"[{len(results)}/{len(records)}] {status}: {result['question']}")
+    finally:
+        if own_pipeline:
+            pipeline.close()
+            close_pools()
+            close_clients()
+
+    summary = summarize(results, time.perf_counter() - start)
+    print(f"{summary['questions']} questions, {summary['failed']} failed, "
+          f"{summary['questions_per_sec']:.2f} questions/s, results written to {output_path}")
+    for stage in STAGES:
+        if stage in summary:
+            print(f"  {stage:<13} p50 {summary[stage]['p50'] * 1000:9.1f} ms   p95 {summary[stage]['p95'] * 1000:9.1f} ms")
+    return summary
@@ -0,0 +1,136 @@
+import contextvars
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from metrics import record
+
+_current_token = contextvars.ContextVar("qa_sql_cancel_token", default=None)
+
+
+class Cancelled(BaseException):
+    """
+    Raised by work stopped because its cancellation token was cancelled.
+
+    Like `asyncio.CancelledError` it is not an `Exception`, so the error
+    handlers of the pipeline stages let it through to the caller.
+
+    Attributes:
+        stage (str): the stage that was interrupted, e.g. `llm` or `sql`
+    """
+
+    def __init__(self, stage: str = None):
+        super().__init__(f"cancelled during {stage}" if stage else "cancelled")
+        self.stage = stage
+
+
+class CancelToken:
+    """
+    Cancellation of one question, shared by the threads working on it.
+
+    Work checks `cancelled` between steps, and registers callbacks that
+    interrupt blocking I/O (shutting down an HTTP stream, cancelling a
+    running query) while it waits. Cancelling runs the callbacks on the
+    calling thread, e.g. the UI thread.
+
+        token = CancelToken()
+        with cancellation(token):
+            ...                     # on another thread: token.cancel()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._ids = itertools.count()
+        self.cancelled_at = None    # time.perf_counter() of the cancel request
+        self._recorded = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancelled_at is not None
+
+    def cancel(self):
+        """Request cancellation and interrupt the registered blocking operations."""
+        with self._lock:
+            if self.cancelled_at is not None:
+                return
+            self.cancelled_at = time.perf_counter()
+            callbacks = list(self._callbacks.values())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e!r}")
+
+    def raise_if_cancelled(self, stage: str = None):
+        if self.cancelled_at is not None:
+            raise Cancelled(stage)
+
+    def add_callback(self, callback: Callable[[], None]) -> int:
+        """
+        Call `callback` when the token is cancelled, right away if it already is.
+
+        Returns:
+            int: a handle for `remove_callback`
+        """
+        with self._lock:
+            handle = next(self._ids)
+            if self.cancelled_at is None:
+                self._callbacks[handle] = callback
+                return handle
+        callback()
+        return handle
+
+    def remove_callback(self, handle: int):
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """Register `callback` for the duration of a `with` block."""
+        handle = self.add_callback(callback)
+        try:
+            yield
+        finally:
+            self.remove_callback(handle)
+
+    def stopped(self, stage: str = None):
+        """
+        Record the cancellation latency, from the cancel request until the
+        work stopped, as a `cancel` span. Only the first call records.
+        """
+        with self._lock:
+            if self.cancelled_at is None or self._recorded:
+                return
+            self._recorded = True
+        record("cancel", self.cancelled_at, stage=stage)
+
+
+def current_token() -> CancelToken | None:
+    """The cancellation token of the current thread (or task), None if the work cannot be cancelled."""
+    return _current_token.get()
+
+
+def raise_if_cancelled(stage: str = None):
+    """Raise `Cancelled` if the current token was cancelled."""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled(stage)
+
+
+@contextmanager
+def cancellation(token: CancelToken | None) -> Iterator[CancelToken | None]:
+    """
+    Make `token` the cancellation token of the work done in the `with` block.
+    Work done in threads started from the block only sees it if they run in a copy of the context.
+    """
+    if token is None:
+        yield None
+        return
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
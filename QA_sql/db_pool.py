@@ -0,0 +1,315 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+import psycopg2
+from psycopg2.extensions import connection, TRANSACTION_STATUS_IDLE
+
+from utils import (
+    DB_HOST, DB_USER, DB_PASSWORD, DB_PORT, DB_STATEMENT_TIMEOUT_MS,
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_CHECKOUT_TIMEOUT,
+    POOL_IDLE_TIMEOUT, POOL_HEALTH_CHECK_INTERVAL,
+)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of PostgreSQL connections for a single database.
+
+    Connections are created lazily up to `max_size`, handed out most recently
+    used first, health-checked when they have been idle for a while, and
+    closed again once they stay idle longer than `idle_timeout` (never going
+    below `min_size`). Every connection runs its statements under the
+    `statement_timeout` (in milliseconds, 0 for none).
+    """
+
+    def __init__(
+            self,
+            database: str,
+            host: str = DB_HOST,
+            user: str = DB_USER,
+            password: str = DB_PASSWORD,
+            port: int = DB_PORT,
+            min_size: int = POOL_MIN_SIZE,
+            max_size: int = POOL_MAX_SIZE,
+            checkout_timeout: float = POOL_CHECKOUT_TIMEOUT,
+            idle_timeout: float = POOL_IDLE_TIMEOUT,
+            health_check_interval: float = POOL_HEALTH_CHECK_INTERVAL,
+            statement_timeout: int = DB_STATEMENT_TIMEOUT_MS,
+        ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+
+        self.database = database
+        self._connect_kwargs = dict(
+            host=host, database=database, user=user, password=password, port=port
+        )
+        if statement_timeout:
+            # session setting, the server cancels any statement of the connection running longer
+            self._connect_kwargs["options"] = f"-c statement_timeout={int(statement_timeout)}"
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()        # (connection, last_used) pairs, most recent on the right
+        self._total = 0             # idle + in use + being created
+        self._in_use = 0
+        self._closed = False
+        self._reaper = None
+
+        self._stats = {
+            "checkouts": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "closed": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self) -> connection:
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _close_connection(self, conn: connection):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._stats["closed"] += 1
+
+    def _is_healthy(self, conn: connection) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self) -> connection:
+        """
+        Check a connection out of the pool, waiting up to `checkout_timeout` seconds.
+
+        Returns:
+            connection: An open connection with no transaction in progress.
+        """
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+
+        while True:
+            conn, last_used, create = None, None, False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.InterfaceError(f"Connection pool for '{self.database}' is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._total < self.max_size:
+                        self._total += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.checkout_timeout}s waiting for a connection to '{self.database}'"
+                        )
+                    self._cond.wait(remaining)
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                    self._close_connection(conn)
+                    self._total -= 1
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._in_use += 1
+                self._stats["checkouts"] += 1
+                self._stats["wait_time"] += waited
+                self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+            self._start_reaper()
+            return conn
+
+    def putconn(self, conn: connection, discard: bool = False):
+        """
+        Return a connection to the pool.
+
+        Args:
+            conn (connection): A connection previously obtained from `getconn`.
+            discard (bool): Close the connection instead of keeping it for reuse.
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._close_connection(conn)
+                self._total -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        """
+        Borrow a connection for the duration of a `with` block.
+
+        The transaction is committed when the block exits normally and rolled
+        back otherwise, including on `Cancelled` or `KeyboardInterrupt`.
+        Connections that broke during use are discarded.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            broken = conn.closed != 0
+            if not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            self.putconn(conn, discard=broken)
+            raise
+        else:
+            self.putconn(conn)
+
+    def reap_idle(self):
+        """
+        Close connections idle for longer than `idle_timeout`, keeping at least `min_size` open.
+        """
+        now = time.monotonic()
+        with self._cond:
+            # oldest connections sit on the left of the deque
+            while self._idle and self._total > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+                conn, _ = self._idle.popleft()
+                self._close_connection(conn)
+                self._total -= 1
+
+    def _start_reaper(self):
+        if self._reaper is not None or self.idle_timeout <= 0:
+            return
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(
+                target=self._reap_loop, name=f"pool-reaper-{self.database}", daemon=True
+            )
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(self.idle_timeout / 2, 1)
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                self._cond.wait(interval)
+                if self._closed:
+                    return
+            self.reap_idle()
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the pool counters.
+
+        Returns:
+            dict: checkouts, total/average/max wait time, connections in use and idle,
+            connections created/closed, checkout timeouts and failed health checks.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["database"] = self.database
+            stats["in_use"] = self._in_use
+            stats["idle"] = len(self._idle)
+            stats["size"] = self._total
+            stats["max_size"] = self.max_size
+            stats["avg_wait_time"] = stats["wait_time"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def close(self):
+        """
+        Close all idle connections and refuse further checkouts.
+        Connections still in use are closed when they are returned.
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_connection(conn)
+                self._total -= 1
+            self._cond.notify_all()
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: str) -> ConnectionPool:
+    """
+    Get the shared connection pool for a database, creating it on first use.
+
+    Args:
+        db_name (str): The name of the database.
+
+    Returns:
+        ConnectionPool: The pool shared by every caller using `db_name`.
+    """
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_name)
+            if pool is None:
+                pool = ConnectionPool(db_name)
+                _pools[db_name] = pool
+    return pool
+
+
+def pool_stats() -> dict[str, dict]:
+    """
+    Get the statistics of every open pool, keyed by database name.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.database: pool.stats() for pool in pools}
+
+
+def close_pools():
+    """
+    Close every pool. Pools are recreated on the next `get_pool` call.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
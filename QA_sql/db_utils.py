@@ -1,43 +1,233 @@
+from contextlib import contextmanager
+import json
 import psycopg2
 from psycopg2.extensions import cursor
-from typing import Tuple
-import re
-
-def get_cursor(
-        database: str,
-        host: str = "localhost", 
-        user: str = "postgres", 
-        password: str = "admin", 
-        port: int = 5432
-    ) -> cursor:
+from typing import Tuple, Iterator, Iterable
+import time
+from itertools import islice
+
+from db_pool import get_pool
+from metrics import span, record
+from cancellation import Cancelled, current_token
+from result_summary import ResultSummary
+from schema_cache import SchemaCache
+from sql_lexer import classify, single_query, write_keyword
+from utils import FETCH_BATCH_SIZE, MAX_ROWS, MAX_CELL_WIDTH, PAGE_SIZE
+
+@contextmanager
+def get_cursor(database: str) -> Iterator[cursor]:
     """
-    Establish connection to a PostgreSQL database
+    Borrow a cursor on a pooled connection to a PostgreSQL database
+
+    The connection comes from the pool shared by every caller using the same
+    database and goes back to it when the `with` block exits. The transaction
+    is committed on success and rolled back if an exception is raised.
 
     Args:
         database (str): The name of the database to connect to.
-        host (str): The hostname or IP address of the database server.
-        user (str): The username to authenticate with the database.
-        password (str): The password to authenticate with the database.
-        port (int): The port number database server is listening.
 
-    Returns:
+    Yields:
         cursor: A cursor object used for executing SQL queries.
     """
-    # Establish a connection to the database
-    connection = psycopg2.connect(
-        host=host,
-        database=database,
-        user=user,
-        password=password,
-        port=port
-    )
-    print("Connection successful!\n")
-    cursor = connection.cursor()
+    with get_pool(database).connection() as connection:
+        with connection.cursor() as cur:
+            yield cur
+
+
+# one row per table with a hash over its columns and key constraints,
+# cheap enough to run on every start to find tables whose definition changed
+_SQL_TABLE_FINGERPRINTS = """
+    SELECT
+        c.oid,
+        n.nspname,
+        c.relname,
+        md5(
+            coalesce((
+                SELECT string_agg(a.attname::text || ':' || a.atttypid || ':' || a.atttypmod || ':' || a.attnotnull, ',' ORDER BY a.attnum)
+                FROM pg_attribute a
+                WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            ), '')
+            || '|' ||
+            coalesce((
+                SELECT string_agg(co.contype::text || ':' || co.conkey::text || ':' || coalesce(co.confrelid::regclass::text, '') || ':' || coalesce(co.confkey::text, ''), ',' ORDER BY co.conname)
+                FROM pg_constraint co
+                WHERE co.conrelid = c.oid AND co.contype IN ('p', 'f')
+            ), '')
+        )
+    FROM
+        pg_class c
+    JOIN
+        pg_namespace n ON n.oid = c.relnamespace
+    WHERE
+        c.relkind IN ('r', 'p', 'v', 'f')
+        AND n.nspname <> 'information_schema'
+        AND n.nspname !~ '^pg_'
+        AND has_table_privilege(c.oid, 'SELECT');"""
+
+_SQL_COLUMNS = """
+    SELECT
+        a.attrelid,
+        a.attname,
+        format_type(a.atttypid, a.atttypmod),
+        a.attnotnull
+    FROM
+        pg_attribute a
+    WHERE
+        a.attrelid = ANY(%s::oid[])
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+    ORDER BY
+        a.attrelid, a.attnum;"""
+
+_SQL_PRIMARY_KEYS = """
+    SELECT
+        co.conrelid,
+        a.attname
+    FROM
+        pg_constraint co
+    CROSS JOIN LATERAL
+        unnest(co.conkey) WITH ORDINALITY AS k(attnum, position)
+    JOIN
+        pg_attribute a ON a.attrelid = co.conrelid AND a.attnum = k.attnum
+    WHERE
+        co.contype = 'p'
+        AND co.conrelid = ANY(%s::oid[])
+    ORDER BY
+        co.conrelid, k.position;"""
+
+_SQL_FOREIGN_KEYS = """
+    SELECT
+        co.conrelid,
+        sa.attname,
+        tn.nspname,
+        tc.relname,
+        ta.attname
+    FROM
+        pg_constraint co
+    CROSS JOIN LATERAL
+        unnest(co.conkey, co.confkey) WITH ORDINALITY AS k(source_attnum, target_attnum, position)
+    JOIN
+        pg_attribute sa ON sa.attrelid = co.conrelid AND sa.attnum = k.source_attnum
+    JOIN
+        pg_attribute ta ON ta.attrelid = co.confrelid AND ta.attnum = k.target_attnum
+    JOIN
+        pg_class tc ON tc.oid = co.confrelid
+    JOIN
+        pg_namespace tn ON tn.oid = tc.relnamespace
+    WHERE
+        co.contype = 'f'
+        AND co.conrelid = ANY(%s::oid[])
+    ORDER BY
+        co.conrelid, co.conname, k.position;"""
+
+
+def _table_name(schema: str, table: str) -> str:
+    # tables outside the default schema need to be qualified in generated SQL
+    return table if schema == "public" else f"{schema}.{table}"
+
+
+def _introspect_tables(cur: cursor, tables: dict[int, Tuple[str, str, str]]) -> dict[str, dict]:
+    """
+    Read the definition of the given tables from pg_catalog.
+
+    Args:
+        cur (cursor): An open cursor.
+        tables (dict[int, Tuple]): (schema, table, fingerprint) keyed by table oid.
+
+    Returns:
+        dict[str, dict]: table entries keyed by oid (as string, for JSON).
+    """
+    oids = list(tables)
+    entries = {}
+    for oid, (schema, table, fingerprint) in tables.items():
+        entries[str(oid)] = {
+            "schema": schema,
+            "name": _table_name(schema, table),
+            "fingerprint": fingerprint,
+            "columns": [],
+            "primary_keys": [],
+            "foreign_keys": [],
+        }
+
+    cur.execute(_SQL_COLUMNS, (oids,))
+    for oid, column, data_type, not_null in cur.fetchall():
+        column_def = f"{column} {data_type}"
+        if not_null:
+            column_def += " NOT NULL"
+        entries[str(oid)]["columns"].append([column, column_def])
+
+    cur.execute(_SQL_PRIMARY_KEYS, (oids,))
+    for oid, column in cur.fetchall():
+        entries[str(oid)]["primary_keys"].append(column)
+
+    cur.execute(_SQL_FOREIGN_KEYS, (oids,))
+    for oid, source_column, target_schema, target_table, target_column in cur.fetchall():
+        entries[str(oid)]["foreign_keys"].append(
+            [source_column, _table_name(target_schema, target_table), target_column]
+        )
+
+    for entry in entries.values():
+        entry["create"] = _create_statement(entry)
+
+    return entries
+
+
+def _create_statement(entry: dict) -> str:
+    create_statement = f"CREATE TABLE {entry['name']} (\n  "
+    create_statement += ",\n  ".join(column_def for _, column_def in entry["columns"])
+    if entry["primary_keys"]:
+        create_statement += f",\n  PRIMARY KEY ({', '.join(entry['primary_keys'])})"
+    if entry["foreign_keys"]:
+        create_statement += f",\n  " + ",\n  ".join(
+            f"FOREIGN KEY ({source_column}) REFERENCES {target_table}({target_column})"
+            for source_column, target_table, target_column in entry["foreign_keys"]
+        )
+    create_statement += "\n);"
+    return create_statement
+
+
+def get_schema_tables(db_name: str, refresh: bool = False) -> list[dict]:
+    """
+    Get the table definitions of the given PostgreSQL database.
 
-    return cursor
+    Definitions are cached on disk together with a per-table catalog
+    fingerprint. On each call only the fingerprints are read from the
+    database, and only new or changed tables are introspected again.
 
+    Args:
+        db_name (str): The name of the database to connect to.
+        refresh (bool): Ignore the cache and introspect every table.
 
-def get_schema_info(db_name: str) -> str:
+    Returns:
+        list[dict]: One entry per table, ordered by schema and table name, with keys
+        `name`, `columns` ([name, definition] pairs), `primary_keys`,
+        `foreign_keys` ([column, target table, target column]) and `create`.
+    """
+    with span("schema", db=db_name, refresh=refresh) as schema_span:
+        cache = SchemaCache(db_name)
+        cached = {} if refresh else cache.load()
+
+        with get_cursor(db_name) as cur:
+            cur.execute(_SQL_TABLE_FINGERPRINTS)
+            current = {oid: (schema, table, fingerprint) for oid, schema, table, fingerprint in cur.fetchall()}
+
+            changed = {
+                oid: info for oid, info in current.items()
+                if str(oid) not in cached
+                or cached[str(oid)]["fingerprint"] != info[2]
+                or cached[str(oid)]["name"] != _table_name(info[0], info[1])
+            }
+            introspected = _introspect_tables(cur, changed) if changed else {}
+
+        tables = {str(oid): introspected.get(str(oid)) or cached[str(oid)] for oid in current}
+        if introspected or len(tables) != len(cached):
+            cache.save(tables)
+        schema_span.set(tables=len(tables), introspected=len(introspected))
+
+    return sorted(tables.values(), key=lambda entry: (entry["schema"], entry["name"]))
+
+
+def get_schema_info(db_name: str, refresh: bool = False) -> str:
     """
     Get SQL schema for the given PostgreSQL database.
 
@@ -46,126 +236,296 @@ def get_schema_info(db_name: str) -> str:
 
     Args:
         db_name (str): The name of the database to connect to.
+        refresh (bool): Ignore the on-disk schema cache and introspect every table.
 
     Returns:
         str: A formatted string containing SQL schema. 
     
         Example Output:
             CREATE TABLE my_table (
-                column1 INTEGER NOT NULL,
-                column2 VARCHAR(50),
+                column1 integer NOT NULL,
+                column2 character varying(50),
                 PRIMARY KEY (column1),
                 FOREIGN KEY (column2) REFERENCES other_table(column1)
             );
     """
+    return "\n\n".join(entry["create"] for entry in get_schema_tables(db_name, refresh=refresh))
+
+
+def is_read_query(sql_statement: str) -> bool:
+    """
+    Whether a SQL statement is a single plain query (SELECT, WITH, VALUES, TABLE) that modifies nothing.
+    """
+    return single_query(sql_statement) is not None
+
+
+def explain_sql(sql_statement: str, db_name: str) -> str | None:
+    """
+    Check that the server can plan a SQL query, without executing it.
+
+    Only a single read-only query is sent to the server: the read-only
+    transaction alone would not stop a statement smuggled after it, e.g.
+    `SELECT 1; COMMIT; DROP TABLE t` commits and then drops the table.
+
+    Args:
+        sql_statement (str): The SQL query to validate.
+        db_name (str): The name of the database to connect to.
+
+    Returns:
+        str: the error reported by the server, None if the statement is valid
+    """
+    query = single_query(sql_statement)
+    if query is None:
+        return "not a single read-only query"
+    with span("explain", db=db_name) as explain_span:
+        try:
+            with get_cursor(db_name) as cur:
+                cur.execute("SET TRANSACTION READ ONLY")
+                cur.execute(f"EXPLAIN {query}")
+        except psycopg2.Error as e:
+            explain_span.set(valid=False)
+            return str(e).strip()
+        explain_span.set(valid=True)
+        return None
+
+
+def estimate_sql(sql_statement: str, db_name: str) -> dict:
+    """
+    Get the planner estimates of a SQL query with `EXPLAIN (FORMAT JSON)`, without executing it.
+
+    Only a single read-only query is sent to the server, see `explain_sql`.
+
+    Args:
+        sql_statement (str): The SQL query to plan.
+        db_name (str): The name of the database to connect to.
+
+    Returns:
+        dict: `cost` (total planner cost), `rows` (estimated result rows) and
+        `node` (type of the top plan node, e.g. `Limit`)
+
+    Raises:
+        ValueError: if the statement is not a single read-only query.
+        psycopg2.Error: if the server cannot plan the statement.
+    """
+    query = single_query(sql_statement)
+    if query is None:
+        raise ValueError("Only a single read-only query can be planned.")
+    with span("explain", db=db_name) as explain_span:
+        with get_cursor(db_name) as cur:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            plan = cur.fetchone()[0]
+        # psycopg2 decodes json columns, but EXPLAIN returns text on some servers
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        plan = plan[0]["Plan"]
+        estimate = {"cost": plan["Total Cost"], "rows": plan["Plan Rows"], "node": plan["Node Type"]}
+        explain_span.set(cost=estimate["cost"], estimated_rows=estimate["rows"])
+        return estimate
+
+
+def limit_sql(sql_statement: str, limit: int) -> str:
+    """
+    Wrap a SQL query so that it returns at most `limit` rows, keeping its ordering.
+
+    Raises:
+        ValueError: if the statement is not a single read-only query.
+    """
+    query = single_query(sql_statement)
+    if query is None:
+        raise ValueError("Only a single read-only query can be limited.")
+    return f"SELECT * FROM (\n{query}\n) AS limited LIMIT {int(limit)};"
+
+
+class ResultStream:
+    """
+    Iterate over the result of an SQL statement in batches of rows.
+
+    Read-only queries are executed through a named (server-side) cursor so
+    rows are only transferred from PostgreSQL when a batch is requested, and
+    memory stays bounded by `batch_size` regardless of the result size. Other
+    statements fall back to a regular cursor.
+
+    The running statement is cancelled on the server (`connection.cancel()`)
+    when the current cancellation token is cancelled, and `Cancelled` is raised.
+
+    The pooled connection is held until the stream is exhausted or closed,
+    so use it as a context manager:
+
+        with stream_sql("SELECT * FROM big_table", db_name) as stream:
+            for batch in stream:
+                ...
+
+    Attributes:
+        columns_header (list[str]): The column header of the result.
+        row_count (int): Number of rows yielded so far.
+        truncated (bool): Whether the result had more than `max_rows` rows.
+    """
+
+    def __init__(
+            self,
+            sql_statement: str,
+            db_name: str,
+            batch_size: int = FETCH_BATCH_SIZE,
+            max_rows: int | None = MAX_ROWS
+        ):
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self._start = time.perf_counter()
+        self._db_name = db_name
+        self.row_count = 0
+        self.truncated = False
+        self.columns_header = []
+
+        self._token = current_token()
+        self._cancel_handle = None
+        if self._token is not None:
+            self._token.raise_if_cancelled("sql")
+
+        self._pool = get_pool(db_name)
+        self._conn = self._pool.getconn()
+        self._cur = None
+        self._pending = []
+        self._done = False
+        try:
+            if self._token is not None:
+                self._cancel_handle = self._token.add_callback(self._conn.cancel)
+            statements = classify(sql_statement)
+            if all(statement.write is None for statement in statements):
+                # statements that were not approved as writes cannot modify anything
+                with self._conn.cursor() as cur:
+                    cur.execute("SET TRANSACTION READ ONLY")
+            if len(statements) == 1 and statements[0].is_query:
+                # DECLARE ... CURSOR FOR does not accept a trailing semicolon
+                self._cur = self._conn.cursor(name=f"qa_sql_{id(self):x}")
+                self._cur.itersize = batch_size
+                self._cur.execute(sql_statement[statements[0].start:statements[0].end])
+            else:
+                self._cur = self._conn.cursor()
+                self._cur.execute(sql_statement)
+
+            # named cursors only describe the result after the first fetch
+            if self._cur.description is None and self._cur.name is None:
+                # statement without a result set (e.g. INSERT), report affected rows
+                self._pending = [(self._cur.rowcount,)]
+                self.columns_header = ["rows_affected"]
+                self._done = True
+            else:
+                self._fetch()
+                self.columns_header = [desc[0] for desc in self._cur.description]
+        except Exception as e:
+            self._release(success=False)
+            self._raise_if_cancelled(e)
+            raise
+
+    def _raise_if_cancelled(self, error: Exception):
+        if self._token is not None and self._token.cancelled:
+            raise Cancelled("sql") from error
+
+    def _fetch(self):
+        size = self.batch_size
+        if self.max_rows is not None:
+            size = min(size, self.max_rows - self.row_count)
+        self._pending = self._cur.fetchmany(size)
+        # a short batch means the result is exhausted
+        self._done = len(self._pending) < size
+
+    def __iter__(self) -> Iterator[list[Tuple]]:
+        try:
+            while self._conn is not None:
+                if self._pending:
+                    batch, self._pending = self._pending, []
+                    self.row_count += len(batch)
+                    yield batch
+
+                if self._done:
+                    break
+                if self.max_rows is not None and self.row_count >= self.max_rows:
+                    self.truncated = self._cur.fetchone() is not None
+                    break
+
+                self._fetch()
+                if not self._pending:
+                    break
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            self._release(success=False)
+            self._raise_if_cancelled(e)
+            raise
+        self.close()
+
+    def rows(self) -> Iterator[Tuple]:
+        """
+        Iterate over the individual rows instead of batches.
+        """
+        for batch in self:
+            yield from batch
+
+    def close(self):
+        """
+        Close the cursor and return the connection to the pool.
+        """
+        self._release(success=True)
+
+    def _release(self, success: bool):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._cancel_handle is not None:
+            self._token.remove_callback(self._cancel_handle)
+        record(
+            "sql", self._start, db=self._db_name, rows=self.row_count,
+            truncated=self.truncated, server_side=self._cur is not None and self._cur.name is not None,
+            **({} if success else {"error": "cancelled" if self._token is not None and self._token.cancelled else "rolled back"})
+        )
+        broken = False
+        try:
+            if self._cur is not None:
+                self._cur.close()
+            if success:
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception:
+            broken = True
+        self._pool.putconn(conn, discard=broken or conn.closed != 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._release(success=exc_type is None)
+
+
+def stream_sql(
+        sql_statement: str,
+        db_name: str,
+        batch_size: int = None,
+        max_rows: int = None
+    ) -> ResultStream:
+    """
+    Execute an SQL statement and stream the results in batches.
+
+    Args:
+        sql_statement (str): The SQL query to be executed.
+        db_name (str): The name of the database to connect to.
+        batch_size (int): Number of rows fetched from the server at a time.
+        max_rows (int): Maximum number of rows to read, defaults to the configured row cap.
 
-    with get_cursor(db_name) as cur:
-        # Fetch columns and attributes
-        sql_columns = """
-            SELECT 
-                c.table_schema,
-                c.table_name,
-                c.column_name,
-                c.data_type,
-                COALESCE(character_maximum_length, numeric_precision) AS length,
-                c.is_nullable,
-                c.column_default
-            FROM 
-                information_schema.columns c
-            WHERE 
-                c.table_schema NOT IN ('pg_catalog', 'information_schema')
-            ORDER BY 
-                c.table_schema, c.table_name, c.ordinal_position;"""
-
-        cur.execute(sql_columns)
-        columns = cur.fetchall()
-
-        # Fetch primary key
-        sql_primary_key = """
-            SELECT 
-                kcu.table_schema,
-                kcu.table_name,
-                kcu.column_name
-            FROM 
-                information_schema.table_constraints tco
-            JOIN 
-                information_schema.key_column_usage kcu
-                ON tco.constraint_name = kcu.constraint_name
-            WHERE 
-                tco.constraint_type = 'PRIMARY KEY'
-                AND tco.table_schema NOT IN ('pg_catalog', 'information_schema')
-            ORDER BY 
-                kcu.table_schema, kcu.table_name, kcu.ordinal_position;"""
-
-        cur.execute(sql_primary_key)
-        primary_keys = cur.fetchall()
-
-        # Fetch foreign keys
-        sql_foreign_key = """
-            SELECT 
-                tc.table_schema AS source_schema,
-                tc.table_name AS source_table,
-                kcu.column_name AS source_column,
-                ccu.table_schema AS target_schema,
-                ccu.table_name AS target_table,
-                ccu.column_name AS target_column
-            FROM 
-                information_schema.table_constraints AS tc
-            JOIN 
-                information_schema.key_column_usage AS kcu
-                ON tc.constraint_name = kcu.constraint_name
-            JOIN 
-                information_schema.constraint_column_usage AS ccu
-                ON ccu.constraint_name = tc.constraint_name
-            WHERE 
-                tc.constraint_type = 'FOREIGN KEY'
-            ORDER BY 
-                source_schema, source_table;"""
-
-        cur.execute(sql_foreign_key)
-        foreign_keys = cur.fetchall()
-        
-        # Format data into CREATE TABLE statements
-        tables = {}
-        for _, table, column, data_type, length, is_nullable, default in columns:
-            if table not in tables:
-                tables[table] = {
-                    "columns": [],
-                    "primary_keys": [],
-                    "foreign_keys": []
-                }
-            column_def = f"{column} {data_type}"
-            if length:
-                column_def += f"({length})"
-            if is_nullable == "NO":
-                column_def += " NOT NULL"
-            # if default:
-            #     column_def += f" DEFAULT {default}"
-            tables[table]["columns"].append(column_def)
-
-        for _, table, column in primary_keys:
-            tables[table]["primary_keys"].append(column)
-
-        for _, source_table, source_column, _, target_table, target_column in foreign_keys:
-            fk = f"FOREIGN KEY ({source_column}) REFERENCES {target_table}({target_column})"
-            tables[source_table]["foreign_keys"].append(fk)
-
-        create_statements = []
-        for table, info in tables.items():
-            create_statement = f"CREATE TABLE {table} (\n  "
-            create_statement += ",\n  ".join(info["columns"])
-            if info["primary_keys"]:
-                create_statement += f",\n  PRIMARY KEY ({', '.join(info['primary_keys'])})"
-            if info["foreign_keys"]:
-                create_statement += f",\n  " + ",\n  ".join(info["foreign_keys"])
-            create_statement += "\n);"
-            create_statements.append(create_statement)
-
-    return "\n\n".join(create_statements)
+    Returns:
+        ResultStream: An iterator of row batches exposing the column header.
+    """
+    return ResultStream(
+        sql_statement,
+        db_name,
+        batch_size=batch_size or FETCH_BATCH_SIZE,
+        max_rows=max_rows or MAX_ROWS,
+    )
 
 
 def execute_sql(
-        sql_statement: str, db_name: str
+        sql_statement: str, db_name: str, max_rows: int = None
     ) -> Tuple[list[Tuple], list[str]]:
     """
     Execute an SQL statement for the given database and retrieve results.
@@ -173,78 +533,220 @@ def execute_sql(
     Args:
         sql_statement (str): The SQL query to be executed.
         db_name (str): The name of the database to connect to.
+        max_rows (int): Maximum number of rows to retrieve, all rows if None.
 
     Returns:
         - result (list[tuples]): The rows returned by executing the query.
         - columns_header (list[str]): The column header of the result.
     """
-    with get_cursor(db_name) as cur:
-        cur.execute(sql_statement)
-        result = cur.fetchall()
-        columns_header = [desc[0] for desc in cur.description]
+    with ResultStream(sql_statement, db_name, batch_size=FETCH_BATCH_SIZE, max_rows=max_rows) as stream:
+        result = list(stream.rows())
+        columns_header = stream.columns_header
 
     return result, columns_header
 
 
-def format_output(
-        result: list[Tuple], col_header: list[str]
+def preview_sql(
+        sql_statement: str, db_name: str, num_rows: int, summary: ResultSummary = None
+    ) -> Tuple[list[Tuple], list[str], int, bool]:
+    """
+    Execute an SQL statement, keeping only the first rows of the result in memory.
+
+    The remaining rows are streamed from the server and counted, never stored.
+
+    Args:
+        sql_statement (str): The SQL query to be executed.
+        db_name (str): The name of the database to connect to.
+        num_rows (int): Number of leading rows to keep.
+        summary (ResultSummary): if given, accumulates the column statistics of every row read.
+
+    Returns:
+        - rows (list[tuples]): The first `num_rows` rows of the result.
+        - columns_header (list[str]): The column header of the result.
+        - row_count (int): The number of rows read, capped by the configured row cap.
+        - truncated (bool): Whether the result exceeded the row cap.
+    """
+    rows = []
+    with stream_sql(sql_statement, db_name) as stream:
+        for batch in stream:
+            if len(rows) < num_rows:
+                rows.extend(batch[:num_rows - len(rows)])
+            if summary is not None:
+                summary.add(batch, stream.columns_header)
+
+    return rows, stream.columns_header, stream.row_count, stream.truncated
+
+
+def count_sql(sql_statement: str, db_name: str) -> int | None:
+    """
+    Count the rows of a query result on the server, without transferring them.
+
+    The count is cancelled on the server when the current cancellation token is cancelled.
+
+    Args:
+        sql_statement (str): The SQL query whose rows to count.
+        db_name (str): The name of the database to connect to.
+
+    Returns:
+        int: The number of rows of the result, None if the statement is not a single read-only query.
+
+    Raises:
+        Cancelled: if the current cancellation token is cancelled.
+    """
+    query = single_query(sql_statement)
+    if query is None:
+        return None
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled("sql")
+    with span("count", db=db_name) as count_span:
+        try:
+            with get_pool(db_name).connection() as conn:
+                handle = token.add_callback(conn.cancel) if token is not None else None
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SET TRANSACTION READ ONLY")
+                        cur.execute(f"SELECT COUNT(*) FROM (\n{query}\n) AS counted")
+                        row_count = cur.fetchone()[0]
+                finally:
+                    if handle is not None:
+                        token.remove_callback(handle)
+        except psycopg2.Error as e:
+            if token is not None and token.cancelled:
+                raise Cancelled("sql") from e
+            raise
+        count_span.set(rows=row_count)
+        return row_count
+
+
+def _cell(value, max_width: int) -> str:
+    text = str(value)
+    if len(text) > max_width:
+        if max_width < 4:
+            return text[:max_width]
+        return text[:max_width - 3] + "..."
+    return text
+
+
+def render_table(
+        rows: Iterable[Tuple],
+        col_header: list[str],
+        max_width: int = MAX_CELL_WIDTH,
+        width_sample: int | None = None
     ) -> str:
     """
-    Format raw database output into table format.
+    Render rows into a text table in linear time.
+
+    Every cell is converted with `str()` once and truncated at `max_width`
+    characters. Column widths come from a single pass over the rows, or only
+    over the first `width_sample` rows, in which case the remaining rows are
+    rendered straight from the iterable and longer cells are truncated to
+    the sampled width.
 
     Args:
-        result (list[tuple]): The rows returned by the query.
+        rows (Iterable[Tuple]): The rows returned by the query.
         col_header (list[str]): The column headers of the result.
+        max_width (int): The maximum width of a column.
+        width_sample (int): Number of leading rows used to size the columns, all rows if None.
 
     Returns:
         str: A string representation of the data formatted as a table.
     """
+    with span("format") as format_span:
+        table, num_rows = _render_table(rows, col_header, max_width, width_sample)
+        format_span.set(rows=num_rows, bytes=len(table))
+    return table
 
-    table = ''
 
-    # Determine max widths for each column
-    col_widths = [
-        int(max(len(str(row[i])) for row in result + [col_header])*1.5) for i in range(len(col_header))
-    ]
+def _render_table(
+        rows: Iterable[Tuple], col_header: list[str], max_width: int, width_sample: int | None
+    ) -> Tuple[str, int]:
+    header = [_cell(col, max_width) for col in col_header]
+    rows = iter(rows)
 
-    line = "+" + "+".join("-" * (width + 2) for width in col_widths) + "+"
-    header = "| " + " | ".join(f"{col_header[i]:{col_widths[i]}}" for i in range(len(col_header))) + " |"
-    table += f'{line}\n{header}\n{line}\n'
+    # single pass: stringify the (sampled) rows once, widths are computed column-wise
+    sampled = [tuple(map(str, row)) for row in islice(rows, width_sample)]
+    widths = [
+        max(len(col), max(map(len, cells), default=0)) for col, cells in zip(header, zip(*sampled))
+    ] if sampled else [len(col) for col in header]
 
-    # Append the table rows
-    for row in result:
-        row_str = "| " + " | ".join(f"{str(row[i]):{col_widths[i]}}" for i in range(len(row))) + " |"
-        table += row_str + '\n'
+    if any(width > max_width for width in widths):
+        sampled = [tuple(_cell(cell, max_width) for cell in cells) for cells in sampled]
+        widths = [min(width, max_width) for width in widths]
 
-    # Bottom row
-    table += line
+    line = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+    # the precision truncates cells of rows past the sample to the column width
+    row_format = "| " + " | ".join(f"{{:<{width}.{width}}}" for width in widths) + " |"
 
-    return table
+    out = [line, row_format.format(*header), line]
+    out.extend(row_format.format(*cells) for cells in sampled)
+    out.extend(row_format.format(*map(str, row)) for row in rows)
+    out.append(line)
 
+    # without the header and the three separator lines
+    return "\n".join(out), len(out) - 4
 
-def detect_keyword(sql_statement: str) -> str | None:
+
+def render_page(
+        rows: list[Tuple],
+        col_header: list[str],
+        page: int = 0,
+        page_size: int = PAGE_SIZE,
+        max_width: int = MAX_CELL_WIDTH,
+        total_rows: int = None
+    ) -> str:
     """
-    Detect if keyword present in the sql statement
-    
+    Render a single page of rows, only the visible rows are formatted.
+
     Args:
-        sql_statement (str): The SQL query to detect keyword.
+        rows (list[tuple]): The rows returned by the query.
+        col_header (list[str]): The column headers of the result.
+        page (int): Zero-based page number.
+        page_size (int): Number of rows per page.
+        max_width (int): The maximum width of a column.
+        total_rows (int): Total number of rows in the result, defaults to `len(rows)`.
 
     Returns:
-        str: return the found keyeword or None if keyword not found
+        str: The page formatted as a table, followed by the displayed row range.
+    """
+    if total_rows is None:
+        total_rows = len(rows)
+
+    start = page * page_size
+    page_rows = rows[start:start + page_size]
+    table = render_table(page_rows, col_header, max_width=max_width)
+
+    if total_rows > len(page_rows):
+        table += f"\n\nRows {start + 1}-{start + len(page_rows)} of {total_rows}"
+
+    return table
+
+
+def format_output(
+        result: Iterable[Tuple], col_header: list[str]
+    ) -> str:
     """
-    KEYWORDS = ['INSERT INTO', 'DELETE FROM', 'CREATE TABLE', 'DROP TABLE', 'ALTER TABLE', 'TRUNCATE TABLE']
+    Format raw database output into table format.
 
-    # RE for general keywords
-    general_pattern = re.compile(r'\b(' + '|'.join(re.escape(keyword) for keyword in KEYWORDS) + r')\b', re.IGNORECASE)
+    Args:
+        result (Iterable[tuple]): The rows returned by the query.
+        col_header (list[str]): The column headers of the result.
 
-    # RE for UPDATE
-    update_pattern = re.compile(r'\bUPDATE\s+\w+\s+SET\b', re.IGNORECASE)
-    if update_pattern.search(sql_statement):
-        return 'UPDATE'
+    Returns:
+        str: A string representation of the data formatted as a table.
+    """
+    return render_table(result, col_header)
 
-    match = general_pattern.search(sql_statement)
-    if match:
-        return match.group(0)
 
-    return None
+def detect_keyword(sql_statement: str) -> str | None:
+    """
+    Detect if the sql statement modifies the database, see `sql_lexer.classify`.
+    
+    Args:
+        sql_statement (str): The SQL query to detect keyword.
+
+    Returns:
+        str: return the found keyeword (e.g. `DELETE` or `DROP TABLE`) or None if keyword not found
+    """
+    return write_keyword(sql_statement)
 
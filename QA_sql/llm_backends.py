@@ -0,0 +1,460 @@
+import inspect
+import random
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import deque
+from typing import Callable, Iterator
+
+# local files
+from cancellation import Cancelled, CancelToken, cancellation, current_token
+from utils import (
+    LLM_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_FIRST_TOKEN_TIMEOUT, LLM_CIRCUIT_FAILURES, LLM_CIRCUIT_RESET,
+    LLM_FALLBACK_MODELS
+)
+
+# latencies kept per backend for its percentiles
+STATS_WINDOW = 1024
+
+_EMPTY = object()
+
+
+class LLMError(Exception):
+    """
+    A request to an LLM backend failed.
+
+    Attributes:
+        backend (str): name of the backend, e.g. `ollama:llama3@http://localhost:11434/api/chat`
+        retryable (bool): whether sending the same request again may succeed
+    """
+
+    retryable = False
+
+    def __init__(self, message: str, backend: str = None):
+        super().__init__(f"{backend}: {message}" if backend else message)
+        self.backend = backend
+
+
+class LLMTimeout(LLMError):
+    """
+    The backend did not answer in time.
+
+    Attributes:
+        phase (str): `connect`, `read` or `first token`
+    """
+
+    retryable = True
+
+    def __init__(self, message: str, backend: str = None, phase: str = None):
+        super().__init__(message, backend)
+        self.phase = phase
+
+
+class LLMUnavailable(LLMError):
+    """The backend cannot be reached, or is overloaded or failing (HTTP 429, 5xx)."""
+
+    retryable = True
+
+
+class LLMRequestError(LLMError):
+    """The backend refused the request: unknown model, invalid API key, invalid request."""
+
+
+class CircuitOpen(LLMUnavailable):
+    """The backend failed too often recently and is skipped until its circuit breaker lets a request through."""
+
+    retryable = False
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a failing backend.
+
+    After `failures` consecutive failures the circuit opens and requests are
+    refused right away. After `reset_timeout` seconds one request is let
+    through: the circuit closes if it succeeds and opens again if it fails.
+    A request that ends otherwise (cancelled) must be `abandon`ed, so that
+    the next one is let through instead.
+    """
+
+    __slots__ = ("failure_threshold", "reset_timeout", "state", "failures", "opened_at", "_probing", "_lock")
+
+    def __init__(self, failures: int = LLM_CIRCUIT_FAILURES, reset_timeout: float = LLM_CIRCUIT_RESET):
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def abandon(self):
+        """A request let through ended with neither a success nor a failure."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit opened after {self.failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+def _percentile(samples: list[float], q: float) -> float | None:
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class BackendStats:
+    """
+    Outcomes of the requests sent to a backend, and the latencies of the last
+    `STATS_WINDOW` successful ones.
+    """
+
+    __slots__ = ("requests", "errors", "retries", "failovers", "latencies", "ttfts", "_lock")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.failovers = 0  # requests it served after another backend failed
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.ttfts = deque(maxlen=STATS_WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, duration: float, ttft: float = None, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+                return
+            self.latencies.append(duration)
+            if ttft is not None:
+                self.ttfts.append(ttft)
+
+    def count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies, ttfts = sorted(self.latencies), sorted(self.ttfts)
+            stats = {
+                "requests": self.requests, "errors": self.errors, "retries": self.retries, "failovers": self.failovers,
+            }
+        for name, samples in (("latency", latencies), ("ttft", ttfts)):
+            for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                stats[f"{name}_{label}"] = _percentile(samples, q)
+        return stats
+
+
+class Backend(ABC):
+    """
+    A server (or API) serving one model.
+
+    Subclasses implement `stream` and `complete`, and raise `LLMError`
+    subclasses for failed requests. They stop with `Cancelled` when the
+    current cancellation token is cancelled. The breaker and the statistics
+    of a backend are shared by every request of the process, see `get_backend`.
+
+    Args:
+        model_name (str): the model
+        endpoint (str): the URL of the server, None for the default of the backend
+    """
+
+    kind = None
+
+    def __init__(self, model_name: str, endpoint: str = None):
+        self.model_name = model_name
+        self.endpoint = endpoint
+        self.name = f"{self.kind}:{model_name}" + (f"@{endpoint}" if endpoint else "")
+        self.breaker = CircuitBreaker()
+        self.stats = BackendStats()
+
+    @classmethod
+    def server(cls, endpoint: str = None) -> str | None:
+        """The server of the backend for a requested endpoint, None if it has a single one."""
+        return endpoint
+
+    @abstractmethod
+    def stream(self, messages: list[dict], temperature: float = None) -> Iterator[str]:
+        """The response, streamed as it is generated."""
+
+    @abstractmethod
+    def complete(self, messages: list[dict], temperature: float = None) -> str:
+        """The whole response."""
+
+
+# kind -> (predicate on the model name, backend class), in registration order
+_registry = {}
+_backends = {}  # (kind, model name, endpoint) -> Backend
+_backends_lock = threading.Lock()
+
+
+def register_backend(backend_class: type, matches: Callable[[str], bool]):
+    """
+    Serve the models whose name `matches` with `backend_class`. Backends
+    registered later take precedence, the catch-all backend is registered first.
+
+    Raises:
+        TypeError: if `backend_class` is not a `Backend` implementing every method, or has no `kind`
+    """
+    if not (isinstance(backend_class, type) and issubclass(backend_class, Backend)):
+        raise TypeError(f"{backend_class!r} is not a Backend")
+    if inspect.isabstract(backend_class):
+        missing = ", ".join(sorted(backend_class.__abstractmethods__))
+        raise TypeError(f"{backend_class.__name__} does not implement {missing}")
+    if not backend_class.kind:
+        raise TypeError(f"{backend_class.__name__} has no kind")
+    _registry[backend_class.kind] = (matches, backend_class)
+
+
+def get_backend(model_name: str, endpoint: str = None) -> Backend:
+    """
+    The backend serving a model, created on first use.
+
+    Args:
+        model_name (str): the model
+        endpoint (str): the URL of the server, None for the default of the backend
+    """
+    for matches, backend_class in reversed(list(_registry.values())):
+        if matches(model_name):
+            break
+    else:
+        raise LLMRequestError(f"No backend serves the model {model_name!r}")
+
+    endpoint = backend_class.server(endpoint)
+    key = (backend_class.kind, model_name, endpoint)
+    backend = _backends.get(key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(key)
+            if backend is None:
+                backend = _backends[key] = backend_class(model_name, endpoint)
+    return backend
+
+
+def backend_stats() -> dict[str, dict]:
+    """Statistics and circuit state of every backend used so far, by name."""
+    with _backends_lock:
+        backends = list(_backends.values())
+    return {backend.name: {**backend.stats.snapshot(), "circuit": backend.breaker.state} for backend in backends}
+
+
+def backend_chain(model_name: str, endpoint: str = None, fallbacks: list[str] = None) -> list[Backend]:
+    """
+    The backend of a model followed by the backends to fail over to.
+
+    Args:
+        model_name (str): the model
+        endpoint (str): its server, None for the default of its backend
+        fallbacks (list[str]): `model` or `model@url` entries, `LLM_FALLBACK_MODELS` if None
+    """
+    chain = [get_backend(model_name, endpoint)]
+    for entry in LLM_FALLBACK_MODELS if fallbacks is None else fallbacks:
+        fallback_model, _, fallback_endpoint = entry.partition("@")
+        backend = get_backend(fallback_model.strip(), fallback_endpoint.strip() or None)
+        if backend not in chain:
+            chain.append(backend)
+    return chain
+
+
+def _backoff(attempt: int):
+    """Wait before retry `attempt` (from 0), full jitter: a random delay up to the exponential bound."""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    token = current_token()
+    if token is None:
+        time.sleep(delay)
+        return
+    woken = threading.Event()
+    with token.on_cancel(woken.set):
+        woken.wait(delay)
+    token.raise_if_cancelled("llm")
+
+
+def _failed(backend: Backend, error: LLMError, start: float, attempt: int, last_attempt: bool) -> bool:
+    """Record a failed request, and wait before sending it again. Returns whether to retry."""
+    if error.retryable:
+        backend.breaker.failure()
+    else:
+        # the backend answered, the request itself is wrong (bad model, missing key...)
+        backend.breaker.abandon()
+    backend.stats.observe(time.perf_counter() - start, error=True)
+    if not error.retryable or last_attempt or backend.breaker.state == "open":
+        print(f"LLM request failed: {error}")
+        return False
+    print(f"LLM request failed: {error}, retrying")
+    backend.stats.count("retries")
+    _backoff(attempt)
+    return True
+
+
+def _attempts(chain: list[Backend]) -> Iterator[tuple[Backend, int, bool]]:
+    """
+    The (backend, attempt, last attempt) to try in turn: every backend of
+    the chain whose circuit lets requests through, up to `LLM_RETRIES` times.
+    The error of each failed attempt is sent back. Once every backend
+    failed, the last error of a request is raised, `CircuitOpen` if none was sent.
+    """
+    errors = []
+    for i, backend in enumerate(chain):
+        if i:
+            print(f"Failing over to {backend.name}")
+        for attempt in range(LLM_RETRIES + 1):
+            if not backend.breaker.allow():
+                errors.append(CircuitOpen("skipped, too many recent failures", backend.name))
+                break
+            error = yield backend, attempt, attempt == LLM_RETRIES
+            errors.append(error)
+            if not error.retryable:
+                break
+    raise next((error for error in reversed(errors) if not isinstance(error, CircuitOpen)), errors[-1])
+
+
+def complete(
+        messages: list[dict], model_name: str, endpoint: str = None, temperature: float = None, fallbacks: list[str] = None
+    ) -> str:
+    """
+    The whole response of a model, retrying and failing over as configured, see `stream`.
+    """
+    chain = backend_chain(model_name, endpoint, fallbacks)
+    attempts = _attempts(chain)
+    error = None
+    while True:
+        backend, attempt, last_attempt = attempts.send(error) if error is not None else next(attempts)
+        start = time.perf_counter()
+        try:
+            response = backend.complete(messages, temperature)
+        except LLMError as e:
+            error = e
+            _failed(backend, e, start, attempt, last_attempt)
+            continue
+        except BaseException:
+            backend.breaker.abandon()
+            raise
+        attempts.close()
+        backend.breaker.success()
+        backend.stats.observe(time.perf_counter() - start)
+        if backend is not chain[0]:
+            backend.stats.count("failovers")
+        return response
+
+
+def stream(
+        messages: list[dict], model_name: str, endpoint: str = None, temperature: float = None, fallbacks: list[str] = None
+    ) -> Iterator[str]:
+    """
+    The response of a model, streamed as it is generated.
+
+    A request failing before its first token (connection refused, timeout,
+    HTTP 429 or 5xx, no token within `LLM_FIRST_TOKEN_TIMEOUT` seconds) is
+    sent again up to `LLM_RETRIES` times, after an exponential backoff with
+    jitter, then to the fallback models in turn; backends whose circuit
+    breaker is open are skipped. Once tokens were yielded the response is
+    committed: a later failure is raised to the caller.
+
+    Args:
+        messages (list[dict]): the prompt
+        model_name (str): the model
+        endpoint (str): its server, None for the default of its backend
+        temperature (float): sampling temperature, the model's default if None
+        fallbacks (list[str]): `model` or `model@url` entries, `LLM_FALLBACK_MODELS` if None
+
+    Raises:
+        LLMError: the error of the last backend tried, if all of them failed
+        Cancelled: if the current cancellation token is cancelled
+    """
+    chain = backend_chain(model_name, endpoint, fallbacks)
+    attempts = _attempts(chain)
+    parent = current_token()
+    error = None
+    while True:
+        backend, attempt, last_attempt = attempts.send(error) if error is not None else next(attempts)
+        start = time.perf_counter()
+
+        # the request runs under a token of its own, cancelled by the caller's token or the first token timeout
+        request_token = CancelToken()
+        timed_out = threading.Event()
+
+        def _expire():
+            timed_out.set()
+            request_token.cancel()
+
+        timer = threading.Timer(LLM_FIRST_TOKEN_TIMEOUT, _expire)
+        timer.daemon = True
+        handle = parent.add_callback(request_token.cancel) if parent is not None else None
+        chunks = backend.stream(messages, temperature)
+        try:
+            timer.start()
+            try:
+                with cancellation(request_token):
+                    first = next(chunks, _EMPTY)
+            except Cancelled as e:
+                if not timed_out.is_set() or (parent is not None and parent.cancelled):
+                    raise
+                raise LLMTimeout(
+                    f"no token within {LLM_FIRST_TOKEN_TIMEOUT:.0f}s", backend.name, "first token"
+                ) from e
+            finally:
+                timer.cancel()
+        except LLMError as e:
+            chunks.close()
+            if handle is not None:
+                parent.remove_callback(handle)
+            error = e
+            _failed(backend, e, start, attempt, last_attempt)
+            continue
+        except BaseException:
+            chunks.close()
+            if handle is not None:
+                parent.remove_callback(handle)
+            backend.breaker.abandon()
+            raise
+
+        attempts.close()
+        if backend is not chain[0]:
+            backend.stats.count("failovers")
+        ttft = time.perf_counter() - start
+        failed = False
+        try:
+            if first is not _EMPTY:
+                yield first
+            yield from chunks
+        except LLMError:
+            failed = True
+            raise
+        finally:
+            chunks.close()
+            if handle is not None:
+                parent.remove_callback(handle)
+            # a response abandoned by the caller (e.g. a losing speculative candidate) is not a failure
+            if failed:
+                backend.breaker.failure()
+                backend.stats.observe(time.perf_counter() - start, error=True)
+            else:
+                backend.breaker.success()
+                backend.stats.observe(time.perf_counter() - start, ttft)
+        return
@@ -0,0 +1,288 @@
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+from utils import METRICS_LOG_PATH, METRICS_LOG_MAX_BYTES, METRICS_LOG_BACKUPS, METRICS_PORT, METRICS_FILE
+
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# spans shown in the status bar, in pipeline order
+SUMMARY_SPANS = (
+    ("schema", "schema"), ("prompt", "prompt"), ("summarize", "summarize"), ("speculate", "candidates"),
+    ("llm", "llm"), ("sql", "sql"), ("format", "format"),
+)
+
+_current_trace = contextvars.ContextVar("qa_sql_trace", default=None)
+_trace_ids = itertools.count(1)
+
+
+class Span:
+    """A timed operation and its attributes (token counts, row counts, bytes...)."""
+
+    __slots__ = ("name", "start", "duration", "attrs")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Add attributes to the span."""
+        self.attrs.update(attrs)
+
+
+class Trace:
+    """The spans recorded while answering one question."""
+
+    def __init__(self, name: str, attrs: dict):
+        self.id = next(_trace_ids)
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.duration = None
+
+    def total(self, name: str, attr: str = None) -> float:
+        """
+        Sum of the durations (or of an attribute) of the spans of a name.
+        """
+        if attr is None:
+            return sum(span.duration for span in self.spans if span.name == name)
+        return sum(span.attrs.get(attr) or 0 for span in self.spans if span.name == name)
+
+    def summary(self) -> str:
+        """
+        One line summary of where the time went, e.g.
+        `llm 1.84s (ttft 0.21s, 312 tokens) · sql 0.04s (1,234 rows) · total 1.93s`.
+        """
+        parts = []
+        names = {span.name for span in self.spans}
+        for name, label in SUMMARY_SPANS:
+            if name not in names:
+                continue
+            details = []
+            if name == "llm":
+                first = next((span.attrs["ttft"] for span in self.spans if "ttft" in span.attrs), None)
+                if first is not None:
+                    details.append(f"ttft {first:.2f}s")
+                tokens = self.total(name, "completion_tokens")
+                if tokens:
+                    details.append(f"{int(tokens):,} tokens")
+            elif name == "speculate":
+                winner = next(span.attrs.get("winner") for span in self.spans if span.name == name)
+                if winner is not None:
+                    details.append(f"#{winner + 1} won, {self.total(name, 'saved'):.2f}s saved")
+            elif name == "sql":
+                details.append(f"{int(self.total(name, 'rows')):,} rows")
+            parts.append(f"{label} {self.total(name):.2f}s" + (f" ({', '.join(details)})" if details else ""))
+        if self.duration is not None:
+            parts.append(f"total {self.duration:.2f}s")
+        return " · ".join(parts)
+
+
+class Registry:
+    """
+    Process wide aggregates of the recorded spans: a latency histogram per
+    span name, and the sum of every numeric attribute.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # name -> [bucket counts..., +Inf count, sum]
+        self._totals = {}       # (name, attr) -> sum
+
+    def observe(self, span: Span):
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(BUCKETS):
+                if span.duration <= bound:
+                    histogram[i] += 1
+            histogram[len(BUCKETS)] += 1
+            histogram[-1] += span.duration
+
+            for attr, value in span.attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and attr != "ttft":
+                    self._totals[(span.name, attr)] = self._totals.get((span.name, attr), 0) + value
+
+    def render(self) -> str:
+        """
+        The aggregates in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+            totals = dict(self._totals)
+
+        lines = [
+            "# HELP qa_sql_span_seconds Duration of the QA pipeline stages.",
+            "# TYPE qa_sql_span_seconds histogram",
+        ]
+        for name, histogram in sorted(histograms.items()):
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f'qa_sql_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'qa_sql_span_seconds_bucket{{span="{name}",le="+Inf"}} {histogram[len(BUCKETS)]}')
+            lines.append(f'qa_sql_span_seconds_sum{{span="{name}"}} {histogram[-1]}')
+            lines.append(f'qa_sql_span_seconds_count{{span="{name}"}} {histogram[len(BUCKETS)]}')
+
+        for attr in sorted({attr for _, attr in totals}):
+            lines.append(f"# TYPE qa_sql_{attr}_total counter")
+            for (name, key), value in sorted(totals.items()):
+                if key == attr:
+                    lines.append(f'qa_sql_{attr}_total{{span="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+_log = logging.getLogger("qa_sql.metrics")
+_log.propagate = False
+_log_lock = threading.Lock()
+_log_ready = False
+
+
+def _logger() -> logging.Logger | None:
+    """The rotating JSON span log, configured on first use. None if disabled."""
+    global _log_ready
+    if not METRICS_LOG_PATH:
+        return None
+    if not _log_ready:
+        with _log_lock:
+            if not _log_ready:
+                path = os.path.expanduser(METRICS_LOG_PATH)
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    path, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                _log.addHandler(handler)
+                _log.setLevel(logging.INFO)
+                _log_ready = True
+    return _log
+
+
+def _write_log(kind: str, name: str, duration: float, attrs: dict, trace: Trace | None):
+    log = _logger()
+    if log is None:
+        return
+    record = {"ts": round(time.time(), 3), "kind": kind, "name": name, "duration_ms": round(duration * 1000, 3)}
+    if trace is not None:
+        record["trace_id"] = trace.id
+        record["trace"] = trace.name
+    record.update(attrs)
+    log.info(json.dumps(record, default=str))
+
+
+def _finish(span: Span):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append(span)
+    REGISTRY.observe(span)
+    _write_log("span", span.name, span.duration, span.attrs, trace)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """
+    Time a block of code as a span of the current trace.
+
+        with span("sql", db=db_name) as s:
+            ...
+            s.set(rows=row_count)
+    """
+    current = Span(name, attrs)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _finish(current)
+
+
+def record(name: str, start: float, **attrs) -> Span:
+    """
+    Record a span that started at `start` (a `time.perf_counter()` value) and
+    ends now, for operations that do not fit a `with` block such as generators.
+    """
+    current = Span(name, attrs)
+    current.start = start
+    current.duration = time.perf_counter() - start
+    _finish(current)
+    return current
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Trace]:
+    """
+    Collect the spans recorded by the current thread (or task) into a trace.
+    """
+    current = Trace(name, attrs)
+    token = _current_trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_trace.reset(token)
+        _write_log("trace", name, current.duration, {**attrs, "summary": current.summary()}, current)
+        if METRICS_FILE:
+            write_prometheus(METRICS_FILE)
+
+
+def write_prometheus(path: str):
+    """
+    Write the metrics in the Prometheus text format, e.g. for the node exporter textfile collector.
+    """
+    path = os.path.expanduser(path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        data = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> ThreadingHTTPServer | None:
+    """
+    Serve the metrics at `http://localhost:<port>/metrics` on a daemon thread.
+    Does nothing if the port is 0 or the server is already running.
+    """
+    global _server
+    with _server_lock:
+        if not port or _server is not None:
+            return _server
+        _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        print(f"Metrics served at http://127.0.0.1:{port}/metrics")
+        return _server
@@ -0,0 +1,814 @@
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, Tuple
+
+from LLM import LLM_response
+from prompt import (
+    SQL_question_message, question_answer_message, count_tokens, SCHEMA_PROMPT_TEMPLATE, SUPPLEMENT_SCHEMA_TEMPLATE
+)
+from db_utils import get_schema_tables, preview_sql, count_sql, detect_keyword, is_read_query, explain_sql
+from metrics import span, trace, start_metrics_server
+from cancellation import CancelToken, Cancelled, cancellation, current_token, raise_if_cancelled
+from query_guard import GuardVerdict, check_query
+from schema_index import SchemaIndex
+from response_cache import ResponseCache, cache_key
+from result_cache import ResultCache, write_targets
+from result_summary import ResultSummary
+from utils import (
+    MAX_RETRY, DISPLAY_ROWS, RESULT_LIMIT, SCHEMA_PRUNE, SCHEMA_PRUNE_MIN_TABLES,
+    SQL_CACHE, RESULT_CACHE, OLLAMA_CONCURRENCY, OPENAI_CONCURRENCY, DB_CONCURRENCY, BATCH_WORKERS,
+    SPECULATIVE_CANDIDATES, SPECULATIVE_TEMPERATURES, SPECULATIVE_MODELS, GUARD_ENABLED, RESULT_SUMMARY, SERVER_WORKERS,
+    EARLY_SQL,
+)
+
+_SQL_BLOCK_PATTERN = re.compile(r"```sql(.*?)```", re.DOTALL)
+
+# concurrency limits shared by every pipeline of the process, per backend
+_backend_slots = {
+    "ollama": threading.BoundedSemaphore(OLLAMA_CONCURRENCY),
+    "openai": threading.BoundedSemaphore(OPENAI_CONCURRENCY),
+    "postgres": threading.BoundedSemaphore(DB_CONCURRENCY),
+}
+
+_candidate_executor = None
+_candidate_executor_lock = threading.Lock()
+_tail_executor = None
+
+
+def _candidate_pool() -> ThreadPoolExecutor:
+    """The threads generating speculative SQL candidates, shared by every pipeline of the process."""
+    global _candidate_executor
+    with _candidate_executor_lock:
+        if _candidate_executor is None:
+            _candidate_executor = ThreadPoolExecutor(
+                max_workers=SPECULATIVE_CANDIDATES * max(BATCH_WORKERS, SERVER_WORKERS), thread_name_prefix="qa_sql_candidate"
+            )
+        return _candidate_executor
+
+
+def _tail_pool() -> ThreadPoolExecutor:
+    """The threads reading the rest of the responses whose SQL is already running, see `StreamedResponse`."""
+    global _tail_executor
+    with _candidate_executor_lock:
+        if _tail_executor is None:
+            _tail_executor = ThreadPoolExecutor(
+                max_workers=max(BATCH_WORKERS, SERVER_WORKERS), thread_name_prefix="qa_sql_tail"
+            )
+        return _tail_executor
+
+
+def llm_backend(model_name: str) -> str:
+    """
+    Name of the backend serving a model, `openai` for GPT models and `ollama` otherwise.
+    """
+    return "openai" if model_name[:3].lower() == 'gpt' else "ollama"
+
+
+def extract_sql(response: str) -> str | None:
+    """
+    Extract the first ```sql code block of an LLM response.
+
+    Returns:
+        str: the SQL statement, or None if the response has no SQL block.
+    """
+    sql_query = _SQL_BLOCK_PATTERN.search(response)
+    if sql_query:
+        return sql_query.group(1).strip()
+    return None
+
+
+class SQLFenceParser:
+    """
+    Finds the first ```sql code block of a streamed LLM response as its
+    chunks arrive, with the result of `extract_sql` on the whole text. Fences
+    split across chunks are found, each character is scanned about once.
+
+        parser = SQLFenceParser()
+        for chunk in chunks:
+            if parser.feed(chunk) is not None:
+                break       # parser.sql is complete
+    """
+
+    __slots__ = ("text", "sql", "_open")
+
+    def __init__(self):
+        self.text = ""      # the response so far
+        self.sql = None     # the SQL statement, once its block is closed
+        self._open = None   # offset of the SQL after the opening fence
+
+    def feed(self, chunk: str) -> str | None:
+        """
+        Add a chunk of the response.
+
+        Returns:
+            str: the SQL statement if this chunk closed its block, None otherwise
+        """
+        scanned = len(self.text)
+        self.text += chunk
+        if self.sql is not None:
+            return None
+        if self._open is None:
+            # the opening fence may start in the previous chunk
+            fence = self.text.find("```sql", max(0, scanned - 5))
+            if fence < 0:
+                return None
+            self._open = start = fence + 6
+        else:
+            start = max(self._open, scanned - 2)
+        close = self.text.find("```", start)
+        if close < 0:
+            return None
+        self.sql = self.text[self._open:close].strip()
+        return self.sql
+
+
+class StreamedResponse:
+    """
+    An LLM response read up to the end of its SQL block, so that the query
+    runs while the rest of the response (usually an explanation) is read on
+    a background thread.
+
+    Attributes:
+        head (str): the response up to the end of the SQL block, or the whole
+            response if it has no SQL block
+        ahead (float): seconds between the end of the SQL block and the end
+            of the response, i.e. the time the query ran ahead of it
+    """
+
+    __slots__ = ("head", "ahead", "_chunks", "_future", "_stop", "_sql_at")
+
+    def __init__(self, head: str, chunks: Iterator[str] = None):
+        self.head = head
+        self.ahead = 0.0
+        self._chunks = chunks
+        self._future = None
+        self._stop = threading.Event()
+        self._sql_at = time.perf_counter()
+        if chunks is not None:
+            self._future = _tail_pool().submit(contextvars.copy_context().run, self._drain)
+
+    def _drain(self) -> str:
+        tail = []
+        try:
+            for chunk in self._chunks:
+                if self._stop.is_set():
+                    break
+                tail.append(chunk)
+        finally:
+            # stops the generation if abandoned
+            self._chunks.close()
+            self.ahead = time.perf_counter() - self._sql_at
+        return "".join(tail)
+
+    def text(self) -> str:
+        """The whole response, waiting for its end. Only the head if reading the rest failed."""
+        if self._future is None:
+            return self.head
+        try:
+            return self.head + self._future.result()
+        except Exception as e:
+            print(f"Failed to read the end of the response: {e}")
+            return self.head
+
+    def abandon(self):
+        """Stop reading the rest of the response."""
+        self._stop.set()
+
+
+class Conversation:
+    """
+    State of one conversation: the message history, the tables whose schema
+    was sent so far and the last question and response.
+    """
+
+    def __init__(self):
+        self.history = None
+        self.session_tables = []
+        self.num_conversation = 0
+        self.question = None
+        self.response = None
+
+
+class SQLCandidate:
+    """
+    One of the SQL responses requested concurrently for a question, and why
+    it was rejected (None if it is a valid read-only query).
+    """
+
+    __slots__ = ("index", "model_name", "temperature", "response", "sql", "error", "duration")
+
+    def __init__(self, index: int, model_name: str, temperature: float | None):
+        self.index = index
+        self.model_name = model_name
+        self.temperature = temperature
+        self.response = None
+        self.sql = None
+        self.error = None
+        self.duration = None
+
+
+class PipelineObserver:
+    """
+    Receives the progress of `QAPipeline.ask`. Every method is a no-op,
+    subclasses override what they display.
+    """
+
+    def status(self, text: str):
+        pass
+
+    def answered_without_sql(self, question: str, response: str):
+        pass
+
+    def sql_generated(self, question: str, sql_statement: str):
+        pass
+
+    def result(self, rows: list[Tuple], col_header: list[str], row_count: int, truncated: bool, cache_age: float | None):
+        pass
+
+    def answer_started(self):
+        pass
+
+    def token(self, chunk: str):
+        pass
+
+    def answer_finished(self):
+        pass
+
+    def error(self, title: str, message: str):
+        pass
+
+    def confirm(self, title: str, message: str) -> bool:
+        """
+        Ask the user a yes/no question, e.g. whether to run an expensive query.
+        Without a user to ask, the answer is no.
+        """
+        return False
+
+
+class QAPipeline:
+    """
+    Headless question answering pipeline over one database:
+
+    LLM response -> extract SQL -> keyword guard -> cost guard -> execute SQL -> answer question
+
+    The pipeline holds what is shared between conversations (schema, schema
+    index, caches) and is safe to use from several threads, while each
+    conversation keeps its own `Conversation` state.
+    """
+
+    def __init__(self, model_name: str, db_name: str, refresh_schema: bool = False):
+        self.model_name = model_name
+        self.db_name = db_name
+
+        self.schema_tables = get_schema_tables(db_name, refresh=refresh_schema)
+        self.schema_index = SchemaIndex(self.schema_tables)
+        self.SCHEMA_PROMPT = SCHEMA_PROMPT_TEMPLATE.format(schema=self.schema_index.schema(self.schema_index.names))
+        self.schema_prompt_tokens = count_tokens([{"role": "user", "content": self.SCHEMA_PROMPT}], model_name)
+
+        self.sql_cache = ResponseCache() if SQL_CACHE else None
+        self.result_cache = ResultCache() if RESULT_CACHE else None
+
+        start_metrics_server()
+
+    def close(self):
+        if self.sql_cache is not None:
+            self.sql_cache.close()
+
+    def schema_prompt(self, question: str, conversation: Conversation) -> str:
+        """
+        Build the schema part of the prompt for a question.
+
+        The schema sent with the first question of a conversation stays in its
+        system prompt for the whole conversation. For large schemas only the
+        tables relevant to the question are included, together with their
+        foreign key neighbours, and follow-up questions only carry the relevant
+        tables that were not sent yet.
+
+        Args:
+            question (str): the user's question
+            conversation (Conversation): the conversation, its sent tables are updated
+
+        Returns:
+            str: the schema prompt, empty if the conversation already has every relevant table
+        """
+        pruned = SCHEMA_PRUNE and len(self.schema_tables) > SCHEMA_PRUNE_MIN_TABLES
+
+        if conversation.history is None:
+            tables = self.schema_index.select(question) if pruned else []
+            if not tables:
+                # small schema, or nothing matched: let the model see everything
+                conversation.session_tables = list(self.schema_index.names)
+                return self.SCHEMA_PROMPT
+            conversation.session_tables = tables
+
+            prompt = SCHEMA_PROMPT_TEMPLATE.format(schema=self.schema_index.schema(tables))
+            saved = self.schema_prompt_tokens - count_tokens([{"role": "user", "content": prompt}], self.model_name)
+            print(f"Schema pruned to {len(tables)} of {len(self.schema_tables)} tables, {int(saved)} tokens saved.")
+            return prompt
+
+        if not pruned:
+            return ""
+
+        sent = set(conversation.session_tables)
+        new_tables = [
+            table for table in self.schema_index.select(question, include=conversation.session_tables)
+            if table not in sent
+        ]
+        if not new_tables:
+            return ""
+        conversation.session_tables = conversation.session_tables + new_tables
+        print(f"Schema extended with {len(new_tables)} tables.")
+        return SUPPLEMENT_SCHEMA_TEMPLATE.format(schema=self.schema_index.schema(new_tables))
+
+    def sql_prompt(
+            self, question: str, conversation: Conversation, feedback: str = None
+        ) -> Tuple[list[dict], str]:
+        """
+        Build the prompt asking the LLM for a SQL query.
+
+        Returns:
+            - new_history (list[dict]): the conversation history with the question appended,
+              the messages to send
+            - schema_prompt (str): the schema part of the prompt
+        """
+        schema_prompt = self.schema_prompt(question, conversation)
+        new_history = SQL_question_message(
+            question, feedback=feedback, history=conversation.history, model_name=self.model_name,
+            schema_prompt=schema_prompt
+        )
+
+        return new_history, schema_prompt
+
+    def llm(
+            self, messages: list[dict], stream: bool = True, model_name: str = None, temperature: float = None
+        ) -> Iterator[str] | str:
+        """
+        Call the LLM (the model of the pipeline unless given) within the concurrency limit of its backend.
+        """
+        model_name = model_name or self.model_name
+        slots = _backend_slots[llm_backend(model_name)]
+        if not stream:
+            with slots:
+                return LLM_response(messages, model_name, stream=False, temperature=temperature)
+
+        def _stream():
+            with slots:
+                yield from LLM_response(messages, model_name, stream=True, temperature=temperature)
+
+        return _stream()
+
+    def _candidate(self, candidate: SQLCandidate, messages: list[dict], cancelled: threading.Event) -> SQLCandidate:
+        """
+        Generate one SQL candidate and validate it with `EXPLAIN`.
+
+        The response is streamed so that the request can be abandoned as soon
+        as another candidate wins, closing the connection stops the generation.
+        """
+        start = time.perf_counter()
+        try:
+            chunks = self.llm(messages, stream=True, model_name=candidate.model_name, temperature=candidate.temperature)
+            response = []
+            try:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        break
+                    response.append(chunk)
+            finally:
+                chunks.close()
+
+            if cancelled.is_set():
+                candidate.error = "cancelled"
+                return candidate
+            candidate.response = "".join(response)
+            candidate.sql = extract_sql(candidate.response)
+            if candidate.sql is None:
+                candidate.error = "no SQL query"
+            elif not is_read_query(candidate.sql):
+                candidate.error = "not a read-only query"
+            else:
+                with _backend_slots["postgres"]:
+                    candidate.error = explain_sql(candidate.sql, self.db_name)
+        except Exception as e:
+            candidate.error = str(e) or type(e).__name__
+        finally:
+            candidate.duration = time.perf_counter() - start
+        return candidate
+
+    def speculate(self, messages: list[dict]) -> Tuple[str, dict]:
+        """
+        Request several SQL responses concurrently and keep the first valid one.
+
+        Candidates differ by temperature (and model, if several are configured).
+        Each one is validated with `EXPLAIN` as soon as it arrives, the first
+        valid read-only query wins and the other requests are abandoned.
+
+        Args:
+            messages (list[dict]): the prompt asking for a SQL query
+
+        Returns:
+            - response (str): the winning response; if no candidate is valid, a
+              response without SQL if there is one, otherwise the first one received
+            - report (dict): number of candidates, index, model and temperature of the
+              winner (None if no candidate is valid), the rejection of the others and
+              the latency saved in seconds compared to generating them one at a time
+        """
+        models = SPECULATIVE_MODELS or [self.model_name]
+        temperatures = SPECULATIVE_TEMPERATURES or [None]
+        candidates = [
+            SQLCandidate(i, models[i % len(models)], temperatures[i % len(temperatures)])
+            for i in range(SPECULATIVE_CANDIDATES)
+        ]
+
+        with span("speculate", candidates=len(candidates)) as speculate_span:
+            cancelled = threading.Event()
+            start = time.perf_counter()
+            executor = _candidate_pool()
+            futures = [
+                # run in a copy of the context so that the candidate spans join the current trace
+                executor.submit(contextvars.copy_context().run, self._candidate, candidate, messages, cancelled)
+                for candidate in candidates
+            ]
+            finished, winner = [], None
+            for future in as_completed(futures):
+                candidate = future.result()
+                finished.append(candidate)
+                if candidate.error is None:
+                    winner = candidate
+                    break
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+            elapsed = time.perf_counter() - start
+
+            # generated one at a time, the rejected candidates would have come before the winner
+            saved = sum(candidate.duration for candidate in finished) - elapsed if winner is not None else 0.0
+            report = {
+                "candidates": len(candidates),
+                "winner": None if winner is None else winner.index,
+                "model": None if winner is None else winner.model_name,
+                "temperature": None if winner is None else winner.temperature,
+                "rejected": {candidate.index: candidate.error for candidate in finished if candidate is not winner},
+                "saved": max(saved, 0.0),
+            }
+            speculate_span.set(
+                winner=report["winner"], rejected=len(report["rejected"]), saved=report["saved"]
+            )
+
+        if winner is not None:
+            print(f"SQL candidate {winner.index + 1} of {len(candidates)} won, {report['saved']:.2f}s saved.")
+            return winner.response, report
+
+        received = [candidate for candidate in finished if candidate.response is not None]
+        if not received:
+            raise Exception(finished[0].error if finished else "no SQL candidate generated")
+        without_sql = [candidate for candidate in received if candidate.sql is None]
+        return (without_sql or received)[0].response, report
+
+    def generate_sql(
+            self, question: str, conversation: Conversation, feedback: str = None, result: dict = None
+        ) -> Tuple[str, list[dict], str | None, bool]:
+        """
+        Ask the LLM for a response containing a SQL query.
+
+        Standalone questions (first of a conversation, no feedback) are served
+        from the SQL cache when the same question was answered before. With
+        more than one speculative candidate configured, several responses are
+        requested concurrently and the first valid query is kept, its report
+        is stored under `speculative` in `result`.
+
+        With `early_sql` set, the response is streamed and returned as soon as
+        its SQL block is closed, as a `StreamedResponse` whose rest is still
+        being read.
+
+        Returns:
+            - response (str | StreamedResponse): the LLM response
+            - new_history (list[dict]): the conversation history with the question appended
+            - cache_entry (str): the SQL cache key of the response, None if not cacheable
+            - from_cache (bool): whether the response came from the cache
+        """
+        new_history, schema_prompt = self.sql_prompt(question, conversation, feedback)
+
+        response, entry = None, None
+        if self.sql_cache is not None and conversation.history is None and feedback is None:
+            entry = cache_key(question, self.model_name, schema_prompt)
+            with span("sql_cache") as cache_span:
+                response = self.sql_cache.get(entry)
+                cache_span.set(hits=int(response is not None))
+
+        if response is not None:
+            return response, new_history, entry, True
+        if SPECULATIVE_CANDIDATES > 1:
+            response, report = self.speculate(new_history)
+            if result is not None:
+                result["speculative"] = report
+            return response, new_history, entry, False
+        if EARLY_SQL:
+            return self.stream_sql_response(new_history), new_history, entry, False
+        return self.llm(new_history, stream=False), new_history, entry, False
+
+    def stream_sql_response(self, messages: list[dict]) -> StreamedResponse:
+        """
+        Stream a response, returning as soon as its SQL block is closed.
+
+        The rest of the response is read on a background thread, see
+        `StreamedResponse`. It is read outside of the concurrency limit of
+        the backend: the slot is handed back when the SQL block is closed, so
+        that the answer request does not wait for the end of the explanation.
+        A response without a SQL block is read to its end.
+        """
+        parser = SQLFenceParser()
+        slots = _backend_slots[llm_backend(self.model_name)]
+        slots.acquire()
+        held = True
+        chunks = LLM_response(messages, self.model_name, stream=True)
+        try:
+            for chunk in chunks:
+                if parser.feed(chunk) is not None:
+                    slots.release()
+                    held = False
+                    return StreamedResponse(parser.text, chunks)
+        except BaseException:
+            chunks.close()
+            raise
+        finally:
+            if held:
+                slots.release()
+        return StreamedResponse(parser.text)
+
+    def guard(self, sql_statement: str, observer: PipelineObserver = None) -> GuardVerdict:
+        """
+        Check a query against the planner estimates before running it, see `query_guard.check_query`.
+
+        Expensive queries needing confirmation are resolved with the observer, the
+        returned verdict is `run`, `limit` (run the query wrapped in a LIMIT) or `reject`.
+        """
+        if not GUARD_ENABLED:
+            return GuardVerdict("run", sql_statement)
+        with _backend_slots["postgres"]:
+            verdict = check_query(sql_statement, self.db_name)
+        if verdict.action == "ask":
+            observer = observer or PipelineObserver()
+            proceed = observer.confirm(
+                "Confirmation", f"The query looks expensive: {verdict.reason}. Would you like to run it?"
+            )
+            if not proceed:
+                verdict.action = "reject"
+            else:
+                verdict.action = "run" if verdict.sql == sql_statement else "limit"
+        return verdict
+
+    def execute(
+            self, sql_statement: str
+        ) -> Tuple[list[Tuple], list[str], int, bool, float | None, ResultSummary | None]:
+        """
+        Execute a SQL statement, keeping the leading rows of its result.
+
+        Results of queries are cached, other statements drop the cached
+        results of the tables they modify. The statistics of the columns are
+        gathered while the rows are streamed, the rows past the row cap are
+        counted on the server.
+
+        Returns:
+            - rows (list[Tuple]): the leading rows of the result
+            - col_header (list[str]): the column header
+            - row_count (int): the number of rows
+            - truncated (bool): whether the result exceeded the row cap
+            - cache_age (float): age of the result in seconds if served from the cache, else None
+            - summary (ResultSummary): statistics of the result columns, None if disabled
+        """
+        if self.result_cache is not None and is_read_query(sql_statement):
+            cached = self.result_cache.get(self.db_name, sql_statement)
+            if cached is not None:
+                rows, col_header, row_count, truncated, summary = cached.value
+                return rows, col_header, row_count, truncated, cached.age, summary
+
+        summary = ResultSummary() if RESULT_SUMMARY else None
+        with _backend_slots["postgres"]:
+            rows, col_header, row_count, truncated = preview_sql(
+                sql_statement, self.db_name, max(DISPLAY_ROWS, RESULT_LIMIT), summary=summary
+            )
+            if summary is not None and truncated and is_read_query(sql_statement):
+                summary.total_rows = count_sql(sql_statement, self.db_name)
+
+        if self.result_cache is not None:
+            if is_read_query(sql_statement):
+                self.result_cache.put(self.db_name, sql_statement, (rows, col_header, row_count, truncated, summary))
+            else:
+                dropped = self.result_cache.invalidate(self.db_name, write_targets(sql_statement))
+                print(f"Statement may have modified the database, {dropped} cached results dropped.")
+
+        return rows, col_header, row_count, truncated, None, summary
+
+    def execute_and_answer(
+            self,
+            sql_statement: str,
+            conversation: Conversation,
+            observer: PipelineObserver = None,
+            result: dict = None
+        ) -> bool:
+        """
+        Execute the SQL statement of the last question and answer it from the result.
+
+        Args:
+            sql_statement (str): the SQL statement to execute
+            conversation (Conversation): the conversation, its history is updated
+            observer (PipelineObserver): receives the result and the answer tokens
+            result (dict): filled with the result, answer and stage timings
+
+        Returns:
+            bool: whether the SQL statement was executed and the question answered
+        """
+        observer = observer or PipelineObserver()
+        result = {} if result is None else result
+        timings = result.setdefault("timings", {})
+
+        try:
+            observer.status("Extracting and executing SQL queries...")
+            start = time.perf_counter()
+            rows, col_header, row_count, truncated, cache_age, summary = self.execute(sql_statement)
+            timings["execute"] = time.perf_counter() - start
+
+            observer.result(rows[:DISPLAY_ROWS], col_header, row_count, truncated, cache_age)
+            result.update(
+                columns=col_header, rows=rows[:RESULT_LIMIT], row_count=row_count,
+                truncated=truncated, result_from_cache=cache_age is not None
+            )
+
+            new_history = question_answer_message(
+                conversation.question, sql_statement, rows[:RESULT_LIMIT], history=conversation.history,
+                model_name=self.model_name, row_count=row_count, summary=summary
+            )
+
+            observer.status("generating answers...")
+            observer.answer_started()
+            start = time.perf_counter()
+            LLM_answer = []
+            try:
+                for chunk in self.llm(new_history, stream=True):
+                    observer.token(chunk)
+                    LLM_answer.append(chunk)
+            finally:
+                observer.answer_finished()
+            timings["answer"] = time.perf_counter() - start
+
+            answer = "".join(LLM_answer)
+            result["answer"] = answer
+
+            # update history
+            conversation.history = new_history
+            conversation.history.append({"role": "assistant", "content": answer})
+            conversation.num_conversation += 1
+            observer.status("")
+            return True
+
+        except Exception as e:
+            result["error"] = str(e)
+            observer.error("Error", f"Failed to extract and execute SQL statement.\n{e}")
+            return False
+
+    def ask(
+            self,
+            question: str,
+            conversation: Conversation = None,
+            observer: PipelineObserver = None,
+            cancel_token: CancelToken = None
+        ) -> dict:
+        """
+        Answer a question end to end, regenerating the SQL with feedback if it is rejected.
+
+        Args:
+            question (str): the user's question
+            conversation (Conversation): the conversation to continue, a new one if None
+            observer (PipelineObserver): receives the progress
+            cancel_token (CancelToken): stops the LLM streams and SQL statements of the
+                question when cancelled, defaults to the current token
+
+        Returns:
+            dict: the question, generated SQL, result columns, leading rows, row count,
+            answer, number of attempts, cache usage, error (if any), the stage that was
+            cancelled (if any), per-stage timings
+            in seconds, the planner estimates of the query, a one line summary of the
+            recorded spans and, in speculative mode, the report of the SQL candidates.
+        """
+        with trace("ask", model=self.model_name, db=self.db_name) as ask_trace, cancellation(cancel_token):
+            result = self._ask(question, conversation, observer)
+        result["trace"] = ask_trace.summary()
+        return result
+
+    def _ask(self, question: str, conversation: Conversation, observer: PipelineObserver) -> dict:
+        conversation = conversation or Conversation()
+        observer = observer or PipelineObserver()
+        result = {
+            "question": question, "sql": None, "columns": None, "rows": None, "row_count": None,
+            "answer": None, "attempts": 0, "sql_from_cache": False, "result_from_cache": False,
+            "error": None, "cancelled": None, "timings": {},
+        }
+        timings = result["timings"]
+        start = time.perf_counter()
+        try:
+            raise_if_cancelled("queued")
+            self._answer(question, conversation, observer, result)
+        except Cancelled as e:
+            result["error"] = "cancelled"
+            result["cancelled"] = e.stage
+            current_token().stopped(e.stage)
+            observer.status("cancelled")
+
+        timings["total"] = time.perf_counter() - start
+        return result
+
+    def _answer(self, question: str, conversation: Conversation, observer: PipelineObserver, result: dict):
+        timings = result["timings"]
+        feedback = None     # LLM feedback prompt
+
+        # LLM regenerate response
+        for attempt in range(1, MAX_RETRY + 1):
+            result["attempts"] = attempt
+
+            # ---generate response---
+            observer.status("generating SQL queries...")
+            stage_start = time.perf_counter()
+            try:
+                response, new_history, cache_entry, from_cache = self.generate_sql(
+                    question, conversation, feedback, result
+                )
+            except Exception as e:
+                result["error"] = str(e)
+                observer.error("Error", f"API call error, failed to connect to LLM.\n{e}")
+                break
+            finally:
+                timings["generate_sql"] = timings.get("generate_sql", 0.0) + time.perf_counter() - stage_start
+            feedback = None
+            streamed = None
+            if isinstance(response, StreamedResponse):
+                streamed, response = response, response.head
+            result["sql_from_cache"] = from_cache
+            if from_cache:
+                observer.status("SQL served from cache, executing...")
+
+            # ---extract SQL---
+            extracted_sql = extract_sql(response)
+            if extracted_sql is None: # in case where answering the question does not require SQL query
+                observer.answered_without_sql(question, response)
+                conversation.question = question
+                conversation.response = response
+                conversation.history = new_history
+                conversation.history.append({"role": "assistant", "content": response})
+                result["answer"] = response
+                observer.status("")
+                break
+
+            # ---keyword detection---
+            keyword = detect_keyword(extracted_sql)
+
+            # regenerate if sql statement tries to do something other than query
+            if keyword is not None:
+                feedback = f"""
+    The generated SQL query is attempted to perform '{keyword}' statement.
+    Please ensure that queries are limited to SELECT query statements only."""
+                result["error"] = f"'{keyword}' statement generated"
+                observer.status(f"generation failed for error {result['error']}, retrying...")
+                if streamed is not None:
+                    streamed.abandon()
+                continue
+
+            # ---cost guard---
+            verdict = self.guard(extracted_sql, observer)
+            result["guard"] = verdict.as_dict()
+            if verdict.action == "reject":
+                feedback = f"""
+    The generated SQL query is too expensive to run, {verdict.reason}.
+    Please avoid cross joins and unbounded scans: join on keys, filter, aggregate or limit the rows."""
+                result["error"] = f"query rejected, {verdict.reason}"
+                observer.status(f"generation failed for error {result['error']}, retrying...")
+                if streamed is not None:
+                    streamed.abandon()
+                continue
+            if verdict.action == "limit":
+                print(f"Query {verdict.reason}.")
+                extracted_sql = verdict.sql
+
+            result["sql"] = extracted_sql
+            result["error"] = None
+            observer.sql_generated(question, extracted_sql)
+
+            # Update history
+            conversation.question = question
+            conversation.response = response
+            conversation.history = new_history
+            conversation.history.append({"role": "assistant", "content": extracted_sql})
+
+            succeeded = self.execute_and_answer(extracted_sql, conversation, observer, result)
+            if streamed is not None:
+                # the query ran while the rest of the response was generated
+                response = conversation.response = streamed.text()
+                timings["sql_ahead"] = streamed.ahead
+            if cache_entry is not None:
+                if succeeded and not from_cache:
+                    self.sql_cache.put(cache_entry, response)
+                elif not succeeded and from_cache:
+                    self.sql_cache.invalidate(cache_entry)
+            break
@@ -1,24 +1,313 @@
-from typing import Tuple
+from typing import Tuple, Iterable, Iterator
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import tiktoken
 from LLM import LLM_response
-from utils import RESULT_LIMIT, INPUT_TOKEN_LIMIT
+from metrics import span
+from result_summary import ResultSummary
+from utils import (
+    RESULT_LIMIT, INPUT_TOKEN_LIMIT, BACKGROUND_SUMMARY, SUMMARY_TOKEN_LIMIT, SUMMARY_KEEP_MESSAGES,
+    RESULT_SAMPLE_ROWS, RESULT_SUMMARY_TOKENS
+)
+
+# a heuristic estimation correction of the number of tokens per word
+WORD_TOKEN_CORRECTION = 4/3
+
+SCHEMA_PROMPT_TEMPLATE = "\nThis query will run on a database whose schema is represented as:\n\n{schema}"
+# tables relevant to a follow-up question that are not in the schema of the system prompt
+SUPPLEMENT_SCHEMA_TEMPLATE = "\nThe database also has the following tables:\n\n{schema}"
+
+SQL_SYSTEM_PROMPT = """
+    You are a helpful assistant for generating SQL queries.
+    Adhere to these rules:
+    - **Deliberately go through the question and database schema word by word** to appropriately answer the question.
+    - **Use Table Aliases** to prevent ambiguity. For example, `SELECT table1.col1, table2.col1 FROM table1 JOIN table2 ON table1.id = table2.id`.
+    - When creating a ratio, always cast the numerator as float.
+    - Pay attention to **use only the column names that you see in the schema description**.
+    - Pay attention to **which column is in which table**.
+    - When given the result of a SQL query, answer the user question directly from it."""
+
+# tiktoken encodings by model name, looking one up is much slower than encoding a message
+_encodings: dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+
+# summarizes the older turns of long conversations off the question path
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="qa-summary")
+
+SUMMARY_QUESTION = {"role": "user", "content": "Summarize my previous conversation into a brief summary."}
+
+
+class Message:
+    """
+    One message of a conversation, linked to the message before it.
+
+    Records are immutable and shared by every history they belong to: a
+    history is a chain of records ending with its last message, appending
+    links a new record to it, and histories branching off the same
+    conversation share the records they have in common.
+
+    Attributes:
+        role (str): `system`, `user` or `assistant`
+        content (str): the text of the message
+        tokens (float): its number of tokens, see `message_tokens`
+        previous (Message): the message before it, None for the first message
+        first (Message): the first message of the chain
+        length (int): number of messages of the chain up to this one
+        total (float): number of tokens of the chain up to this one
+        chars (int): number of characters of the chain up to this one
+    """
+
+    __slots__ = ("role", "content", "tokens", "previous", "first", "length", "total", "chars", "__weakref__")
+
+    def __init__(self, role: str, content: str, tokens: float, previous: "Message" = None):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+        self.previous = previous
+        if previous is None:
+            self.first, self.length, self.total, self.chars = self, 1, tokens, len(content)
+        else:
+            self.first = previous.first
+            self.length = previous.length + 1
+            self.total = previous.total + tokens
+            self.chars = previous.chars + len(content)
+
+    def as_dict(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+
+# first messages (the system prompt with the schema) shared by every conversation starting with them
+_first_messages = weakref.WeakValueDictionary()
+_first_messages_lock = threading.Lock()
+
+
+def _first_message(message: dict, model_name: str) -> Message:
+    key = (model_name, message["role"], message["content"])
+    with _first_messages_lock:
+        record = _first_messages.get(key)
+        if record is None:
+            record = Message(message["role"], message["content"], message_tokens(message, model_name))
+            _first_messages[key] = record
+    return record
+
+
+class History:
+    """
+    Conversation messages keeping a running count of their tokens.
+
+    Messages are stored as a chain of immutable `Message` records: appending
+    links one record (whose tokens are counted once) and copying a history
+    only copies the reference to its last record, so building the prompt of
+    a question never copies the conversation, and a retry branches off the
+    same messages as the failed attempt. The first message, the system prompt
+    holding the schema, is a single record shared by every conversation
+    starting with it.
+
+    A history reads like a list of `{"role", "content"}` dicts (iteration,
+    `len`, indexing and slicing, which materialize the messages); only
+    `append` and `extend` modify it.
+
+    Args:
+        messages (Iterable[dict]): the initial messages
+        model_name (str): the model whose tokenizer counts the tokens
+    """
+
+    __slots__ = ("model_name", "last", "_compaction")
+
+    def __init__(self, messages: Iterable[dict] = (), model_name: str = 'gpt-4o'):
+        self.model_name = model_name
+        self.last = None
+        self._compaction = None     # (future, cut) of the summary being computed in the background
+        self.extend(messages)
+
+    @classmethod
+    def _from(cls, last: Message, model_name: str, compaction: tuple = None) -> "History":
+        history = cls.__new__(cls)
+        history.model_name = model_name
+        history.last = last
+        history._compaction = compaction
+        return history
+
+    @property
+    def tokens(self) -> int:
+        """Number of tokens of the messages, as counted by `count_tokens`."""
+        total = self.last.total if self.last is not None else 0
+        return total + (3 if _is_openai(self.model_name) else 0)
+
+    @property
+    def turn_tokens(self) -> int:
+        """Number of tokens of the conversation turns, without the system prompt."""
+        if self.last is None:
+            return 0
+        return self.last.total - self.last.first.tokens
+
+    @property
+    def chars(self) -> int:
+        """Number of characters of the messages."""
+        return self.last.chars if self.last is not None else 0
+
+    def append(self, message: dict):
+        if self.last is None:
+            self.last = _first_message(message, self.model_name)
+        else:
+            self.last = Message(
+                message["role"], message["content"], message_tokens(message, self.model_name), self.last
+            )
+
+    def extend(self, messages: Iterable[dict]):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable[dict]):
+        self.extend(messages)
+        return self
+
+    def records(self) -> list[Message]:
+        """The message records, first to last."""
+        records = []
+        record = self.last
+        while record is not None:
+            records.append(record)
+            record = record.previous
+        records.reverse()
+        return records
+
+    def __len__(self) -> int:
+        return self.last.length if self.last is not None else 0
+
+    def __iter__(self) -> Iterator[dict]:
+        return (record.as_dict() for record in self.records())
+
+    def __getitem__(self, index):
+        if index == -1 and self.last is not None:
+            return self.last.as_dict()
+        if index == 0 and self.last is not None:
+            return self.last.first.as_dict()
+        if isinstance(index, slice):
+            return [record.as_dict() for record in self.records()[index]]
+        return self.records()[index].as_dict()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, History):
+            return self.last is other.last or list(self) == list(other)
+        return list(self) == other
+
+    def __repr__(self) -> str:
+        return f"History({list(self)!r})"
+
+    def copy(self) -> "History":
+        return History._from(self.last, self.model_name, self._compaction)
+
+    def dump(self) -> list[list]:
+        """The messages with their token counts, as `[role, content, tokens]` lists, see `load`."""
+        return [[record.role, record.content, record.tokens] for record in self.records()]
+
+    @classmethod
+    def load(cls, messages: list[list], model_name: str) -> "History":
+        """Rebuild a history from `dump`, without counting the tokens again."""
+        history = cls((), model_name)
+        for i, (role, content, tokens) in enumerate(messages):
+            if i == 0:
+                history.last = _first_message({"role": role, "content": content}, model_name)
+            else:
+                history.last = Message(role, content, tokens, history.last)
+        return history
+
+    def compact_in_background(
+            self, token_limit: int = SUMMARY_TOKEN_LIMIT, keep_messages: int = SUMMARY_KEEP_MESSAGES
+        ) -> bool:
+        """
+        Start summarizing the older turns in the background if they exceed
+        `token_limit` tokens. The system prompt and the latest `keep_messages`
+        messages are kept verbatim.
+
+        Only messages appended after the summarized turns may be added until
+        `compacted` swaps the summary in.
+
+        Returns:
+            bool: whether a summary was started
+        """
+        if self._compaction is not None or self.turn_tokens <= token_limit:
+            return False
+
+        # keep whole turns: the kept messages start with a user message
+        records = self.records()
+        cut = len(records) - keep_messages
+        while cut > 1 and records[cut].role != "user":
+            cut -= 1
+        if cut < 3:
+            return False
+
+        future = _summary_executor.submit(
+            _background_summary, [record.as_dict() for record in records[1:cut]], self.model_name
+        )
+        self._compaction = (future, cut)
+        return True
+
+    def compacted(self, wait: bool = False) -> "History":
+        """
+        The history with its older turns replaced by their background summary.
+
+        Args:
+            wait (bool): wait for a running summary instead of skipping it
+
+        Returns:
+            History: a new, shorter history if the summary is ready, else this history
+        """
+        if self._compaction is None:
+            return self
+        future, cut = self._compaction
+        if not wait and not future.done():
+            return self
+        self._compaction = None
+
+        try:
+            summary = future.result()
+        except Exception as e:
+            print(f"Background summary failed: {e}")
+            return self
+        if not summary:
+            return self
+
+        # the kept messages are linked again after the summary, their tokens are not counted again
+        records = self.records()
+        history = History._from(records[0], self.model_name)
+        history.extend([SUMMARY_QUESTION, {"role": "assistant", "content": summary}])
+        for record in records[cut:]:
+            history.last = Message(record.role, record.content, record.tokens, history.last)
+        return history
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo: dict) -> "History":
+        # records are immutable
+        return self.copy()
+
 
 def SQL_question_message(
         question: str, 
         feedback: str = None, 
         history: list[dict] = None, 
-        model_name: str = 'gpt-4o'
+        model_name: str = 'gpt-4o',
+        schema_prompt: str = ""
     ) -> list[dict]:
     """
     Construct a prompt message for LLM to generate a SQL query.
 
+    The system rules and the schema form the first message, which stays the
+    same for the whole conversation, and turns are only ever appended after
+    it so LLM servers can reuse the cached prefix of the previous prompt.
+
     Args:
-        schema_info (str): A string representing the schema of a database. 
         question (str): The user's question.
         feedback (str): The feedback prompt to LLM.
+        history (list[dict]): The conversation so far, None for a new conversation.
+        schema_prompt (str): The schema of the database. Ends the system prompt of a new 
+            conversation, and is appended to the question of a follow-up (tables not sent yet).
 
     Returns:
-        Tuple(list[dict], list[dict]): A list of message in a format for input to an LLM.
+        list[dict]: A list of message in a format for input to an LLM.
     """
 
     content = f"""
@@ -32,22 +321,15 @@ def SQL_question_message(
     Please take into consideration while generating response."""
     
     if history is None:
-        messages = [
-            {"role": "system", "content": """
-    You are a helpful assistant for generating SQL queries.
-    Adhere to these rules:
-    - **Deliberately go through the question and database schema word by word** to appropriately answer the question.
-    - **Use Table Aliases** to prevent ambiguity. For example, `SELECT table1.col1, table2.col1 FROM table1 JOIN table2 ON table1.id = table2.id`.
-    - When creating a ratio, always cast the numerator as float.
-    - Pay attention to **use only the column names that you see in the schema description**.
-    - Pay attention to **which column is in which table**."""}, 
+        messages = History([
+            {"role": "system", "content": SQL_SYSTEM_PROMPT + schema_prompt}, 
             {"role": "user", "content": content}
-        ]
+        ], model_name)
 
         return messages
     # given history, add instruction
     else:
-        return _chat_history(content, history, model_name)
+        return _chat_history(content + schema_prompt, history, model_name)
         
 
 def question_answer_message(
@@ -56,21 +338,33 @@ def question_answer_message(
         result: list[Tuple], 
         history: list[dict] = None, 
         model_name: str = 'gpt-4o', 
+        row_count: int = None,
+        summary: ResultSummary = None,
     ) -> list[dict]:
     """
     Construct a prompt message for the LLM to generate answers based on the SQL query result.
 
+    Results larger than `RESULT_LIMIT` rows are described by the statistics of
+    their columns when a summary is given, followed by a sample of their
+    leading rows, within `RESULT_SUMMARY_TOKENS`.
+
     Args:
         question (str): The user's question.
         query (str): The SQL query obtained from LLM response.
-        result (list[Tuple]): The result of the SQL query execution.
+        result (list[Tuple]): The result of the SQL query execution, or its leading rows.
+        row_count (int): The total number of rows in the result, defaults to `len(result)`.
+        summary (ResultSummary): Statistics of the result columns.
 
     Returns:
         list[dict]: A list of message in a format for input to an LLM.
     """
+    if row_count is None:
+        row_count = len(result)
 
-    if len(result) > RESULT_LIMIT:
-        result = str(result[:RESULT_LIMIT])[:-1] + f", ..., which has {len(result)} number of rows."
+    if row_count > RESULT_LIMIT and summary is not None and summary.columns:
+        result = _summarized_result(result, summary, model_name)
+    elif row_count > RESULT_LIMIT:
+        result = str(result[:RESULT_LIMIT])[:-1] + f", ..., which has {row_count} number of rows."
 
     content = f"""
     Given the following user question, corresponding SQL query,
@@ -84,6 +378,20 @@ def question_answer_message(
     return _chat_history(content, history, model_name)
 
 
+def _summarized_result(result: list[Tuple], summary: ResultSummary, model_name: str) -> str:
+    """
+    Describe a large result by its column statistics and its first rows,
+    halving the rows until the description fits in `RESULT_SUMMARY_TOKENS`.
+    """
+    description = summary.describe()
+    num_rows = min(RESULT_SAMPLE_ROWS, len(result))
+    while True:
+        text = description + (f"\nFirst {num_rows} rows: {result[:num_rows]}" if num_rows else "")
+        if not num_rows or message_tokens({"role": "user", "content": text}, model_name) <= RESULT_SUMMARY_TOKENS:
+            return text
+        num_rows //= 2
+
+
 def _chat_history(
         content: str, 
         history: list[dict], 
@@ -99,24 +407,40 @@ def _chat_history(
     1. Refer to preivous response to provide contextually relevant answers.
     2. If a question or statement directly relates to something in the past, refer back to it explicitly."""
 
-    # Token checker and summarizer
-    if count_tokens(history, model_name) > INPUT_TOKEN_LIMIT and len(history) > 5:
+    # swap in the summary computed in the background, waiting for it only
+    # if the history is over the hard limit; the question is appended to a
+    # copy, which shares the messages of the conversation
+    if isinstance(history, History):
+        history = history.compacted(wait=history.turn_tokens > INPUT_TOKEN_LIMIT).copy()
+    else:
+        history = History(history, model_name)
+
+    # Token checker and summarizer, the system prompt (with the schema) is always kept
+    with span("prompt", messages=len(history)) as prompt_span:
+        if isinstance(history, History) and history.model_name == model_name:
+            history_tokens = history.turn_tokens
+        else:
+            history_tokens = count_tokens(history[1:], model_name)
+        prompt_span.set(tokens=int(history_tokens))
+
+    if history_tokens > INPUT_TOKEN_LIMIT and len(history) > 5:
 
         # long term memory includes system prompt
         long_term_memory = history[0]
         # short term memory includes LLM response and user questions
         short_term_memory = history[1:]
 
-        summary_question = {"role": "user", "content": "Summarize my previous conversation into a brief summary."}
-        summary_response = {"role": "assistant", "content": summarizer(short_term_memory, model_name)}
+        with span("summarize", messages=len(short_term_memory), tokens=int(history_tokens)):
+            summary_response = {"role": "assistant", "content": summarizer(short_term_memory, model_name)}
 
-        new_history = [long_term_memory]
-        new_history.append(summary_question)
-        new_history.append(summary_response)
-        history = new_history
+        history = History([long_term_memory, SUMMARY_QUESTION, summary_response], model_name)
 
     history.append({"role": "user", "content": content})
 
+    # summarize the older turns while this question is answered
+    if BACKGROUND_SUMMARY and isinstance(history, History):
+        history.compact_in_background()
+
     return history
 
 
@@ -134,19 +458,11 @@ def count_tokens(
     Returns:
         int: The total number of tokens in the messages.
     """
-    if model_name[:3].lower() == 'gpt':
-        try:
-            encoding = tiktoken.encoding_for_model(model_name)
-        except KeyError:
-            # default tokenizer
-            encoding = tiktoken.get_encoding("cl100k_base")
+    if isinstance(messages, History) and messages.model_name == model_name:
+        return messages.tokens
 
-        token_count = 0
-        for message in messages:
-            token_count += len(encoding.encode(message["role"]))
-            token_count += len(encoding.encode(message["content"]))
-            # structural tokens 
-            token_count += 2 
+    if _is_openai(model_name):
+        token_count = sum(message_tokens(message, model_name) for message in messages)
 
         # for general structure token
         token_count += 3
@@ -157,6 +473,38 @@ def count_tokens(
         return word_count(messages)
 
 
+def _is_openai(model_name: str) -> bool:
+    return model_name[:3].lower() == 'gpt'
+
+
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    """
+    Get the tiktoken encoding of an OpenAI model, cached per model.
+    """
+    encoding = _encodings.get(model_name)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # default tokenizer
+            encoding = tiktoken.get_encoding("cl100k_base")
+        with _encodings_lock:
+            _encodings[model_name] = encoding
+    return encoding
+
+
+def message_tokens(message: dict, model_name: str) -> float:
+    """
+    Count the tokens of a single message, see `count_tokens`.
+    """
+    if _is_openai(model_name):
+        encoding = get_encoding(model_name)
+        # structural tokens
+        return len(encoding.encode(message["role"])) + len(encoding.encode(message["content"])) + 2
+
+    return len(f"{message['role']}: {message['content']}".split()) * WORD_TOKEN_CORRECTION
+
+
 def word_count(messages: list[dict]) -> int:
     """
     Count the number of words in messages prompt
@@ -168,14 +516,16 @@ def word_count(messages: list[dict]) -> int:
     Returns:
         int: Estimated number of tokens based on word count.
     """
-    # a heuristic estimation correction
-    TOKEN_CORRECTION = 4/3
-
     word_count = 0
     for message in messages:
         content = f"{message['role']}: {message['content']}"
         word_count += len(content.split()) 
-    return word_count * TOKEN_CORRECTION
+    return word_count * WORD_TOKEN_CORRECTION
+
+
+def _background_summary(messages: list[dict], model_name: str) -> str:
+    with span("summarize", messages=len(messages), background=True):
+        return summarizer(messages, model_name)
 
 
 def summarizer(messages: list[dict], model_name: str) -> str:
@@ -0,0 +1,81 @@
+import psycopg2
+
+from db_utils import estimate_sql, limit_sql, is_read_query
+from utils import GUARD_MAX_ROWS, GUARD_LIMIT, GUARD_MAX_COST, GUARD_ACTION
+
+ACTIONS = ("reject", "ask", "run")
+
+
+class GuardVerdict:
+    """
+    What to do with a generated query according to the planner estimates.
+
+    Attributes:
+        action (str): `run`, `limit` (run `sql`, the query wrapped in a LIMIT),
+            `reject` (regenerate the query) or `ask` (the user whether to run it)
+        sql (str): the statement to run
+        cost (float): estimated planner cost of the query, None if it was not planned
+        rows (float): estimated number of rows of the query, None if it was not planned
+        reason (str): why the query was limited, rejected or needs confirmation
+    """
+
+    __slots__ = ("action", "sql", "cost", "rows", "reason")
+
+    def __init__(self, action: str, sql: str, cost: float = None, rows: float = None, reason: str = None):
+        self.action = action
+        self.sql = sql
+        self.cost = cost
+        self.rows = rows
+        self.reason = reason
+
+    def as_dict(self) -> dict:
+        return {"action": self.action, "cost": self.cost, "rows": self.rows, "reason": self.reason}
+
+
+def check_query(
+        sql_statement: str,
+        db_name: str,
+        max_rows: float = GUARD_MAX_ROWS,
+        limit: int = GUARD_LIMIT,
+        max_cost: float = GUARD_MAX_COST,
+        action: str = GUARD_ACTION
+    ) -> GuardVerdict:
+    """
+    Pre-flight check of a query with `EXPLAIN (FORMAT JSON)`.
+
+    Queries whose estimated cost is above `max_cost`, such as accidental
+    cross joins or unbounded scans feeding a sort, get the configured
+    `action`. Cheaper queries estimated to return more than `max_rows` rows
+    are wrapped in a LIMIT. Statements other than queries, and queries the
+    server cannot plan, are left to the execution to report.
+
+    Args:
+        sql_statement (str): the generated SQL statement
+        db_name (str): the database to plan it on
+        max_rows (float): estimated rows above which a LIMIT is added
+        limit (int): the number of rows of the added LIMIT, 0 to never add one
+        max_cost (float): planner cost above which `action` applies
+        action (str): `reject`, `ask` or `run`
+
+    Returns:
+        GuardVerdict: the action and the statement to run
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Invalid guard action '{action}', expected one of {', '.join(ACTIONS)}")
+    if not is_read_query(sql_statement):
+        return GuardVerdict("run", sql_statement)
+
+    try:
+        estimate = estimate_sql(sql_statement, db_name)
+    except psycopg2.Error:
+        return GuardVerdict("run", sql_statement)
+
+    rows, cost = estimate["rows"], estimate["cost"]
+    verdict = GuardVerdict("run", sql_statement, cost=cost, rows=rows)
+    if limit and rows > max_rows and estimate["node"] != "Limit":
+        verdict.action, verdict.sql = "limit", limit_sql(sql_statement, limit)
+        verdict.reason = f"estimated {rows:,.0f} rows, limited to {limit:,}"
+    if cost > max_cost and action != "run":
+        verdict.action = action
+        verdict.reason = f"estimated cost {cost:,.0f} exceeds {max_cost:,.0f} ({rows:,.0f} rows)"
+    return verdict
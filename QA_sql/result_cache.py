@@ -0,0 +1,178 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Tuple
+
+from sql_lexer import classify, tokenize
+from utils import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL
+
+_IDENTIFIER_PATTERN = re.compile(r'"([^"]+)"|([A-Za-z_][\w$]*)')
+
+
+def normalize_sql(sql_statement: str) -> str:
+    """
+    Normalize the whitespace, comments and trailing semicolons of a SQL
+    statement. Tokens are kept as written, so string literals and quoted
+    identifiers keep their whitespace.
+    """
+    tokens = list(tokenize(sql_statement))
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    parts, last_end = [], None
+    for _, text, start in tokens:
+        # tokens that were apart (whitespace or a comment between them) stay apart
+        if last_end is not None and start != last_end:
+            parts.append(" ")
+        parts.append(text)
+        last_end = start + len(text)
+    return "".join(parts)
+
+
+def _identifiers(sql_statement: str) -> set[str]:
+    return {
+        (quoted or bare.lower()) for quoted, bare in _IDENTIFIER_PATTERN.findall(sql_statement)
+    }
+
+
+def write_targets(sql_statement: str) -> set[str] | None:
+    """
+    Tables modified by a write statement.
+
+    Returns:
+        set[str]: unqualified names of the modified tables, or None if they could not be 
+        determined, in which case every table should be considered modified.
+    """
+    targets = set()
+    for statement in classify(sql_statement):
+        if statement.targets is None:
+            # e.g. TRUNCATE of several tables, DROP SCHEMA
+            return None
+        targets |= statement.targets
+    return targets or None
+
+
+class CachedResult:
+    """A cache hit: the cached value and its age in seconds."""
+
+    __slots__ = ("value", "age")
+
+    def __init__(self, value: Any, age: float):
+        self.value = value
+        self.age = age
+
+
+class ResultCache:
+    """
+    In-memory LRU cache of query results, bounded by an estimate of their size in bytes.
+
+    Entries are keyed by database and normalized SQL and expire after their
+    TTL. Every entry remembers the identifiers used by its query, so a write
+    to a table drops exactly the entries that may read it.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (value, size, expires, created, identifiers)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def estimate_size(value: Any) -> int:
+        """
+        Rough size in bytes of nested tuples/lists of scalar values.
+        """
+        size = sys.getsizeof(value)
+        if isinstance(value, (list, tuple)):
+            size += sum(ResultCache.estimate_size(item) for item in value)
+        return size
+
+    def get(self, db_name: str, sql_statement: str) -> CachedResult | None:
+        """
+        Look up the cached result of a statement.
+
+        Returns:
+            CachedResult: the cached value and its age, or None on a miss.
+        """
+        key = (db_name, normalize_sql(sql_statement))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return CachedResult(entry[0], now - entry[3])
+
+    def put(self, db_name: str, sql_statement: str, value: Any, ttl: float = None):
+        """
+        Cache the result of a read-only statement.
+
+        Args:
+            db_name (str): The database the statement ran on.
+            sql_statement (str): The executed statement.
+            value (Any): The result to cache.
+            ttl (float): Seconds the entry stays valid, defaults to the cache TTL.
+        """
+        size = self.estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        key = (db_name, normalize_sql(sql_statement))
+        now = time.monotonic()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires, now, _identifiers(sql_statement))
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, db_name: str, tables: set[str] | None = None) -> int:
+        """
+        Drop the entries of a database that may read the given tables.
+
+        Args:
+            db_name (str): The database that was modified.
+            tables (set[str]): Unqualified names of the modified tables, None drops
+                every entry of the database.
+
+        Returns:
+            int: number of dropped entries.
+        """
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if key[0] == db_name and (tables is None or entry[4] & tables)
+            ]
+            for key in stale:
+                self._remove(key)
+        return len(stale)
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters, number of entries and their estimated size in bytes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,183 @@
+import datetime
+import decimal
+from collections import Counter
+from typing import Tuple
+
+import numpy as np
+
+from utils import RESULT_TOP_K
+
+# columns with more distinct values stop counting them, only min/max are kept
+MAX_TRACKED_VALUES = 10000
+
+# longest value shown in a summary, in characters
+MAX_VALUE_WIDTH = 40
+
+_NUMERIC_TYPES = (int, float, decimal.Decimal)
+_ORDERED_TYPES = (datetime.date, datetime.time, datetime.datetime, datetime.timedelta)
+# json objects and arrays, as psycopg2 returns them
+_UNHASHABLE_TYPES = (dict, list)
+
+
+def _value(value) -> str:
+    text = repr(value) if isinstance(value, str) else str(value)
+    return text if len(text) <= MAX_VALUE_WIDTH else text[:MAX_VALUE_WIDTH - 3] + "..."
+
+
+def _number(value: float) -> str:
+    if abs(value) >= 1e15:
+        return f"{value:.4g}"
+    if float(value).is_integer() or abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:.4g}"
+
+
+class ColumnSummary:
+    """
+    Running statistics of one result column, updated a batch of values at a time.
+
+    Numbers get their min, max and mean, dates and times their min and max,
+    and other values (text, booleans...) the counts of their most frequent
+    values. Values that cannot be counted (json objects, arrays) only get
+    their number of nulls.
+    """
+
+    __slots__ = ("name", "kind", "count", "nulls", "min", "max", "total", "values")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.kind = None        # "number", "ordered", "category" or "other", from the first value seen
+        self.count = 0          # non null values
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.values = Counter()     # None once the column has too many distinct values
+
+    def add(self, values: Tuple):
+        """
+        Add a batch of values of the column.
+        """
+        if self.kind is None:
+            first = next((value for value in values if value is not None), None)
+            if first is None:
+                self.nulls += len(values)
+                return
+            if isinstance(first, _NUMERIC_TYPES) and not isinstance(first, bool):
+                self.kind = "number"
+            elif isinstance(first, _ORDERED_TYPES):
+                self.kind = "ordered"
+            elif isinstance(first, _UNHASHABLE_TYPES):
+                self._uncounted()
+            else:
+                self.kind = "category"
+
+        if self.kind == "number":
+            try:
+                # nulls become NaN, in C for ints, floats and decimals alike
+                numbers = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                # e.g. a json column holding numbers, then objects or strings
+                self._uncounted()
+            else:
+                present = numbers[~np.isnan(numbers)]
+                self.nulls += len(numbers) - len(present)
+                if len(present):
+                    self.count += len(present)
+                    self.total += float(present.sum())
+                    self._extend(float(present.min()), float(present.max()))
+                return
+
+        present = [value for value in values if value is not None]
+        self.nulls += len(values) - len(present)
+        if not present:
+            return
+        self.count += len(present)
+        if self.kind == "ordered":
+            try:
+                self._extend(min(present), max(present))
+            except TypeError:
+                # e.g. dates and strings, or dates and datetimes
+                self._uncounted()
+        elif self.values is not None:
+            try:
+                self.values.update(present)
+            except TypeError:
+                # e.g. a json column whose first values were strings
+                self._uncounted()
+                return
+            if len(self.values) > MAX_TRACKED_VALUES:
+                self.values = None
+
+    def _extend(self, low, high):
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def _uncounted(self):
+        """Values of several types that cannot be compared nor counted: only count the values and nulls."""
+        self.kind = "other"
+        self.values = None
+
+    def describe(self, top_k: int = RESULT_TOP_K) -> str:
+        """
+        One line description, e.g. `amount: min 0.5, max 99.5, mean 50, 12 null`.
+        """
+        parts = []
+        if self.kind == "number":
+            parts.append(f"min {_number(self.min)}, max {_number(self.max)}, mean {_number(self.total / self.count)}")
+        elif self.kind == "ordered":
+            parts.append(f"min {_value(self.min)}, max {_value(self.max)}")
+        elif self.kind == "category":
+            if self.values is None:
+                parts.append(f"more than {MAX_TRACKED_VALUES:,} distinct values")
+            else:
+                top = ", ".join(f"{_value(value)} ({count:,})" for value, count in self.values.most_common(top_k))
+                parts.append(f"{len(self.values):,} distinct values, most frequent {top}")
+        elif self.kind == "other" and self.count:
+            parts.append(f"{self.count:,} values")
+        if self.nulls:
+            parts.append(f"{self.nulls:,} null")
+        return f"{self.name}: " + (", ".join(parts) if parts else "no values")
+
+
+class ResultSummary:
+    """
+    Per-column statistics of a query result, accumulated while its rows are
+    streamed so that the whole result never has to be kept in memory.
+
+        summary = ResultSummary()
+        preview_sql(sql_statement, db_name, num_rows, summary=summary)
+        summary.describe()
+
+    Attributes:
+        row_count (int): rows seen
+        total_rows (int): rows of the whole result, if more than the rows seen (counted on the server)
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.row_count = 0
+        self.total_rows = None
+
+    def add(self, batch: list[Tuple], columns_header: list[str]):
+        """
+        Add a batch of rows.
+        """
+        if not batch:
+            return
+        if self.columns is None:
+            self.columns = [ColumnSummary(name) for name in columns_header]
+        self.row_count += len(batch)
+        for column, values in zip(self.columns, zip(*batch)):
+            column.add(values)
+
+    def describe(self, top_k: int = RESULT_TOP_K) -> str:
+        """
+        Compact description of the result: its number of rows and one line per column.
+        """
+        if self.total_rows is not None and self.total_rows > self.row_count:
+            lines = [f"{self.total_rows:,} rows, statistics over the first {self.row_count:,}:"]
+        else:
+            lines = [f"{self.row_count:,} rows:"]
+        lines.extend(f"- {column.describe(top_k)}" for column in self.columns or [])
+        return "\n".join(lines)
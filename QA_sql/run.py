@@ -1,5 +1,4 @@
 import argparse
-from app import *
 
 def main():
     parser = argparse.ArgumentParser(
@@ -19,13 +18,45 @@ def main():
         required=True,
         help="The database to connect with.",
     )
+    parser.add_argument(
+        "--refresh_schema",
+        action="store_true",
+        help="Ignore the cached database schema and introspect every table again.",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        help="Answer the questions of a JSONL file without opening the window.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="JSONL file of the batch results, defaults to <batch>_answers.jsonl.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of questions answered concurrently in batch mode.",
+    )
 
     args = parser.parse_args()
 
-    sql_app = App(args.model_name, args.database_name)
+    if args.batch:
+        # batch mode runs headless, tkinter is not imported
+        from batch import run_batch
+        from utils import BATCH_WORKERS
+
+        run_batch(
+            args.model_name, args.database_name, args.batch, args.output,
+            workers=args.workers or BATCH_WORKERS, refresh_schema=args.refresh_schema
+        )
+        return
+
+    from app import App
+
+    sql_app = App(args.model_name, args.database_name, refresh_schema=args.refresh_schema)
     sql_app.run()
 
 
 if __name__ == "__main__":
     main()
-
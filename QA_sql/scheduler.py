@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from utils import SERVER_WORKERS, SERVER_SESSION_QUEUE, SERVER_MAX_QUEUE
+
+
+class Overloaded(Exception):
+    """
+    Raised when a job is refused because too many jobs are waiting.
+
+    Attributes:
+        scope (str): `session` if the session has too many jobs waiting, `server` if all sessions together do
+        retry_after (float): seconds after which the job may be submitted again
+    """
+
+    def __init__(self, scope: str, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """
+    Runs the jobs of many sessions on a fixed number of threads.
+
+    A session runs one job at a time, in the order it submitted them, so its
+    conversation is never updated concurrently. Threads pick the next job
+    from the sessions in turn, so a session with many waiting jobs delays
+    the others by at most one job each. Queues are bounded: a session with
+    `session_queue` jobs waiting, or a scheduler with `max_queue` jobs
+    waiting, refuses new jobs with `Overloaded` instead of letting them pile up.
+
+        scheduler = FairScheduler(workers=8)
+        future = scheduler.submit(session_id, pipeline.ask, question)
+    """
+
+    def __init__(
+            self,
+            workers: int = SERVER_WORKERS,
+            session_queue: int = SERVER_SESSION_QUEUE,
+            max_queue: int = SERVER_MAX_QUEUE
+        ):
+        self.session_queue = session_queue
+        self.max_queue = max_queue
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()    # session -> deque of (future, fn, args, kwargs), in turn order
+        self._running = set()           # sessions with a running job
+        self._queued = 0
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"qa_sql_server_{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, session_id: Any, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queue `fn(*args, **kwargs)` behind the other jobs of the session.
+
+        Raises:
+            Overloaded: if the session or the scheduler has too many jobs waiting
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            queue = self._queues.get(session_id)
+            if queue is not None and len(queue) >= self.session_queue:
+                raise Overloaded("session", f"{len(queue)} requests of the session are already waiting")
+            if self._queued >= self.max_queue:
+                raise Overloaded("server", f"{self._queued} requests are already waiting")
+            if queue is None:
+                queue = self._queues[session_id] = deque()
+            queue.append((future, fn, args, kwargs))
+            self._queued += 1
+            self._condition.notify()
+        return future
+
+    def _next(self):
+        # first session in turn without a running job, it then goes to the end of the turn
+        for session_id, queue in self._queues.items():
+            if session_id not in self._running:
+                job = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(session_id)
+                else:
+                    del self._queues[session_id]
+                self._queued -= 1
+                return session_id, job
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while (entry := self._next()) is None:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                session_id, (future, fn, args, kwargs) = entry
+                self._running.add(session_id)
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running.discard(session_id)
+                    # the next job of the session may be runnable now
+                    self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """Number of worker threads, running jobs, waiting jobs and sessions with waiting jobs."""
+        with self._condition:
+            return {
+                "workers": len(self._threads),
+                "running": len(self._running),
+                "queued": self._queued,
+                "waiting_sessions": len(self._queues),
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Cancel the waiting jobs and stop the threads once the running jobs are done."""
+        with self._condition:
+            self._closed = True
+            queues, self._queues = self._queues, OrderedDict()
+            self._queued = 0
+            self._condition.notify_all()
+        for queue in queues.values():
+            for future, *_ in queue:
+                future.cancel()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,71 @@
+import json
+import os
+import re
+import tempfile
+import threading
+
+from utils import DB_HOST, DB_PORT, SCHEMA_CACHE_DIR
+
+# bump when the layout of cached table entries changes
+CACHE_VERSION = 1
+
+
+class SchemaCache:
+    """
+    On-disk cache of introspected table definitions for one database.
+
+    Entries are keyed by table oid and carry the catalog fingerprint they were
+    built from, so callers can tell which tables changed since the last run.
+    """
+
+    def __init__(self, db_name: str, cache_dir: str = SCHEMA_CACHE_DIR):
+        self.db_name = db_name
+        safe_name = re.sub(r"[^\w.-]", "_", f"{DB_HOST}_{DB_PORT}_{db_name}")
+        self.path = os.path.join(os.path.expanduser(cache_dir), f"{safe_name}.json")
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, dict]:
+        """
+        Load cached table entries.
+
+        Returns:
+            dict[str, dict]: table entries keyed by oid, empty if there is no usable cache.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if data.get("version") != CACHE_VERSION:
+            return {}
+        return data.get("tables", {})
+
+    def save(self, tables: dict[str, dict]):
+        """
+        Atomically replace the cache file with the given table entries.
+
+        Args:
+            tables (dict[str, dict]): table entries keyed by oid.
+        """
+        directory = os.path.dirname(self.path)
+        with self._lock:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"version": CACHE_VERSION, "tables": tables}, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                # the cache is an optimization, never fail schema loading because of it
+                print(f"Failed to write schema cache {self.path}: {e}")
+
+    def clear(self):
+        """
+        Delete the cache file.
+        """
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,139 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+from utils import SCHEMA_TOP_K
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# a table name match counts as much as this many column name matches
+TABLE_NAME_WEIGHT = 3
+
+_SPLIT_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text and identifiers (snake_case, camelCase) into lowercase terms.
+
+    Plural endings are stripped so `customers` matches `customer`.
+    """
+    tokens = []
+    for word in _SPLIT_PATTERN.findall(text):
+        word = word.lower()
+        if len(word) > 3 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class SchemaIndex:
+    """
+    BM25 index over table names, column names and foreign key targets.
+
+    Used to pick the tables relevant to a question so that only their
+    `CREATE TABLE` statements are sent to the LLM.
+    """
+
+    def __init__(self, tables: list[dict]):
+        """
+        Args:
+            tables (list[dict]): table entries as returned by `db_utils.get_schema_tables`.
+        """
+        self.tables = tables
+        self.names = [table["name"] for table in tables]
+        position = {name: i for i, name in enumerate(self.names)}
+
+        # foreign key edges in both directions
+        self.neighbours = [set() for _ in tables]
+        for i, table in enumerate(tables):
+            for _, target_table, _ in table["foreign_keys"]:
+                j = position.get(target_table)
+                if j is not None and j != i:
+                    self.neighbours[i].add(j)
+                    self.neighbours[j].add(i)
+
+        # term -> (document ids, term frequencies)
+        postings = {}
+        doc_lengths = np.zeros(len(tables), dtype=np.float64)
+        for i, table in enumerate(tables):
+            terms = tokenize(table["name"]) * TABLE_NAME_WEIGHT
+            for column, _ in table["columns"]:
+                terms += tokenize(column)
+            for _, target_table, _ in table["foreign_keys"]:
+                terms += tokenize(target_table)
+
+            doc_lengths[i] = len(terms)
+            for term, freq in Counter(terms).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(i)
+                postings[term][1].append(freq)
+
+        num_docs = max(len(tables), 1)
+        avg_length = doc_lengths.mean() if len(tables) else 1.0
+        length_norm = K1 * (1 - B + B * doc_lengths / max(avg_length, 1e-9))
+
+        # precompute the BM25 weight of every posting
+        self._postings = {}
+        for term, (doc_ids, freqs) in postings.items():
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+            freqs = np.asarray(freqs, dtype=np.float64)
+            idf = np.log(1 + (num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            weights = idf * freqs * (K1 + 1) / (freqs + length_norm[doc_ids])
+            self._postings[term] = (doc_ids, weights)
+
+    def scores(self, question: str) -> np.ndarray:
+        """
+        BM25 score of every table for the question.
+        """
+        scores = np.zeros(len(self.tables), dtype=np.float64)
+        for term in set(tokenize(question)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                doc_ids, weights = posting
+                scores[doc_ids] += weights
+        return scores
+
+    def select(
+            self,
+            question: str,
+            top_k: int = SCHEMA_TOP_K,
+            include: list[str] = None
+        ) -> list[str]:
+        """
+        Select the tables relevant to a question.
+
+        Args:
+            question (str): The user's question.
+            top_k (int): Number of best matching tables to keep.
+            include (list[str]): Table names that are always selected, e.g. tables used
+                earlier in the conversation.
+
+        Returns:
+            list[str]: Names of the top-k tables and their foreign key neighbours, in
+            schema order. Empty if no table matches the question.
+        """
+        scores = self.scores(question)
+        matched = np.flatnonzero(scores > 0)
+        best = matched[np.argsort(-scores[matched], kind="stable")[:top_k]]
+
+        selected = set(best.tolist())
+        for i in best:
+            selected |= self.neighbours[i]
+        if include:
+            position = {name: i for i, name in enumerate(self.names)}
+            selected |= {position[name] for name in include if name in position}
+
+        return [self.names[i] for i in sorted(selected)]
+
+    def schema(self, table_names: list[str]) -> str:
+        """
+        The `CREATE TABLE` statements of the given tables.
+        """
+        wanted = set(table_names)
+        return "\n\n".join(table["create"] for table in self.tables if table["name"] in wanted)
@@ -0,0 +1,398 @@
+import argparse
+import json
+import queue
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# local files
+from LLM import close_clients
+from llm_backends import backend_stats
+from cancellation import CancelToken, cancellation
+from db_pool import close_pools
+from db_utils import detect_keyword
+from metrics import trace
+from pipeline import QAPipeline, PipelineObserver, extract_sql
+from scheduler import FairScheduler, Overloaded
+from sessions import Session, SessionManager
+from utils import (
+    DISPLAY_ROWS, SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_SESSION_QUEUE, SERVER_MAX_QUEUE,
+    SERVER_SESSION_TTL, SERVER_SESSION_MEMORY_MB, SERVER_SESSION_SPILL_DIR
+)
+
+_ROUTE_PATTERN = re.compile(r"^/sessions/([\w-]+)(?:/(ask|generate|execute|answer|cancel))?/?$")
+
+# seconds without an event after which an empty line is sent, to notice clients that went away
+HEARTBEAT_INTERVAL = 5.0
+
+_DONE = object()
+
+
+class _StreamObserver(PipelineObserver):
+    """
+    Turns the progress of a request into events, read by the thread streaming the response.
+    """
+
+    def __init__(self, events: queue.Queue, confirmed: bool):
+        self.events = events
+        self.confirmed = confirmed
+
+    def status(self, text: str):
+        if text:
+            self.events.put({"event": "status", "text": text})
+
+    def sql_generated(self, question: str, sql_statement: str):
+        self.events.put({"event": "sql", "sql": sql_statement})
+
+    def result(self, rows, col_header, row_count, truncated, cache_age):
+        self.events.put({
+            "event": "result", "columns": col_header, "rows": rows, "row_count": row_count,
+            "truncated": truncated, "cache_age": cache_age,
+        })
+
+    def token(self, chunk: str):
+        self.events.put({"event": "token", "text": chunk})
+
+    def error(self, title: str, message: str):
+        self.events.put({"event": "error", "message": message})
+
+    def confirm(self, title: str, message: str) -> bool:
+        # there is nobody to ask in the middle of a request, it is confirmed up front
+        return self.confirmed
+
+
+class QAServer:
+    """
+    HTTP service answering the questions of many concurrent sessions.
+
+    Every session shares the same pipeline, i.e. the schema, the SQL and
+    result caches, the database connection pools and the LLM clients, while
+    keeping its own conversation. Requests run on a `FairScheduler`: a
+    bounded number of workers serves the sessions in turn, and requests
+    beyond the queue limits are refused with 429 (session) or 503 (server).
+
+    Endpoints, request and response bodies are JSON:
+
+        POST   /sessions                 -> {"session": id}
+        DELETE /sessions/<id>
+        POST   /sessions/<id>/ask        {"question", "confirm"?}   question -> SQL -> result -> answer
+        POST   /sessions/<id>/generate   {"question"}               LLM response containing SQL
+        POST   /sessions/<id>/execute    {"sql"?, "confirm"?}       run a statement, defaults to the SQL of the last response
+        POST   /sessions/<id>/answer     {"sql"?, "confirm"?}       run it and answer the last question
+        POST   /sessions/<id>/cancel     cancel the running and waiting requests of the session
+        POST   /ask                      {"question"}               standalone question, without a session
+        GET    /health
+
+    The question endpoints stream newline-delimited JSON events (`status`,
+    `sql`, `result`, `token`, `error`) ending with a `done` event holding
+    the result. Writes, and queries the cost guard would ask about, only
+    run with `"confirm": true`. A client closing the connection cancels its request.
+
+    Conversations are kept by a `SessionManager`, which moves idle sessions
+    to `session_spill_dir` beyond `session_memory_mb` of history.
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            db_name: str,
+            refresh_schema: bool = False,
+            host: str = SERVER_HOST,
+            port: int = SERVER_PORT,
+            workers: int = SERVER_WORKERS,
+            session_queue: int = SERVER_SESSION_QUEUE,
+            max_queue: int = SERVER_MAX_QUEUE,
+            session_ttl: float = SERVER_SESSION_TTL,
+            session_memory_mb: float = SERVER_SESSION_MEMORY_MB,
+            session_spill_dir: str = SERVER_SESSION_SPILL_DIR,
+        ):
+        self.model_name = model_name
+        self.db_name = db_name
+        self.pipeline = QAPipeline(model_name, db_name, refresh_schema=refresh_schema)
+        self.scheduler = FairScheduler(workers, session_queue, max_queue)
+        self.sessions = SessionManager(model_name, session_ttl, session_memory_mb, session_spill_dir)
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.qa_server = self
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        print(f"Serving {self.db_name} with {self.model_name} at {self.url}")
+        self.httpd.serve_forever()
+
+    def start(self) -> "QAServer":
+        """Serve on a daemon thread."""
+        threading.Thread(target=self.httpd.serve_forever, name="qa_sql_server", daemon=True).start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.sessions.close_all()
+        self.scheduler.shutdown()
+        self.pipeline.close()
+
+    # ---sessions---
+
+    def create_session(self, token: CancelToken = None) -> Session:
+        return self.sessions.create(token)
+
+    def session(self, session_id: str, token: CancelToken = None) -> Session | None:
+        return self.sessions.get(session_id, token)
+
+    def close_session(self, session_id: str) -> bool:
+        return self.sessions.close(session_id)
+
+    def stats(self) -> dict:
+        return {**self.sessions.stats(), **self.scheduler.stats(), "llm": backend_stats()}
+
+    # ---requests, run by the scheduler---
+
+    def ask(self, session: Session, body: dict, observer: _StreamObserver, token: CancelToken) -> dict:
+        return self.pipeline.ask(_required(body, "question"), session.conversation, observer, cancel_token=token)
+
+    def generate(self, session: Session, body: dict, observer: _StreamObserver, token: CancelToken) -> dict:
+        question = _required(body, "question")
+        conversation = session.conversation
+        with trace("generate_response", model=self.model_name, db=self.db_name) as response_trace, \
+                cancellation(token):
+            new_history, _ = self.pipeline.sql_prompt(question, conversation)
+            chunks = []
+            for chunk in self.pipeline.llm(new_history, stream=True):
+                observer.token(chunk)
+                chunks.append(chunk)
+
+            conversation.question = question
+            conversation.response = "".join(chunks)
+            conversation.history = new_history
+            conversation.history.append({"role": "assistant", "content": conversation.response})
+            conversation.num_conversation += 1
+        return {
+            "question": question, "response": conversation.response,
+            "sql": extract_sql(conversation.response), "trace": response_trace.summary(),
+        }
+
+    def _checked_sql(self, session: Session, body: dict, observer: _StreamObserver) -> str:
+        sql_statement = body.get("sql") or extract_sql(session.conversation.response or "")
+        if not sql_statement:
+            raise ValueError("No SQL statement given and no SQL query found in the last response.")
+        keyword = detect_keyword(sql_statement)
+        if keyword is not None and not observer.confirmed:
+            raise PermissionError(f"The statement performs '{keyword}', send it again with \"confirm\": true to run it.")
+        verdict = self.pipeline.guard(sql_statement, observer)
+        if verdict.action == "reject":
+            raise PermissionError(f"The SQL statement was not executed, {verdict.reason}.")
+        return verdict.sql
+
+    def execute(self, session: Session, body: dict, observer: _StreamObserver, token: CancelToken) -> dict:
+        with trace("execute", model=self.model_name, db=self.db_name) as execute_trace, cancellation(token):
+            sql_statement = self._checked_sql(session, body, observer)
+            rows, col_header, row_count, truncated, cache_age, _ = self.pipeline.execute(sql_statement)
+        return {
+            "sql": sql_statement, "columns": col_header, "rows": rows[:DISPLAY_ROWS], "row_count": row_count,
+            "truncated": truncated, "result_from_cache": cache_age is not None, "trace": execute_trace.summary(),
+        }
+
+    def answer(self, session: Session, body: dict, observer: _StreamObserver, token: CancelToken) -> dict:
+        if session.conversation.question is None:
+            raise ValueError("No question to answer, generate a response first.")
+        result = {"question": session.conversation.question}
+        with trace("extract_and_execute", model=self.model_name, db=self.db_name) as execute_trace, \
+                cancellation(token):
+            sql_statement = self._checked_sql(session, body, observer)
+            result["sql"] = sql_statement
+            self.pipeline.execute_and_answer(sql_statement, session.conversation, observer, result)
+        result["trace"] = execute_trace.summary()
+        return result
+
+
+def _required(body: dict, key: str) -> str:
+    value = body.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"Missing '{key}'.")
+    return value.strip()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server_version = "QA_SQL"
+
+    @property
+    def qa_server(self) -> QAServer:
+        return self.server.qa_server
+
+    def _json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> dict | None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self._json(400, {"error": "expected a JSON object"})
+            return None
+        return body
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._json(200, {"status": "ok", **self.qa_server.stats()})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        match = _ROUTE_PATTERN.match(self.path)
+        if match is None or match.group(2) is not None:
+            self._json(404, {"error": "not found"})
+        elif self.qa_server.close_session(match.group(1)):
+            self._json(200, {"session": match.group(1), "closed": True})
+        else:
+            self._json(404, {"error": "unknown session"})
+
+    def do_POST(self):
+        server = self.qa_server
+        path = self.path.rstrip("/")
+        if path == "/sessions":
+            self._json(201, {"session": server.create_session().id})
+            return
+        # the session is busy with the request from now on, so it is not moved to disk while the body is read
+        token = CancelToken()
+        if path == "/ask":
+            # standalone question, in a session of its own
+            session, action, temporary = server.create_session(token), "ask", True
+        else:
+            match = _ROUTE_PATTERN.match(self.path)
+            if match is None or match.group(2) is None:
+                self._json(404, {"error": "not found"})
+                return
+            action, temporary = match.group(2), False
+            session = server.session(match.group(1), None if action == "cancel" else token)
+            if session is None:
+                self._json(404, {"error": "unknown session"})
+                return
+        try:
+            if action == "cancel":
+                session.cancel()
+                self._json(200, {"session": session.id, "cancelled": True})
+                return
+            body = None
+            try:
+                body = self._body()
+            finally:
+                if body is None:
+                    # no request to run
+                    session.tokens.discard(token)
+            if body is not None:
+                self._stream(session, getattr(server, action), body, token)
+        finally:
+            if temporary:
+                server.close_session(session.id)
+
+    def _stream(self, session: Session, handler, body: dict, token: CancelToken):
+        """
+        Run a request on the scheduler and stream its events as they are produced.
+        `token`, already among the tokens of the session, is removed once the request is done.
+        """
+        events = queue.Queue()
+        observer = _StreamObserver(events, confirmed=bool(body.get("confirm")))
+
+        def _run():
+            try:
+                result = handler(session, body, observer, token)
+                events.put({"event": "done", **result})
+            except BaseException as e:
+                events.put({"event": "done", "error": "cancelled" if token.cancelled else str(e)})
+            finally:
+                session.tokens.discard(token)
+                self.qa_server.sessions.release(session)
+                events.put(_DONE)
+
+        try:
+            future = self.qa_server.scheduler.submit(session.id, _run)
+        except Overloaded as e:
+            session.tokens.discard(token)
+            status = 429 if e.scope == "session" else 503
+            self._json(status, {"error": str(e)}, {"Retry-After": f"{e.retry_after:.0f}"})
+            return
+        # a request cancelled while waiting never runs
+        future.add_done_callback(lambda f: events.put(_DONE) if f.cancelled() else None)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b"\n")
+                    self.wfile.flush()
+                    continue
+                if event is _DONE:
+                    break
+                self.wfile.write(json.dumps(event, default=str).encode() + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client went away, stop working on its request
+            future.cancel()
+            token.cancel()
+        finally:
+            # a request that ran releases the session itself
+            if future.cancelled():
+                session.tokens.discard(token)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve SQL question answering over HTTP to many concurrent sessions."
+    )
+    parser.add_argument("-m", "--model_name", type=str, required=True, help="LLM model to be used for.")
+    parser.add_argument("-d", "--database_name", type=str, required=True, help="The database to connect with.")
+    parser.add_argument(
+        "--refresh_schema",
+        action="store_true",
+        help="Ignore the cached database schema and introspect every table again.",
+    )
+    parser.add_argument("--host", type=str, default=SERVER_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to listen on.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SERVER_WORKERS,
+        help="Number of requests processed concurrently, for all sessions together.",
+    )
+    args = parser.parse_args()
+
+    server = QAServer(
+        args.model_name, args.database_name, refresh_schema=args.refresh_schema,
+        host=args.host, port=args.port, workers=args.workers
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        close_pools()
+        close_clients()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# local files
+from cancellation import CancelToken
+from pipeline import Conversation
+from prompt import History
+from utils import SERVER_SESSION_TTL, SERVER_SESSION_MEMORY_MB, SERVER_SESSION_SPILL_DIR
+
+# bytes of a message record and its strings besides their characters
+MESSAGE_OVERHEAD = 250
+
+_SESSION_ID_PATTERN = re.compile(r"^[\w-]+$")
+
+
+class Session:
+    """
+    One user of the service: a conversation and the cancellation tokens of its requests.
+    """
+
+    __slots__ = ("id", "conversation", "tokens", "last_used")
+
+    def __init__(self, session_id: str, conversation: Conversation = None):
+        self.id = session_id
+        self.conversation = conversation if conversation is not None else Conversation()
+        self.tokens = set()
+        self.last_used = time.monotonic()
+
+    def cancel(self):
+        for token in list(self.tokens):
+            token.cancel()
+
+    @property
+    def busy(self) -> bool:
+        """Whether one of its requests is waiting or running."""
+        return bool(self.tokens)
+
+
+def _footprint(conversation: Conversation) -> tuple:
+    """
+    The first message of the conversation history, shared with other
+    conversations, and an estimate of the bytes of the rest of it.
+    """
+    size = len(conversation.response or "") + len(conversation.question or "")
+    history = conversation.history
+    if not isinstance(history, History) or history.last is None:
+        return None, size
+    first = history.last.first
+    return first, size + history.chars - first.chars + (len(history) - 1) * MESSAGE_OVERHEAD
+
+
+class SessionManager:
+    """
+    The conversations of many concurrent sessions, within a memory budget.
+
+    Conversations store their messages as shared `History` records: the
+    system prompt holding the schema is stored once for all sessions, and a
+    turn only adds its own messages. When the histories go over
+    `memory_mb`, the least recently used sessions without a running request
+    are written to `spill_dir` and dropped from memory; they are read back
+    when used again. Sessions idle for more than `ttl` seconds are closed,
+    in memory and on disk.
+
+        sessions = SessionManager("llama3")
+        session = sessions.create()
+        ...
+        sessions.release(session)   # after each request, accounts its new messages
+
+    Args:
+        model_name (str): the model counting the tokens of the restored histories
+        ttl (float): seconds an idle session is kept
+        memory_mb (float): megabytes of conversation history kept in memory
+        spill_dir (str): directory of the sessions moved to disk, empty to close them instead
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            ttl: float = SERVER_SESSION_TTL,
+            memory_mb: float = SERVER_SESSION_MEMORY_MB,
+            spill_dir: str = SERVER_SESSION_SPILL_DIR
+        ):
+        self.model_name = model_name
+        self.ttl = ttl
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self.spill_dir = os.path.expanduser(spill_dir) if spill_dir else None
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # id -> Session, least recently used first
+        self._footprints = {}           # id -> (first message, bytes of the rest of the history)
+        self._roots = {}                # first message -> number of sessions sharing it
+        self._memory = 0                # bytes of the histories in memory, first messages counted once
+        self._spilled = {}              # id -> time it was last used, for the sessions on disk
+        self.spills = 0
+        self.restores = 0
+
+    # ---memory accounting, with the lock held---
+
+    def _account(self, session: Session):
+        first, size = _footprint(session.conversation)
+        old_first, old_size = self._footprints.get(session.id, (None, 0))
+        self._memory += size - old_size
+        if first is not old_first:
+            self._release_root(old_first)
+            if first is not None:
+                count = self._roots.get(first, 0)
+                if count == 0:
+                    self._memory += len(first.content) + MESSAGE_OVERHEAD
+                self._roots[first] = count + 1
+        self._footprints[session.id] = (first, size)
+
+    def _release_root(self, first):
+        if first is None:
+            return
+        count = self._roots.pop(first) - 1
+        if count:
+            self._roots[first] = count
+        else:
+            self._memory -= len(first.content) + MESSAGE_OVERHEAD
+
+    def _forget(self, session_id: str) -> Session | None:
+        session = self._sessions.pop(session_id, None)
+        first, size = self._footprints.pop(session_id, (None, 0))
+        self._memory -= size
+        self._release_root(first)
+        return session
+
+    # ---sessions---
+
+    def create(self, token: CancelToken = None) -> Session:
+        """
+        A new session, busy with the request of `token` if given, see `get`.
+        """
+        session = Session(uuid.uuid4().hex)
+        if token is not None:
+            session.tokens.add(token)
+        with self._lock:
+            self._sessions[session.id] = session
+        self._expire()
+        return session
+
+    def get(self, session_id: str, token: CancelToken = None) -> Session | None:
+        """
+        The session, read back from disk if it was moved there. Marks it as used.
+
+        Args:
+            session_id (str): the session
+            token (CancelToken): the token of a request about to run on the session.
+                It is added to the tokens of the session, making it busy so that
+                it is not moved to disk before the request runs. The request
+                removes it when done.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and session_id in self._spilled:
+                session = self._restore(session_id)
+            if session is None:
+                return None
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            if token is not None:
+                session.tokens.add(token)
+        return session
+
+    def release(self, session: Session):
+        """
+        Account the messages a request added to the conversation of the
+        session, and move idle sessions to disk if over the memory budget.
+        """
+        with self._lock:
+            if self._sessions.get(session.id) is not session:
+                # closed meanwhile
+                return
+            session.last_used = time.monotonic()
+            self._account(session)
+            self._enforce_budget()
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._forget(session_id)
+            spilled = self._spilled.pop(session_id, None) is not None
+        if spilled:
+            self._remove_spill(session_id)
+        if session is None:
+            return spilled
+        session.cancel()
+        return True
+
+    def close_all(self):
+        """Cancel the requests of every session and forget them, the sessions on disk are deleted."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            spilled = list(self._spilled)
+            self._sessions.clear()
+            self._footprints.clear()
+            self._roots.clear()
+            self._spilled.clear()
+            self._memory = 0
+        for session in sessions:
+            session.cancel()
+        for session_id in spilled:
+            self._remove_spill(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions) + len(self._spilled),
+                "sessions_in_memory": len(self._sessions),
+                "sessions_on_disk": len(self._spilled),
+                "session_memory_bytes": self._memory,
+                "shared_prompts": len(self._roots),
+                "spills": self.spills,
+                "restores": self.restores,
+            }
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                session.id for session in self._sessions.values()
+                if now - session.last_used > self.ttl and not session.busy
+            ]
+            for session_id in expired:
+                self._forget(session_id)
+            expired_on_disk = [session_id for session_id, last_used in self._spilled.items() if now - last_used > self.ttl]
+            for session_id in expired_on_disk:
+                del self._spilled[session_id]
+        for session_id in expired_on_disk:
+            self._remove_spill(session_id)
+
+    # ---spilling, with the lock held---
+
+    def _enforce_budget(self):
+        if self._memory <= self.memory_budget:
+            return
+        for session in list(self._sessions.values()):
+            if self._memory <= self.memory_budget:
+                break
+            if session.busy:
+                continue
+            if self.spill_dir is not None and self._spill(session):
+                self._spilled[session.id] = session.last_used
+                self.spills += 1
+            self._forget(session.id)
+
+    def _path(self, session_id: str) -> str:
+        if not _SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _spill(self, session: Session) -> bool:
+        conversation = session.conversation
+        history = conversation.history
+        state = {
+            "history": history.dump() if isinstance(history, History) else history,
+            "session_tables": conversation.session_tables,
+            "num_conversation": conversation.num_conversation,
+            "question": conversation.question,
+            "response": conversation.response,
+        }
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._path(session.id))
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Failed to move session {session.id} to disk, closing it: {e}")
+            return False
+
+    def _restore(self, session_id: str) -> Session | None:
+        last_used = self._spilled.pop(session_id)
+        path = self._path(session_id)
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read session {session_id} from disk: {e}")
+            return None
+
+        conversation = Conversation()
+        if state["history"] is not None:
+            # the token counts are stored, they are not computed again
+            conversation.history = History.load(state["history"], self.model_name)
+        conversation.session_tables = state["session_tables"]
+        conversation.num_conversation = state["num_conversation"]
+        conversation.question = state["question"]
+        conversation.response = state["response"]
+
+        session = Session(session_id, conversation)
+        session.last_used = last_used
+        self._sessions[session_id] = session
+        self._account(session)
+        self.restores += 1
+        return session
+
+    def _remove_spill(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except OSError:
+            pass
@@ -0,0 +1,287 @@
+import re
+from typing import Iterator, Tuple
+
+# one alternative per token kind, tried at the current position after skipping whitespace
+_TOKEN_PATTERN = re.compile(r"""\s*(?:
+      (?P<comment>--[^\n]*)
+    | (?P<block>/\*)
+    | (?P<string>[Ee]'(?:[^'\\]|\\.|'')*'?|(?:[BbXxNn]|[Uu]&)?'(?:[^']|'')*'?)
+    | (?P<dollar>\$(?:[^\W\d][\w]*)?\$)
+    | (?P<param>\$\d+)
+    | (?P<quoted>(?:[Uu]&)?"(?:[^"]|"")*"?)
+    | (?P<word>[^\W\d][\w$]*)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[Ee][+-]?\d+)?)
+    | (?P<op>::|[^\s])
+)?""", re.VERBOSE | re.DOTALL)
+
+_BLOCK_PATTERN = re.compile(r"/\*|\*/")
+
+# statements that return rows and can be declared as a server-side cursor
+QUERY_COMMANDS = frozenset({"SELECT", "WITH", "VALUES", "TABLE"})
+
+# statements that modify the database or the session
+WRITE_COMMANDS = frozenset({
+    "INSERT", "UPDATE", "DELETE", "MERGE", "TRUNCATE", "COPY", "CREATE", "DROP", "ALTER", "GRANT", "REVOKE",
+    "COMMENT", "SECURITY", "VACUUM", "ANALYZE", "CLUSTER", "REINDEX", "REFRESH", "LOCK", "CALL", "DO",
+    "SET", "RESET", "DISCARD", "LOAD", "IMPORT", "REASSIGN", "CHECKPOINT", "PREPARE", "EXECUTE", "DEALLOCATE",
+    "LISTEN", "UNLISTEN", "NOTIFY", "BEGIN", "START", "COMMIT", "END", "ROLLBACK", "ABORT", "SAVEPOINT", "RELEASE",
+})
+
+# functions with side effects, refused in read-only transactions or outside of the database
+WRITE_FUNCTIONS = frozenset({
+    "nextval", "setval", "set_config", "pg_terminate_backend", "pg_cancel_backend", "pg_reload_conf",
+    "pg_rotate_logfile", "pg_switch_wal", "pg_create_restore_point", "lo_import", "lo_export", "lo_create",
+    "lo_unlink", "lo_put", "lo_from_bytea", "dblink_exec", "pg_file_write", "pg_file_unlink", "pg_file_rename",
+})
+
+# words between a write command and the table it modifies
+_TARGET_PREFIX = {
+    "INSERT": {"INTO"},
+    "UPDATE": {"ONLY"},
+    "DELETE": {"FROM", "ONLY"},
+    "MERGE": {"INTO"},
+    "COPY": set(),
+    "INTO": {"TEMP", "TEMPORARY", "UNLOGGED", "TABLE"},
+    "TABLE": {"IF", "NOT", "EXISTS", "ONLY"},
+}
+
+# words between CREATE, DROP or ALTER and the type of object
+_OBJECT_MODIFIERS = frozenset({
+    "OR", "REPLACE", "TEMP", "TEMPORARY", "UNLOGGED", "GLOBAL", "LOCAL", "UNIQUE", "MATERIALIZED", "RECURSIVE",
+})
+
+
+def tokenize(sql_statement: str, comments: bool = False) -> Iterator[Tuple[str, str, int]]:
+    """
+    Split SQL text into tokens, in a single pass.
+
+    String literals (including `E''` escapes and `$tag$` dollar quoting),
+    quoted identifiers and comments (including nested block comments) are
+    single tokens, so the keywords they contain are never mistaken for SQL.
+    Unterminated literals and comments run to the end of the text.
+
+    Args:
+        sql_statement (str): the SQL text
+        comments (bool): whether to yield the comments, they are skipped by default
+
+    Yields:
+        tuple: the kind (`word`, `quoted`, `string`, `number`, `param`, `op`
+        or `comment`), the text and the offset of each token
+    """
+    pos, end = 0, len(sql_statement)
+    match = _TOKEN_PATTERN.match
+    while pos < end:
+        token = match(sql_statement, pos)
+        kind, pos = token.lastgroup, token.end()
+        if kind is None:
+            # trailing whitespace
+            break
+        start = token.start(kind)
+
+        if kind == "block":
+            depth = 1
+            while depth:
+                delimiter = _BLOCK_PATTERN.search(sql_statement, pos)
+                if delimiter is None:
+                    pos = end
+                    break
+                depth += 1 if delimiter.group() == "/*" else -1
+                pos = delimiter.end()
+            kind = "comment"
+        elif kind == "dollar":
+            close = sql_statement.find(token.group(), pos)
+            pos = end if close < 0 else close + len(token.group())
+            kind = "string"
+
+        if kind != "comment" or comments:
+            yield kind, sql_statement[start:pos], start
+
+
+class Statement:
+    """
+    One statement of SQL text, as classified by `classify`.
+
+    Attributes:
+        command (str): its first keyword in upper case, e.g. `SELECT` or `WITH`
+        write (str): the first operation found that modifies the database or
+            the session, e.g. `DELETE`, `DROP TABLE`, `SELECT INTO`,
+            `FOR UPDATE` or `nextval()`, None for a read-only statement
+        targets (set[str]): unqualified names of the tables it modifies, None
+            if they cannot be determined (e.g. `TRUNCATE a, b` or `DROP SCHEMA`)
+        start (int): offset of its first token in the text
+        end (int): offset just past its last token, before the semicolon
+    """
+
+    __slots__ = ("command", "write", "targets", "start", "end")
+
+    def __init__(self, start: int):
+        self.command = None
+        self.write = None
+        self.targets = set()
+        self.start = start
+        self.end = start
+
+    @property
+    def is_query(self) -> bool:
+        """Whether it is a query (SELECT, WITH, VALUES, TABLE) that modifies nothing."""
+        return self.command in QUERY_COMMANDS and self.write is None
+
+    def _found(self, write: str, known_targets: bool = True):
+        if self.write is None:
+            self.write = write
+        if not known_targets:
+            self.targets = None
+
+    def _target(self, name: str, replaces: str = None):
+        if self.targets is not None:
+            self.targets.discard(replaces)
+            self.targets.add(name)
+
+
+# positions of a word in a statement
+_STATEMENT, _NESTED = 1, 2
+
+# write commands allowed in a sub-statement, i.e. a data-modifying CTE
+_NESTED_WRITE_COMMANDS = frozenset({"INSERT", "UPDATE", "DELETE", "MERGE"})
+
+# words between EXPLAIN and the statement it explains, besides an option list in parentheses
+_EXPLAIN_OPTIONS = frozenset({"EXPLAIN", "ANALYZE", "VERBOSE"})
+
+
+def _name(kind: str, text: str) -> str:
+    if kind == "quoted":
+        return text[text.index('"') + 1:].rstrip('"').replace('""', '"')
+    return text.lower()
+
+
+def classify(sql_statement: str) -> list[Statement]:
+    """
+    Split SQL text into statements and find what each of them modifies, in
+    one pass over its tokens.
+
+    Write commands count at the start of a statement, and INSERT, UPDATE,
+    DELETE and MERGE at the start of a sub-statement too (data-modifying
+    CTEs, such as `WITH d AS (DELETE ...)` or `WITH ... DELETE`), but not
+    in other parentheses, where they are names (`SELECT (delete) FROM t`). Locking
+    clauses, `SELECT INTO`, `EXPLAIN ANALYZE` of a write and calls of
+    functions with side effects count as writes as well. Keywords inside
+    string literals, quoted identifiers and comments are ignored.
+
+    Args:
+        sql_statement (str): the SQL text, possibly several statements
+
+    Returns:
+        list[Statement]: the non-empty statements, in order
+    """
+    statements = []
+    statement = None
+    for kind, text, start in tokenize(sql_statement):
+        if statement is None:
+            if kind == "op" and text == ";":
+                continue
+            statement = Statement(start)
+            depth = 0
+            position = _STATEMENT   # whether the next word starts a (sub-)statement
+            previous = None         # previous token, upper-cased if a word
+            object_of = None        # CREATE, DROP or ALTER waiting for its object type
+            target_of = None        # key of _TARGET_PREFIX waiting for the target table
+            target = None           # the target just read, None once another token follows
+            qualified = False       # a `.` follows the target, the next name replaces it
+            analyze = False         # EXPLAIN with the ANALYZE option
+            explained = False       # the statement explained by EXPLAIN started
+
+        if kind == "op" and text == ";":
+            statements.append(statement)
+            statement = None
+            continue
+        statement.end = start + len(text)
+        last_target, target = target, None
+
+        if kind == "word" or kind == "quoted":
+            word = text.upper() if kind == "word" else None
+            if statement.command is None:
+                statement.command = word
+
+            if target_of is not None or qualified:
+                if word not in _TARGET_PREFIX.get(target_of, ()):
+                    target = _name(kind, text)
+                    statement._target(target, replaces=last_target if qualified else None)
+                    target_of, qualified = None, False
+            elif kind == "quoted":
+                pass
+            elif object_of is not None:
+                if word not in _OBJECT_MODIFIERS:
+                    statement._found(f"{object_of} {word}", known_targets=word == "TABLE")
+                    target_of = "TABLE" if word == "TABLE" else None
+                    object_of = None
+            elif statement.command == "EXPLAIN" and word == "ANALYZE":
+                analyze = True
+            elif (
+                (position == _STATEMENT or statement.command == "EXPLAIN" and depth == 0 and not explained)
+                and word in WRITE_COMMANDS
+                or position == _NESTED and word in _NESTED_WRITE_COMMANDS
+            ) and (statement.command != "EXPLAIN" or analyze):
+                if word in ("CREATE", "DROP", "ALTER"):
+                    object_of = word
+                else:
+                    statement._found(word, known_targets=word in _TARGET_PREFIX)
+                    target_of = word if word in _TARGET_PREFIX else None
+            elif word in ("UPDATE", "SHARE") and previous in ("FOR", "KEY"):
+                statement._found(f"FOR {word}")
+            elif word == "INTO" and depth == 0 and statement.write is None and statement.command in QUERY_COMMANDS:
+                statement._found("SELECT INTO")
+                target_of = "INTO"
+            if statement.command == "EXPLAIN" and depth == 0 and word not in _EXPLAIN_OPTIONS:
+                explained = True
+            position = None
+            previous = word or text
+
+        elif kind == "op":
+            position = None
+            if text == "(":
+                if previous is not None and previous.lower() in WRITE_FUNCTIONS:
+                    statement._found(f"{previous.lower()}()", known_targets=False)
+                depth += 1
+                # the body of a CTE: `AS (`, `AS [NOT] MATERIALIZED (`
+                if previous in ("AS", "MATERIALIZED"):
+                    position = _NESTED
+                target_of = None
+            elif text == ")":
+                depth = max(depth - 1, 0)
+                # the statement using the CTEs follows their definitions
+                if depth == 0 and statement.command == "WITH":
+                    position = _NESTED
+            elif text == "." and last_target is not None:
+                qualified, target = True, last_target
+            elif text == "," and depth == 0 and statement.write in ("DROP TABLE", "TRUNCATE"):
+                statement.targets = None
+            previous = text
+
+        else:
+            position = None
+            previous = text
+
+    if statement is not None:
+        statements.append(statement)
+    return statements
+
+
+def write_keyword(sql_statement: str) -> str | None:
+    """
+    The first operation of SQL text that modifies the database or the session, None if there is none.
+    """
+    for statement in classify(sql_statement):
+        if statement.write is not None:
+            return statement.write
+    return None
+
+
+def single_query(sql_statement: str) -> str | None:
+    """
+    The text of the query if the SQL text holds a single query that modifies
+    nothing, without its semicolon and trailing comments, None otherwise.
+    """
+    statements = classify(sql_statement)
+    if len(statements) != 1 or not statements[0].is_query:
+        return None
+    return sql_statement[statements[0].start:statements[0].end]
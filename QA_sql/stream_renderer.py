@@ -0,0 +1,149 @@
+import threading
+import time
+import tkinter as tk
+
+from utils import STREAM_FLUSH_MS
+
+
+class StreamRenderer:
+    """
+    Coalesce streamed LLM chunks into periodic writes to a Text widget.
+
+    Worker threads `write` chunks into a buffer. The main thread flushes the
+    buffer every `flush_interval` milliseconds with a single insert and a
+    single scroll, so a fast model cannot make redrawing the widget the
+    bottleneck.
+
+    Between `begin` and `end` the renderer counts chunks (roughly one token
+    each) as they are received and as they reach the screen. The rates of
+    the last stream are kept in `last_stats`.
+    """
+
+    def __init__(self, root, text_widget: tk.Text, flush_interval: int = STREAM_FLUSH_MS):
+        self.root = root
+        self.text_widget = text_widget
+        self.flush_interval = flush_interval
+        self.last_stats = None
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._pending_tokens = 0
+        self._stream = None
+        self._closed = False
+        self.root.after(self.flush_interval, self._tick)
+
+    def begin(self):
+        """
+        Start measuring a new stream. Safe to call from any thread.
+        """
+        with self._lock:
+            self._stream = {
+                "received": 0,
+                "displayed": 0,
+                "flushes": 0,
+                "start": time.perf_counter(),
+                "last_received": None,
+                "last_displayed": None,
+                "ended": False,
+            }
+
+    def write(self, text: str, token: bool = False):
+        """
+        Queue text for display. Safe to call from any thread.
+
+        Args:
+            text (str): the text to append.
+            token (bool): count the text as a streamed token of the current stream.
+        """
+        with self._lock:
+            self._buffer.append(text)
+            if token and self._stream is not None:
+                self._pending_tokens += 1
+                self._stream["received"] += 1
+                self._stream["last_received"] = time.perf_counter()
+
+    def end(self):
+        """
+        Mark the current stream as complete, its statistics are reported after the final flush.
+        Safe to call from any thread.
+        """
+        with self._lock:
+            if self._stream is not None:
+                self._stream["ended"] = True
+
+    def flush(self):
+        """
+        Write the buffered text to the widget. Must be called on the main thread.
+        """
+        with self._lock:
+            if not self._buffer and not (self._stream and self._stream["ended"]):
+                return
+            text = "".join(self._buffer)
+            self._buffer.clear()
+            tokens, self._pending_tokens = self._pending_tokens, 0
+            stream = self._stream
+
+        if text:
+            self.text_widget.config(state=tk.NORMAL)
+            self.text_widget.insert(tk.END, text)
+            self.text_widget.yview(tk.END)
+            self.text_widget.config(state=tk.DISABLED)
+
+        if stream is not None:
+            if tokens:
+                stream["displayed"] += tokens
+                stream["flushes"] += 1
+                stream["last_displayed"] = time.perf_counter()
+            if stream["ended"]:
+                self._report(stream)
+
+    def _report(self, stream: dict):
+        with self._lock:
+            if self._stream is stream:
+                self._stream = None
+
+        if not stream["received"] or stream["last_displayed"] is None:
+            # nothing reached the screen, e.g. the widget was cleared meanwhile
+            return
+        receive_time = stream["last_received"] - stream["start"]
+        display_time = stream["last_displayed"] - stream["start"]
+        self.last_stats = {
+            "tokens": stream["received"],
+            "flushes": stream["flushes"],
+            "received_tokens_per_sec": stream["received"] / receive_time if receive_time > 0 else 0.0,
+            "displayed_tokens_per_sec": stream["displayed"] / display_time if display_time > 0 else 0.0,
+            "display_lag": max(stream["last_displayed"] - stream["last_received"], 0.0),
+        }
+        print(
+            f"Streamed {self.last_stats['tokens']} tokens in {self.last_stats['flushes']} redraws: "
+            f"{self.last_stats['received_tokens_per_sec']:.1f} tokens/s received, "
+            f"{self.last_stats['displayed_tokens_per_sec']:.1f} tokens/s displayed."
+        )
+
+    def clear(self):
+        """
+        Drop buffered text and clear the widget, ending the measure of the current
+        stream. Must be called on the main thread.
+        """
+        with self._lock:
+            self._buffer.clear()
+            self._pending_tokens = 0
+            self._stream = None
+        self.text_widget.config(state=tk.NORMAL)
+        self.text_widget.delete("1.0", tk.END)
+        self.text_widget.config(state=tk.DISABLED)
+
+    def _tick(self):
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            # a failed flush must not stop the timer, the text would no longer be shown
+            self.root.after(self.flush_interval, self._tick)
+
+    def close(self):
+        """
+        Stop the flush timer.
+        """
+        self._closed = True
@@ -14,7 +14,108 @@ API_KEY = parser.get("api_key", "api_key")
 
 # app
 MAX_RETRY = int(parser.get("app", "max_retry"))
+DISPLAY_ROWS = int(parser.get("app", "display_rows", fallback="500"))
+PAGE_SIZE = int(parser.get("app", "page_size", fallback="100"))
+MAX_CELL_WIDTH = int(parser.get("app", "max_cell_width", fallback="40"))
+WORKER_THREADS = int(parser.get("app", "worker_threads", fallback="4"))
+POLL_INTERVAL_MS = int(parser.get("app", "poll_interval_ms", fallback="20"))
+STREAM_FLUSH_MS = int(parser.get("app", "stream_flush_ms", fallback="40"))
+EARLY_SQL = parser.getboolean("app", "early_sql", fallback=True)
 
 # prompt
 RESULT_LIMIT = int(parser.get("prompt", "result_limit"))
+RESULT_SUMMARY = parser.getboolean("prompt", "result_summary", fallback=True)
+RESULT_TOP_K = int(parser.get("prompt", "result_top_k", fallback="3"))
+RESULT_SAMPLE_ROWS = int(parser.get("prompt", "result_sample_rows", fallback="5"))
+RESULT_SUMMARY_TOKENS = int(parser.get("prompt", "result_summary_tokens", fallback="1024"))
 INPUT_TOKEN_LIMIT = int(parser.get("prompt", "input_token_limit"))
+BACKGROUND_SUMMARY = parser.getboolean("prompt", "background_summary", fallback=True)
+SUMMARY_TOKEN_LIMIT = int(parser.get("prompt", "summary_token_limit", fallback="12288"))
+SUMMARY_KEEP_MESSAGES = int(parser.get("prompt", "summary_keep_messages", fallback="6"))
+
+# cache
+SQL_CACHE = parser.getboolean("cache", "sql_cache", fallback=True)
+SQL_CACHE_PATH = parser.get("cache", "sql_cache_path", fallback="~/.cache/qa_sql/sql_cache.sqlite3")
+SQL_CACHE_MAX_ENTRIES = int(parser.get("cache", "sql_cache_max_entries", fallback="1000"))
+SQL_CACHE_TTL = float(parser.get("cache", "sql_cache_ttl", fallback="86400"))
+RESULT_CACHE = parser.getboolean("cache", "result_cache", fallback=True)
+RESULT_CACHE_MAX_BYTES = int(parser.get("cache", "result_cache_max_bytes", fallback="67108864"))
+RESULT_CACHE_TTL = float(parser.get("cache", "result_cache_ttl", fallback="300"))
+
+# llm
+OLLAMA_URL = parser.get("llm", "ollama_url", fallback="http://localhost:11434/api/chat")
+OLLAMA_KEEP_ALIVE = parser.get("llm", "ollama_keep_alive", fallback="30m")
+LLM_POOL_CONNECTIONS = int(parser.get("llm", "pool_connections", fallback="4"))
+LLM_POOL_MAXSIZE = int(parser.get("llm", "pool_maxsize", fallback="16"))
+LLM_CONNECT_TIMEOUT = float(parser.get("llm", "connect_timeout", fallback="10"))
+LLM_READ_TIMEOUT = float(parser.get("llm", "read_timeout", fallback="300"))
+LLM_FIRST_TOKEN_TIMEOUT = float(parser.get("llm", "first_token_timeout", fallback="120"))
+LLM_RETRIES = int(parser.get("llm", "retries", fallback="2"))
+LLM_BACKOFF_BASE = float(parser.get("llm", "backoff_base", fallback="0.5"))
+LLM_BACKOFF_MAX = float(parser.get("llm", "backoff_max", fallback="8"))
+LLM_CIRCUIT_FAILURES = int(parser.get("llm", "circuit_failures", fallback="5"))
+LLM_CIRCUIT_RESET = float(parser.get("llm", "circuit_reset", fallback="30"))
+LLM_FALLBACK_MODELS = [
+    value.strip() for value in parser.get("llm", "fallback_models", fallback="").split(",") if value.strip()
+]
+
+# speculative SQL generation
+SPECULATIVE_CANDIDATES = int(parser.get("speculative", "candidates", fallback="1"))
+SPECULATIVE_TEMPERATURES = [
+    float(value) for value in parser.get("speculative", "temperatures", fallback="0.0, 0.5, 0.9").split(",") if value.strip()
+]
+SPECULATIVE_MODELS = [
+    value.strip() for value in parser.get("speculative", "models", fallback="").split(",") if value.strip()
+]
+
+# metrics
+METRICS_LOG_PATH = parser.get("metrics", "log_path", fallback="~/.cache/qa_sql/metrics.jsonl")
+METRICS_LOG_MAX_BYTES = int(parser.get("metrics", "log_max_bytes", fallback="10485760"))
+METRICS_LOG_BACKUPS = int(parser.get("metrics", "log_backups", fallback="3"))
+METRICS_PORT = int(parser.get("metrics", "prometheus_port", fallback="0"))
+METRICS_FILE = parser.get("metrics", "prometheus_file", fallback="")
+
+# batch
+BATCH_WORKERS = int(parser.get("batch", "workers", fallback="4"))
+OLLAMA_CONCURRENCY = int(parser.get("batch", "ollama_concurrency", fallback="2"))
+OPENAI_CONCURRENCY = int(parser.get("batch", "openai_concurrency", fallback="8"))
+DB_CONCURRENCY = int(parser.get("batch", "db_concurrency", fallback="4"))
+
+# server
+SERVER_HOST = parser.get("server", "host", fallback="127.0.0.1")
+SERVER_PORT = int(parser.get("server", "port", fallback="8765"))
+SERVER_WORKERS = int(parser.get("server", "workers", fallback="8"))
+SERVER_SESSION_QUEUE = int(parser.get("server", "session_queue", fallback="4"))
+SERVER_MAX_QUEUE = int(parser.get("server", "max_queue", fallback="64"))
+SERVER_SESSION_TTL = float(parser.get("server", "session_ttl", fallback="3600"))
+SERVER_SESSION_MEMORY_MB = float(parser.get("server", "session_memory_mb", fallback="256"))
+SERVER_SESSION_SPILL_DIR = parser.get("server", "session_spill_dir", fallback="~/.cache/qa_sql/sessions")
+
+# database
+DB_HOST = parser.get("database", "host", fallback="localhost")
+DB_USER = parser.get("database", "user", fallback="postgres")
+DB_PASSWORD = parser.get("database", "password", fallback="admin")
+DB_PORT = int(parser.get("database", "port", fallback="5432"))
+FETCH_BATCH_SIZE = int(parser.get("database", "fetch_batch_size", fallback="2000"))
+MAX_ROWS = int(parser.get("database", "max_rows", fallback="1000000"))
+DB_STATEMENT_TIMEOUT_MS = int(parser.get("database", "statement_timeout_ms", fallback="60000"))
+
+# query guard
+GUARD_ENABLED = parser.getboolean("guard", "enabled", fallback=True)
+GUARD_MAX_ROWS = float(parser.get("guard", "max_rows", fallback="100000"))
+GUARD_LIMIT = int(parser.get("guard", "limit", fallback="1000"))
+GUARD_MAX_COST = float(parser.get("guard", "max_cost", fallback="10000000"))
+GUARD_ACTION = parser.get("guard", "action", fallback="reject").strip().lower()
+
+# schema
+SCHEMA_CACHE_DIR = parser.get("schema", "cache_dir", fallback="~/.cache/qa_sql/schema")
+SCHEMA_PRUNE = parser.getboolean("schema", "prune", fallback=True)
+SCHEMA_TOP_K = int(parser.get("schema", "top_k", fallback="8"))
+SCHEMA_PRUNE_MIN_TABLES = int(parser.get("schema", "prune_min_tables", fallback="20"))
+
+# connection pool
+POOL_MIN_SIZE = int(parser.get("pool", "min_size", fallback="1"))
+POOL_MAX_SIZE = int(parser.get("pool", "max_size", fallback="8"))
+POOL_CHECKOUT_TIMEOUT = float(parser.get("pool", "checkout_timeout", fallback="30"))
+POOL_IDLE_TIMEOUT = float(parser.get("pool", "idle_timeout", fallback="300"))
+POOL_HEALTH_CHECK_INTERVAL = float(parser.get("pool", "health_check_interval", fallback="30"))
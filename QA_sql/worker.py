@@ -0,0 +1,177 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from cancellation import Cancelled, current_token
+from utils import WORKER_THREADS, POLL_INTERVAL_MS
+
+
+class BackgroundWorker:
+    """
+    Run LLM and database work off the Tk main thread.
+
+    Tk widgets may only be touched from the main thread, so worker threads
+    never call into the UI directly. They queue callbacks with `call_soon`,
+    and the main thread runs them while polling the queue with `root.after`.
+
+    Two kinds of jobs are supported:
+    - serial jobs run one at a time in submission order, used for the
+      conversation pipeline so that a queued question sees the history of
+      the previous one;
+    - concurrent jobs run on a small thread pool, used for independent work
+      such as executing a SQL statement typed by the user.
+    """
+
+    def __init__(
+            self,
+            root,
+            max_workers: int = WORKER_THREADS,
+            poll_interval: int = POLL_INTERVAL_MS
+        ):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._callbacks = queue.SimpleQueue()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qa-worker")
+        self._pipeline = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qa-pipeline")
+        self._pending_serial = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._waiting = set()   # events of the `run_on_main` calls waiting for the main thread
+        self.root.after(self.poll_interval, self._poll)
+
+    def submit(
+            self,
+            fn: Callable,
+            *args,
+            on_done: Callable[[Any], None] = None,
+            on_error: Callable[[BaseException], None] = None,
+            serial: bool = False,
+            **kwargs
+        ) -> Future:
+        """
+        Run `fn(*args, **kwargs)` on a worker thread.
+
+        Args:
+            fn (Callable): the work to run.
+            on_done (Callable): called on the main thread with the result.
+            on_error (Callable): called on the main thread with the raised exception.
+            serial (bool): queue behind the other serial jobs instead of running concurrently.
+
+        Returns:
+            Future: the future of the job.
+        """
+        if serial:
+            with self._lock:
+                self._pending_serial += 1
+            future = self._pipeline.submit(fn, *args, **kwargs)
+        else:
+            future = self._executor.submit(fn, *args, **kwargs)
+
+        def _done(future: Future):
+            if serial:
+                with self._lock:
+                    self._pending_serial -= 1
+            self.call_soon(self._finish, future, on_done, on_error)
+
+        future.add_done_callback(_done)
+        return future
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of serial jobs queued or running.
+        """
+        with self._lock:
+            return self._pending_serial
+
+    def call_soon(self, fn: Callable, *args, **kwargs):
+        """
+        Schedule `fn(*args, **kwargs)` on the main thread. Safe to call from any thread.
+        """
+        self._callbacks.put((fn, args, kwargs))
+
+    def run_on_main(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run `fn` on the main thread and wait for its result, e.g. to ask the user for confirmation.
+        Must be called from a worker thread.
+
+        Raises:
+            Cancelled: if the current cancellation token is cancelled or the
+                worker is shut down before `fn` runs, `fn` is then not run
+        """
+        done = threading.Event()
+        outcome = {}
+
+        def _call():
+            if done.is_set():
+                # the caller stopped waiting
+                return
+            try:
+                outcome["result"] = fn(*args, **kwargs)
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        token = current_token()
+        with self._lock:
+            if self._closed:
+                raise Cancelled("ui")
+            self._waiting.add(done)
+        try:
+            self.call_soon(_call)
+            if token is None:
+                done.wait()
+            else:
+                with token.on_cancel(done.set):
+                    done.wait()
+        finally:
+            with self._lock:
+                self._waiting.discard(done)
+        if "error" in outcome:
+            raise outcome["error"]
+        if "result" not in outcome:
+            # woken by the token or by `shutdown`
+            done.set()
+            raise Cancelled("ui")
+        return outcome["result"]
+
+    def _finish(self, future: Future, on_done: Callable, on_error: Callable):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                print(f"Background job failed: {error!r}")
+        elif on_done is not None:
+            on_done(future.result())
+
+    def _poll(self):
+        if self._closed:
+            return
+        while True:
+            try:
+                fn, args, kwargs = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"UI callback failed: {e!r}")
+        self.root.after(self.poll_interval, self._poll)
+
+    def shutdown(self):
+        """
+        Stop polling and drop the queued jobs, running jobs finish in the background.
+        Jobs waiting in `run_on_main` are woken with `Cancelled`.
+        """
+        with self._lock:
+            self._closed = True
+            waiting = list(self._waiting)
+        for done in waiting:
+            done.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pipeline.shutdown(wait=False, cancel_futures=True)
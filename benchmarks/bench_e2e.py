@@ -0,0 +1,334 @@
+"""
+End-to-end benchmark of the question answering pipeline.
+
+Starts the stub Ollama server (`stub_ollama.py`), seeds fixture databases
+on the configured Postgres server and measures every stage on its own:
+
+    schema_cold     get_schema_tables, introspecting every table
+    schema_warm     get_schema_tables, served from the schema cache
+    schema_info     get_schema_info, the CREATE statements of the whole schema
+    schema_index    building the BM25 index of the schema
+    prompt          SQL_question_message + schema prompt (pruned for large schemas)
+    llm_sql         LLM_response, non streamed
+    llm_ttft        LLM_response, time to the first streamed token
+    execute_sql     execute_sql, every row materialized
+    preview_sql     preview_sql, leading rows kept and the rest counted
+    format_output   format_output of the full result
+    render_page     render_page of the first page
+    ask             QAPipeline.ask, question to answer
+
+over schemas of 10, 500 and 5,000 tables and results of up to millions of
+rows, then the throughput of concurrent questions. p50/p95 of every stage
+are printed and saved to `benchmarks/results/<commit>.json`; `--compare`
+prints the change against an earlier run.
+
+    python benchmarks/bench_e2e.py --db_host localhost --db_password admin
+    python benchmarks/bench_e2e.py --compare benchmarks/results/abc1234.json
+
+The fixture databases (`qa_bench_<tables>`) are created once and reused,
+`--reseed` drops and creates them again.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import utils
+from stub_ollama import StubOllamaServer
+
+WORDS = (
+    "customer", "order", "product", "invoice", "payment", "shipment", "supplier", "warehouse",
+    "employee", "department", "account", "ledger", "campaign", "coupon", "review", "region",
+    "store", "category", "inventory", "refund", "contract", "vendor", "ticket", "session",
+)
+FACTS_TABLE = "bench_facts"
+
+
+def percentiles(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "n": len(samples),
+    }
+
+
+def measure(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def table_names(num_tables: int) -> list[str]:
+    return [
+        f"{WORDS[i % len(WORDS)]}_{WORDS[(i // len(WORDS)) % len(WORDS)]}_{i}" for i in range(num_tables)
+    ]
+
+
+def connect(db_name: str):
+    return psycopg2.connect(
+        database=db_name, host=utils.DB_HOST, user=utils.DB_USER, password=utils.DB_PASSWORD, port=utils.DB_PORT
+    )
+
+
+def seed(num_tables: int, fact_rows: int, reseed: bool) -> str:
+    """
+    Create the fixture database of `num_tables` tables, chained by foreign
+    keys, plus a fact table of `fact_rows` rows. Existing fixtures are reused.
+
+    Returns:
+        str: the database name
+    """
+    db_name = f"qa_bench_{num_tables}"
+    admin = connect("postgres")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (db_name,))
+        exists = cur.fetchone() is not None
+        if exists and reseed:
+            cur.execute(f'DROP DATABASE "{db_name}"')
+            exists = False
+        if not exists:
+            cur.execute(f'CREATE DATABASE "{db_name}"')
+    admin.close()
+
+    conn = connect(db_name)
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM pg_tables WHERE schemaname = 'public'")
+        if cur.fetchone()[0] < num_tables + 1:
+            print(f"Seeding {db_name}: {num_tables} tables...")
+            names = table_names(num_tables)
+            statements = []
+            for i, name in enumerate(names):
+                parent = f", parent_id integer REFERENCES {names[i - 1]} (id)" if i % 5 else ""
+                statements.append(
+                    f"CREATE TABLE IF NOT EXISTS {name} (id serial PRIMARY KEY, name text NOT NULL, "
+                    f"amount numeric(12, 2), created_at timestamp DEFAULT now(){parent})"
+                )
+            # one transaction per chunk, a lock is held per created table
+            for chunk in range(0, len(statements), 200):
+                cur.execute(";\n".join(statements[chunk:chunk + 200]))
+                conn.commit()
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {FACTS_TABLE} (id bigint PRIMARY KEY, name text, "
+                f"amount numeric(12, 2), created_at timestamp)"
+            )
+
+        cur.execute(f"SELECT count(*) FROM {FACTS_TABLE}")
+        if cur.fetchone()[0] < fact_rows:
+            print(f"Seeding {db_name}: {fact_rows} rows...")
+            cur.execute(f"TRUNCATE {FACTS_TABLE}")
+            cur.execute(f"""
+                INSERT INTO {FACTS_TABLE}
+                SELECT i, 'item ' || i, (i %% 10000) / 100.0, timestamp '2024-01-01' + i * interval '1 minute'
+                FROM generate_series(1, %s) AS i""", (fact_rows,))
+            cur.execute(f"ANALYZE {FACTS_TABLE}")
+    conn.close()
+    return db_name
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR, text=True
+        ).strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_schema(db_name: str, num_tables: int, args, results: dict, server):
+    from db_utils import get_schema_tables, get_schema_info
+    from schema_index import SchemaIndex
+    from pipeline import QAPipeline, Conversation
+
+    tag = f"{num_tables}_tables"
+    repeat_cold = max(1, min(args.repeat, 2000 // num_tables))
+    results[f"schema_cold/{tag}"] = measure(lambda: get_schema_tables(db_name, refresh=True), repeat_cold)
+    results[f"schema_warm/{tag}"] = measure(lambda: get_schema_tables(db_name), args.repeat)
+    results[f"schema_info/{tag}"] = measure(lambda: get_schema_info(db_name), args.repeat)
+    tables = get_schema_tables(db_name)
+    results[f"schema_index/{tag}"] = measure(lambda: SchemaIndex(tables), repeat_cold)
+
+    pipeline = QAPipeline(args.model_name, db_name)
+    words = [name.split("_")[:2] for name in table_names(num_tables)]
+    questions = [f"What is the total amount of {a} {b} per day?" for a, b in random.sample(words, min(len(words), 20))]
+
+    results[f"prompt/{tag}"] = measure(
+        lambda: pipeline.sql_prompt(random.choice(questions), Conversation()), args.repeat
+    )
+
+    server.response = f"```sql\nSELECT name, amount FROM {FACTS_TABLE} WHERE id <= 10;\n```"
+    prompt, _ = pipeline.sql_prompt(questions[0], Conversation())
+    results[f"llm_sql/{tag}"] = measure(lambda: pipeline.llm(prompt, stream=False), args.repeat)
+
+    def first_token():
+        stream = pipeline.llm(prompt, stream=True)
+        next(stream)
+        stream.close()
+    results[f"llm_ttft/{tag}"] = measure(first_token, args.repeat)
+
+    results[f"ask/{tag}"] = measure(lambda: pipeline.ask(random.choice(questions)), args.repeat)
+    pipeline.close()
+
+
+def bench_results(db_name: str, args, results: dict, server):
+    from db_utils import execute_sql, preview_sql, format_output, render_page
+    from pipeline import QAPipeline
+    from utils import PAGE_SIZE
+
+    pipeline = QAPipeline(args.model_name, db_name)
+    for num_rows in args.rows:
+        tag = f"{num_rows}_rows"
+        repeat = max(1, min(args.repeat, 2_000_000 // num_rows))
+        sql_statement = f"SELECT id, name, amount, created_at FROM {FACTS_TABLE} WHERE id <= {num_rows}"
+
+        results[f"execute_sql/{tag}"] = measure(lambda: execute_sql(sql_statement, db_name), repeat)
+        results[f"preview_sql/{tag}"] = measure(
+            lambda: preview_sql(sql_statement, db_name, utils.DISPLAY_ROWS), repeat
+        )
+        rows, header = execute_sql(sql_statement, db_name)
+        results[f"format_output/{tag}"] = measure(lambda: format_output(rows, header), repeat)
+        results[f"render_page/{tag}"] = measure(
+            lambda: render_page(rows, header, 0, PAGE_SIZE, total_rows=len(rows)), args.repeat
+        )
+        del rows
+
+        server.response = f"```sql\n{sql_statement};\n```\nThe query lists the facts."
+        results[f"ask/{tag}"] = measure(lambda: pipeline.ask(f"List the first {num_rows} facts"), repeat)
+    pipeline.close()
+
+
+def bench_throughput(db_name: str, args, server) -> dict:
+    from pipeline import QAPipeline
+
+    pipeline = QAPipeline(args.model_name, db_name)
+    server.response = f"```sql\nSELECT name, amount FROM {FACTS_TABLE} WHERE id <= 100;\n```"
+    questions = [f"What is the amount of fact {i}?" for i in range(args.questions)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        answers = list(executor.map(pipeline.ask, questions))
+    elapsed = time.perf_counter() - start
+    pipeline.close()
+
+    return {
+        "questions": len(questions),
+        "workers": args.workers,
+        "failed": sum(answer["error"] is not None for answer in answers),
+        "questions_per_sec": len(questions) / elapsed,
+    }
+
+
+def report(run: dict, baseline: dict = None):
+    if baseline:
+        ignored = ("output", "compare", "reseed")
+        changed = [
+            key for key, value in run["args"].items()
+            if key not in ignored and baseline["args"].get(key) != value
+        ]
+        if changed:
+            print(f"warning: baseline {baseline['commit']} ran with different {', '.join(changed)}")
+    print(f"\n{'stage':<32} {'p50 ms':>10} {'p95 ms':>10} {'n':>5}" + (f" {'p50 vs base':>12}" if baseline else ""))
+    for name, stats in run["results"].items():
+        line = f"{name:<32} {stats['p50'] * 1000:10.2f} {stats['p95'] * 1000:10.2f} {stats['n']:5d}"
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            line += f" {(stats['p50'] / base['p50'] - 1) * 100:+11.1f}%"
+        print(line)
+    throughput = run["throughput"]
+    print(f"\nthroughput: {throughput['questions_per_sec']:.2f} questions/s "
+          f"({throughput['questions']} questions, {throughput['workers']} workers, {throughput['failed']} failed)")
+    if baseline:
+        base = baseline["throughput"]["questions_per_sec"]
+        print(f"baseline {baseline['commit']}: {base:.2f} questions/s "
+              f"({(throughput['questions_per_sec'] / base - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db_host", default=utils.DB_HOST)
+    parser.add_argument("--db_port", type=int, default=utils.DB_PORT)
+    parser.add_argument("--db_user", default=utils.DB_USER)
+    parser.add_argument("--db_password", default=utils.DB_PASSWORD)
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 500, 5000], help="schema sizes")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100_000, 1_000_000], help="result sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="samples per stage, fewer for the slow ones")
+    parser.add_argument("--questions", type=int, default=64, help="questions of the throughput run")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent questions of the throughput run")
+    parser.add_argument("--tokens_per_sec", type=float, default=200.0, help="stub token rate")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency before the first token")
+    parser.add_argument("--model_name", default="stub")
+    parser.add_argument("--reseed", action="store_true", help="drop and seed the fixture databases again")
+    parser.add_argument("--output", help="result file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="result file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(tokens_per_sec=args.tokens_per_sec, latency=args.latency).start()
+
+    # settings are read by the modules on import, override them first
+    utils.DB_HOST, utils.DB_PORT = args.db_host, args.db_port
+    utils.DB_USER, utils.DB_PASSWORD = args.db_user, args.db_password
+    utils.OLLAMA_URL = f"{server.url}/api/chat"
+    utils.SCHEMA_CACHE_DIR = tempfile.mkdtemp(prefix="qa_bench_schema_")
+    utils.SQL_CACHE = utils.RESULT_CACHE = False
+    utils.MAX_ROWS = max(utils.MAX_ROWS, max(args.rows))
+
+    random.seed(0)
+    results = {}
+    fact_rows = max(args.rows)
+    for num_tables in args.tables:
+        db_name = seed(num_tables, fact_rows if num_tables == min(args.tables) else 100, args.reseed)
+        bench_schema(db_name, num_tables, args, results, server)
+
+    db_name = f"qa_bench_{min(args.tables)}"
+    bench_results(db_name, args, results, server)
+    throughput = bench_throughput(db_name, args, server)
+
+    from db_pool import close_pools
+    from LLM import close_clients
+    close_pools()
+    close_clients()
+    server.shutdown()
+
+    run = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "args": vars(args),
+        "results": results,
+        "throughput": throughput,
+    }
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{run['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(run, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    report(run, baseline)
+    print(f"\nresults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Latency of questions whose SQL response ends with an explanation: waiting
+for the whole response versus running the query as soon as its block is streamed.
+
+A stub Ollama server answers the SQL prompt with a query followed by
+`--explanation_tokens` tokens of explanation, at `--tokens_per_sec`, and
+the answer prompt with a short answer. `--questions` questions are asked
+through `QAPipeline.ask` with `early_sql` off (the response is read to its
+end, then the query is extracted) and on (the query runs once its closing
+fence arrives, while the explanation is read in the background). The
+time until the result is shown, until the answer is streamed, and until
+`ask` returns (the whole SQL response is stored in the conversation) are reported.
+With `--ollama_concurrency 1` the answer request needs the only request slot.
+
+    python benchmarks/bench_early_sql.py --db_host localhost --db_password admin
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import utils
+from stub_ollama import StubOllamaServer
+from bench_e2e import seed, percentiles, FACTS_TABLE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db_host", default=utils.DB_HOST)
+    parser.add_argument("--db_port", type=int, default=utils.DB_PORT)
+    parser.add_argument("--db_user", default=utils.DB_USER)
+    parser.add_argument("--db_password", default=utils.DB_PASSWORD)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--explanation_tokens", type=int, default=120, help="tokens after the SQL block")
+    parser.add_argument("--tokens_per_sec", type=float, default=100.0, help="stub generation rate")
+    parser.add_argument(
+        "--ollama_concurrency", type=int, default=utils.OLLAMA_CONCURRENCY, help="concurrent requests sent to the stub"
+    )
+    args = parser.parse_args()
+
+    utils.DB_HOST, utils.DB_PORT = args.db_host, args.db_port
+    utils.DB_USER, utils.DB_PASSWORD = args.db_user, args.db_password
+    utils.SCHEMA_CACHE_DIR = tempfile.mkdtemp(prefix="qa_bench_schema_")
+    utils.SQL_CACHE = utils.RESULT_CACHE = utils.BACKGROUND_SUMMARY = False
+    utils.METRICS_LOG_PATH = ""
+
+    db_name = seed(10, 100000, False)
+    sql_response = (
+        f"Here is the query:\n```sql\nSELECT name, SUM(amount) AS total FROM {FACTS_TABLE} WHERE id <= 1000 "
+        f"GROUP BY name ORDER BY total DESC LIMIT 10;\n```\n" + "It sums the amounts of each name and keeps the largest ones. "
+        * (args.explanation_tokens // 12)
+    )
+
+    def _response(body: dict) -> str:
+        prompt = body["messages"][-1]["content"]
+        return sql_response if "Your task is to answer the user question" in prompt else "The largest total is 42."
+
+    stub = StubOllamaServer(tokens_per_sec=args.tokens_per_sec, latency=0.05, response=_response).start()
+    utils.OLLAMA_URL = f"{stub.url}/api/chat"
+
+    # imported after the settings are patched
+    import pipeline
+    from pipeline import QAPipeline, PipelineObserver
+    pipeline._backend_slots["ollama"] = threading.BoundedSemaphore(args.ollama_concurrency)
+
+    class _Observer(PipelineObserver):
+        def __init__(self):
+            self.result_at = self.answer_at = None
+
+        def result(self, rows, col_header, row_count, truncated, cache_age):
+            self.result_at = time.perf_counter()
+
+        def answer_finished(self):
+            self.answer_at = time.perf_counter()
+
+    qa = QAPipeline("stub", db_name)
+    print(
+        f"{args.explanation_tokens} explanation tokens at {args.tokens_per_sec:.0f} tokens/s, "
+        f"{args.ollama_concurrency} concurrent requests\n"
+        f"{'early_sql':<10} {'result p50':>11} {'result p95':>11} {'answer p50':>11} {'answer p95':>11} "
+        f"{'done p50':>9} {'sql ahead':>10}"
+    )
+    for early in (False, True):
+        pipeline.EARLY_SQL = early
+        to_result, to_answer, to_done, ahead = [], [], [], []
+        for i in range(args.questions):
+            observer = _Observer()
+            start = time.perf_counter()
+            result = qa.ask(f"Which names have the largest total amount? ({i})", observer=observer)
+            to_done.append(time.perf_counter() - start)
+            if result["error"] is not None:
+                print(f"question {i} failed: {result['error']}")
+                continue
+            to_result.append(observer.result_at - start)
+            to_answer.append(observer.answer_at - start)
+            ahead.append(result["timings"].get("sql_ahead", 0.0))
+        result_stats, answer_stats = percentiles(to_result), percentiles(to_answer)
+        print(
+            f"{'on' if early else 'off':<10} {result_stats['p50'] * 1000:>9.0f}ms {result_stats['p95'] * 1000:>9.0f}ms "
+            f"{answer_stats['p50'] * 1000:>9.0f}ms {answer_stats['p95'] * 1000:>9.0f}ms "
+            f"{percentiles(to_done)['p50'] * 1000:>7.0f}ms {percentiles(ahead)['p50'] * 1000:>8.0f}ms"
+        )
+    qa.close()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Microbenchmark of the result table renderer.
+
+Compares `db_utils.render_table` (all rows, and with sampled column widths)
+and `db_utils.render_page` (one page, as shown in the SQL result box) against
+the previous `format_output` implementation on synthetic results.
+
+    python benchmarks/bench_format_output.py --rows 10000 100000 1000000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "QA_sql"))
+
+from db_utils import render_table, render_page
+
+
+def legacy_format_output(result, col_header):
+    """The `format_output` implementation replaced by `render_table`."""
+    table = ''
+
+    col_widths = [
+        int(max(len(str(row[i])) for row in result + [col_header])*1.5) for i in range(len(col_header))
+    ]
+
+    line = "+" + "+".join("-" * (width + 2) for width in col_widths) + "+"
+    header = "| " + " | ".join(f"{col_header[i]:{col_widths[i]}}" for i in range(len(col_header))) + " |"
+    table += f'{line}\n{header}\n{line}\n'
+
+    for row in result:
+        row_str = "| " + " | ".join(f"{str(row[i]):{col_widths[i]}}" for i in range(len(row))) + " |"
+        table += row_str + '\n'
+
+    table += line
+
+    return table
+
+
+def make_rows(num_rows):
+    start = datetime.datetime(2024, 1, 1)
+    return [
+        (i, f"customer_{i % 977}", i * 1.25, start + datetime.timedelta(minutes=i), None if i % 7 else "note " * (i % 13))
+        for i in range(num_rows)
+    ]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--width_sample", type=int, default=1000, help="rows sampled for column widths")
+    args = parser.parse_args()
+
+    header = ["id", "name", "amount", "created_at", "note"]
+    print(f"{'rows':>10} {'legacy (s)':>12} {'render (s)':>12} {'sampled (s)':>12} {'page (s)':>10} {'speedup':>9}")
+    for num_rows in args.rows:
+        rows = make_rows(num_rows)
+        legacy = timed(legacy_format_output, rows, header)
+        full = timed(render_table, rows, header)
+        sampled = timed(render_table, rows, header, width_sample=args.width_sample)
+        page = timed(render_page, rows, header, page=0)
+        print(f"{num_rows:>10} {legacy:>12.3f} {full:>12.3f} {sampled:>12.3f} {page:>10.4f} {legacy / full:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+LLM requests against failing backends: retries, timeouts, failover and circuit breaking.
+
+Two stub Ollama servers play a primary and a fallback endpoint. Each
+scenario sends `--requests` streamed requests one after the other, and
+reports the requests answered, the p50/p95 latency until the response
+is complete, and the per-backend statistics of `llm_backends`:
+
+    flaky      the primary answers `--error_rate` of the requests with 503
+    hung       the primary never sends a token, the fallback is healthy
+
+each with the resilience features off (no retries, no failover) and on.
+For the hung primary, the circuit breaker is also turned off, so that
+every request waits for the first token timeout before failing over.
+
+    python benchmarks/bench_llm_resilience.py --requests 40
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import llm_backends
+from LLM import LLM_response, close_clients
+from llm_backends import LLMError, backend_stats, get_backend
+from stub_ollama import StubOllamaServer
+from bench_e2e import percentiles
+
+MESSAGES = [{"role": "user", "content": "How many orders were placed in each city?"}]
+
+
+def run(args, url: str, fallbacks: list[str], retries: int, circuit_failures: int) -> dict:
+    # fresh backends, so the breakers and statistics start over
+    llm_backends._backends.clear()
+    llm_backends.LLM_RETRIES = retries
+    for backend_url in [url] + [entry.partition("@")[2] for entry in fallbacks]:
+        get_backend("stub", backend_url).breaker.failure_threshold = circuit_failures
+
+    answered, latencies = 0, []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        try:
+            "".join(LLM_response(MESSAGES, "stub", stream=True, url=url, fallbacks=fallbacks))
+            answered += 1
+        except LLMError:
+            pass
+        latencies.append(time.perf_counter() - start)
+    return {"answered": answered, **percentiles(latencies), "backends": backend_stats()}
+
+
+def report(name: str, stats: dict, urls: dict):
+    print(
+        f"{name:<34} {stats['answered']:>4}/{stats['n']:<4} "
+        f"{stats['p50'] * 1000:>8.0f}ms {stats['p95'] * 1000:>8.0f}ms"
+    )
+    for backend, backend_stats in stats["backends"].items():
+        label = next((label for label, url in urls.items() if backend.endswith(url)), backend)
+        p50 = backend_stats["latency_p50"]
+        p50 = f"{p50 * 1000:.0f}ms" if p50 is not None else "-"
+        print(
+            f"    {label:<10} requests {backend_stats['requests']:>3}  errors {backend_stats['errors']:>3}  "
+            f"retries {backend_stats['retries']:>3}  failovers {backend_stats['failovers']:>3}  "
+            f"p50 {p50:>6}  circuit {backend_stats['circuit']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--error_rate", type=float, default=0.3, help="503 rate of the flaky primary")
+    parser.add_argument("--first_token_timeout", type=float, default=1.0)
+    parser.add_argument("--tokens_per_sec", type=float, default=2000.0)
+    args = parser.parse_args()
+
+    llm_backends.LLM_FIRST_TOKEN_TIMEOUT = args.first_token_timeout
+    llm_backends.LLM_BACKOFF_BASE, llm_backends.LLM_BACKOFF_MAX = 0.05, 1.0
+
+    flaky = StubOllamaServer(tokens_per_sec=args.tokens_per_sec, latency=0.02, error_rate=args.error_rate).start()
+    hung = StubOllamaServer(tokens_per_sec=args.tokens_per_sec, latency=3600).start()
+    healthy = StubOllamaServer(tokens_per_sec=args.tokens_per_sec, latency=0.02).start()
+    urls = {"flaky": f"{flaky.url}/api/chat", "hung": f"{hung.url}/api/chat", "fallback": f"{healthy.url}/api/chat"}
+    fallback = [f"stub@{urls['fallback']}"]
+
+    print(f"{'scenario':<34} {'answered':>9} {'p50':>10} {'p95':>10}")
+    report("flaky, no retries", run(args, urls["flaky"], [], 0, 10 ** 6), urls)
+    report("flaky, retries", run(args, urls["flaky"], [], 2, 10 ** 6), urls)
+    report("hung, no retries nor failover", run(args, urls["hung"], [], 0, 10 ** 6), urls)
+    report("hung, failover, no breaker", run(args, urls["hung"], fallback, 0, 10 ** 6), urls)
+    report("hung, retries, failover, breaker", run(args, urls["hung"], fallback, 2, 3), urls)
+
+    close_clients()
+    for server in (flaky, hung, healthy):
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
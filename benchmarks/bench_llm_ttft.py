@@ -0,0 +1,80 @@
+"""
+Time-to-first-token of `LLM.LLM_response` against a local stub Ollama server.
+
+Compares a bare `requests.post` per call (the previous behavior, one new
+connection per request) with `LLM_response`, which reuses a keep-alive
+session. `--handshake_delay` simulates the TLS/auth cost of a remote
+endpoint on every new connection.
+
+    python benchmarks/bench_llm_ttft.py --calls 50 --handshake_delay 0.03
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "QA_sql"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from LLM import LLM_response
+from stub_ollama import StubOllamaServer
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant for generating SQL queries."},
+    {"role": "user", "content": "How many orders were placed in each city?"},
+]
+
+
+def legacy_first_token(url: str, model_name: str) -> float:
+    prompt = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in MESSAGES)
+    start = time.perf_counter()
+    response = requests.post(url=url, json={"model": model_name, "prompt": prompt, "stream": True}, stream=True)
+    first = None
+    for line in response.iter_lines():
+        if line and first is None:
+            json.loads(line)
+            first = time.perf_counter() - start
+    return first
+
+
+def pooled_first_token(url: str, model_name: str) -> float:
+    start = time.perf_counter()
+    first = None
+    for _ in LLM_response(MESSAGES, model_name, stream=True, url=url):
+        if first is None:
+            first = time.perf_counter() - start
+    return first
+
+
+def summarize(name: str, samples: list[float]):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<22} p50 {statistics.median(samples) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub latency before the first token")
+    parser.add_argument("--handshake_delay", type=float, default=0.03, help="stub cost of a new connection")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(latency=args.latency, handshake_delay=args.handshake_delay, tokens_per_sec=5000).start()
+    url = f"{server.url}/api/generate"
+
+    legacy = [legacy_first_token(url, "stub") for _ in range(args.calls)]
+    connections = server.connections
+    pooled = [pooled_first_token(url, "stub") for _ in range(args.calls)]
+
+    summarize("requests.post per call", legacy)
+    summarize("pooled session", pooled)
+    print(f"connections opened: {connections} vs {server.connections - connections}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Prompt prefix reuse over multi-turn conversations.
+
+Runs the same conversations with the previous prompt layout (schema appended
+to the last user message, system prompt replaced for the answer, messages
+flattened for `/api/generate`) and with the current one (rules and schema in a
+stable system message, turns appended after it, sent to `/api/chat`) against
+the stub Ollama server simulating a prompt cache, and reports the prompt
+tokens processed, prefill time and time to first token per LLM call.
+
+    python benchmarks/bench_prompt_prefix.py --db_host localhost --db_password admin --turns 8
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import utils
+from stub_ollama import StubOllamaServer
+from bench_e2e import seed, table_names, FACTS_TABLE
+
+
+def legacy_turn(pipeline, conversation, question: str, url: str):
+    """One question with the previous prompt layout."""
+    from LLM import LLM_response
+    from prompt import SQL_question_message, question_answer_message, SCHEMA_PROMPT_TEMPLATE
+    from pipeline import extract_sql
+    from db_utils import preview_sql
+
+    history = SQL_question_message(question, history=conversation.history, model_name=pipeline.model_name)
+    tables = pipeline.schema_index.select(question, include=conversation.session_tables) or pipeline.schema_index.names
+    conversation.session_tables = tables
+    schema_prompt = SCHEMA_PROMPT_TEMPLATE.format(schema=pipeline.schema_index.schema(tables))
+    prompt = [*history[:-1], {**history[-1], "content": history[-1]["content"] + schema_prompt}]
+
+    response = LLM_response(prompt, pipeline.model_name, stream=False, url=url)
+    sql_statement = extract_sql(response)
+    history.append({"role": "assistant", "content": sql_statement})
+    rows, _, row_count, _ = preview_sql(sql_statement, pipeline.db_name, utils.RESULT_LIMIT)
+
+    history = question_answer_message(
+        question, sql_statement, rows, history=history, model_name=pipeline.model_name, row_count=row_count
+    )
+    prompt = [{"role": "system", "content": "You are a helpful assistant for answering user questions."}, *history[1:]]
+    answer = "".join(LLM_response(prompt, pipeline.model_name, stream=True, url=url))
+    history.append({"role": "assistant", "content": answer})
+    conversation.history = history
+
+
+def run(layout: str, db_name: str, args, server) -> list:
+    from metrics import trace
+    from pipeline import QAPipeline, Conversation
+
+    pipeline = QAPipeline(args.model_name, db_name)
+    words = [name.split("_")[:2] for name in table_names(args.tables)]
+    random.seed(1)
+    spans = []
+    for session in range(args.sessions):
+        conversation = Conversation()
+        server._prompt_cache.clear()
+        for turn in range(args.turns):
+            a, b = random.choice(words)
+            question = f"What is the total amount of {a} {b} in session {session} turn {turn}?"
+            with trace(layout) as turn_trace:
+                if layout == "legacy":
+                    legacy_turn(pipeline, conversation, question, f"{server.url}/api/generate")
+                else:
+                    # the spans of `ask` go to its own trace, collect them in this one
+                    pipeline._ask(question, conversation, None)
+            spans.extend((turn, span) for span in turn_trace.spans if span.name == "llm")
+    pipeline.close()
+    return spans
+
+
+def report(layout: str, spans: list):
+    # the first question of a session processes the whole prompt with either layout
+    follow_ups = [span for turn, span in spans if turn > 0]
+    processed = [span.attrs.get("prompt_tokens") or 0 for span in follow_ups]
+    prefill = [span.attrs.get("prefill") or 0.0 for span in follow_ups]
+    ttft = [span.attrs["ttft"] for span in follow_ups if "ttft" in span.attrs]
+    print(f"{layout:<8} prompt tokens processed p50 {statistics.median(processed):8.0f}   "
+          f"prefill p50 {statistics.median(prefill) * 1000:8.1f} ms   "
+          f"streamed ttft p50 {statistics.median(ttft) * 1000:8.1f} ms   ({len(follow_ups)} calls)")
+    return statistics.median(prefill), statistics.median(ttft)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db_host", default=utils.DB_HOST)
+    parser.add_argument("--db_port", type=int, default=utils.DB_PORT)
+    parser.add_argument("--db_user", default=utils.DB_USER)
+    parser.add_argument("--db_password", default=utils.DB_PASSWORD)
+    parser.add_argument("--tables", type=int, default=500, help="schema size of the fixture database")
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=8, help="questions per session")
+    parser.add_argument("--prefill_tokens_per_sec", type=float, default=2000.0, help="stub prompt processing rate")
+    parser.add_argument("--model_name", default="stub")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(
+        tokens_per_sec=1000, latency=0.01, prefill_tokens_per_sec=args.prefill_tokens_per_sec,
+        response=f"```sql\nSELECT name, amount FROM {FACTS_TABLE} WHERE id <= 10;\n```"
+    ).start()
+
+    # settings are read by the modules on import, override them first
+    utils.DB_HOST, utils.DB_PORT = args.db_host, args.db_port
+    utils.DB_USER, utils.DB_PASSWORD = args.db_user, args.db_password
+    utils.OLLAMA_URL = f"{server.url}/api/chat"
+    utils.SCHEMA_CACHE_DIR = tempfile.mkdtemp(prefix="qa_bench_schema_")
+    utils.SQL_CACHE = utils.RESULT_CACHE = utils.BACKGROUND_SUMMARY = False
+    utils.METRICS_LOG_PATH = ""
+
+    db_name = seed(args.tables, 100, reseed=False)
+    legacy = report("legacy", run("legacy", db_name, args, server))
+    current = report("current", run("current", db_name, args, server))
+    print(f"follow-up questions: prefill {(1 - current[0] / legacy[0]) * 100:.0f}% lower, "
+          f"streamed ttft {(1 - current[1] / legacy[1]) * 100:.0f}% lower")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cost and prompt size of the result summaries.
+
+Results of 1,000 to 1,000,000 rows of the fixture fact table are streamed
+with and without the column statistics, and the answer prompt is built from
+the leading rows only (as before) and from the statistics plus a sample.
+The extra time of the statistics and the tokens of both prompts are
+reported.
+
+    python benchmarks/bench_result_summary.py --db_host localhost --db_password admin
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import utils
+from bench_e2e import seed, percentiles, FACTS_TABLE
+
+QUESTION = "What is the average amount of the items created in the period?"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db_host", default=utils.DB_HOST)
+    parser.add_argument("--db_port", type=int, default=utils.DB_PORT)
+    parser.add_argument("--db_user", default=utils.DB_USER)
+    parser.add_argument("--db_password", default=utils.DB_PASSWORD)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model_name", default="stub", help="model whose tokenizer counts the prompt tokens")
+    parser.add_argument("--reseed", action="store_true")
+    args = parser.parse_args()
+
+    utils.DB_HOST, utils.DB_PORT = args.db_host, args.db_port
+    utils.DB_USER, utils.DB_PASSWORD = args.db_user, args.db_password
+
+    # imported after the connection settings are set
+    from db_utils import preview_sql
+    from prompt import question_answer_message, message_tokens
+    from result_summary import ResultSummary
+
+    db_name = seed(10, max(args.rows), args.reseed)
+    num_rows = max(utils.DISPLAY_ROWS, utils.RESULT_LIMIT)
+
+    print(f"{'rows':>10} {'plain p50':>10} {'summary p50':>12} {'overhead':>9} {'tokens before':>14} {'after':>6}")
+    for rows in args.rows:
+        sql_statement = f"SELECT id, name, amount, created_at FROM {FACTS_TABLE} WHERE id <= {rows}"
+        plain, summarized = [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            preview_sql(sql_statement, db_name, num_rows)
+            plain.append(time.perf_counter() - start)
+
+            summary = ResultSummary()
+            start = time.perf_counter()
+            result, _, row_count, _ = preview_sql(sql_statement, db_name, num_rows, summary=summary)
+            summarized.append(time.perf_counter() - start)
+
+        before = question_answer_message(
+            QUESTION, sql_statement, result, history=[], model_name=args.model_name, row_count=row_count
+        )
+        after = question_answer_message(
+            QUESTION, sql_statement, result, history=[], model_name=args.model_name, row_count=row_count,
+            summary=summary
+        )
+        plain_p50, summary_p50 = percentiles(plain)["p50"], percentiles(summarized)["p50"]
+        print(
+            f"{rows:>10,} {plain_p50 * 1000:>8.0f}ms {summary_p50 * 1000:>10.0f}ms "
+            f"{(summary_p50 / plain_p50 - 1) * 100:>8.0f}% "
+            f"{message_tokens(before[-1], args.model_name):>14.0f} {message_tokens(after[-1], args.model_name):>6.0f}"
+        )
+    print("\nSummary of the largest result:\n" + summary.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Latency of light users of the HTTP service while a heavy user floods it.
+
+`--light` sessions each ask questions one after the other, first alone,
+then while a heavy session keeps `--heavy_clients` requests in flight. The
+same load is run on the fair scheduler of the service (sessions served in
+turn, bounded queues) and on a plain FIFO thread pool of as many workers.
+The p50/p95 latency of the light sessions' questions and the requests of
+the heavy session refused with 429 are reported.
+
+    python benchmarks/bench_server.py --db_host localhost --db_password admin
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import utils
+from stub_ollama import StubOllamaServer
+from bench_e2e import seed, percentiles, FACTS_TABLE
+
+
+class FIFOScheduler:
+    """The scheduler interface on a plain thread pool: first come, first served, unbounded queue."""
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, session_id, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def post(url: str, body: dict) -> tuple[int, list]:
+    request = urllib.request.Request(url, method="POST", data=json.dumps(body).encode())
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, [json.loads(line) for line in response.read().splitlines() if line.strip()]
+    except urllib.error.HTTPError as e:
+        return e.code, [json.loads(e.read())]
+
+
+def run_load(server, args, heavy: bool) -> dict:
+    sessions = [post(f"{server.url}/sessions", {})[1][0]["session"] for _ in range(args.light + 1)]
+    heavy_session, light_sessions = sessions[0], sessions[1:]
+    latencies, refused, served = [], [0], [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def _light(session_id: str):
+        for i in range(args.questions):
+            start = time.perf_counter()
+            status, _ = post(f"{server.url}/sessions/{session_id}/ask", {"question": f"question {i}"})
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    def _heavy():
+        while not stop.is_set():
+            status, _ = post(f"{server.url}/sessions/{heavy_session}/ask", {"question": "heavy question"})
+            with lock:
+                if status == 429:
+                    refused[0] += 1
+                else:
+                    served[0] += 1
+            if status == 429:
+                time.sleep(0.05)
+
+    heavy_threads = [threading.Thread(target=_heavy) for _ in range(args.heavy_clients if heavy else 0)]
+    for thread in heavy_threads:
+        thread.start()
+    time.sleep(0.2 if heavy else 0)
+    light_threads = [threading.Thread(target=_light, args=(session_id,)) for session_id in light_sessions]
+    for thread in light_threads:
+        thread.start()
+    for thread in light_threads:
+        thread.join()
+    stop.set()
+    for thread in heavy_threads:
+        thread.join()
+    return {**percentiles(latencies), "heavy_served": served[0], "heavy_refused": refused[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db_host", default=utils.DB_HOST)
+    parser.add_argument("--db_port", type=int, default=utils.DB_PORT)
+    parser.add_argument("--db_user", default=utils.DB_USER)
+    parser.add_argument("--db_password", default=utils.DB_PASSWORD)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--light", type=int, default=4, help="sessions asking one question at a time")
+    parser.add_argument("--questions", type=int, default=5, help="questions of every light session")
+    parser.add_argument("--heavy_clients", type=int, default=16, help="concurrent requests of the heavy session")
+    parser.add_argument("--tokens_per_sec", type=float, default=400.0, help="stub generation rate")
+    args = parser.parse_args()
+
+    utils.DB_HOST, utils.DB_PORT = args.db_host, args.db_port
+    utils.DB_USER, utils.DB_PASSWORD = args.db_user, args.db_password
+    utils.SCHEMA_CACHE_DIR = tempfile.mkdtemp(prefix="qa_bench_schema_")
+    utils.SQL_CACHE = utils.RESULT_CACHE = utils.BACKGROUND_SUMMARY = False
+    utils.METRICS_LOG_PATH = ""
+    # the LLM and database slots are not the bottleneck under test
+    utils.OLLAMA_CONCURRENCY = utils.DB_CONCURRENCY = args.workers
+
+    db_name = seed(10, 1000, False)
+    stub = StubOllamaServer(
+        tokens_per_sec=args.tokens_per_sec,
+        response=f"```sql\nSELECT name, amount FROM {FACTS_TABLE} WHERE id <= 100;\n```",
+    ).start()
+    utils.OLLAMA_URL = f"{stub.url}/api/chat"
+
+    # imported after the settings are patched
+    import server as qa_server
+
+    print(f"{'scheduler':<10} {'heavy user':<11} {'light p50':>10} {'light p95':>10} {'heavy served':>13} {'refused':>8}")
+    for name in ("fifo", "fair"):
+        for heavy in (False, True):
+            server = qa_server.QAServer("stub", db_name, port=0, workers=args.workers).start()
+            if name == "fifo":
+                server.scheduler.shutdown()
+                server.scheduler = FIFOScheduler(args.workers)
+            try:
+                stats = run_load(server, args, heavy)
+            finally:
+                server.close()
+            print(
+                f"{name:<10} {'yes' if heavy else 'no':<11} {stats['p50'] * 1000:>8.0f}ms {stats['p95'] * 1000:>8.0f}ms "
+                f"{stats['heavy_served']:>13} {stats['heavy_refused']:>8}"
+            )
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
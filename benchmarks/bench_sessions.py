@@ -0,0 +1,118 @@
+"""
+Conversation storage: copied message lists versus shared message records.
+
+`--sessions` conversations of `--turns` turns each start with the same
+system prompt holding a `--schema_kb` schema. Three ways of storing them
+are compared:
+
+    deepcopy   a list of dicts, deep-copied to build the prompt of every question (the app before)
+    list       the previous `History` list, copied to build the prompt of every question
+    chain      `prompt.History`, immutable records shared by every copy and every session
+
+The time to build the prompt of the last question of a conversation, and
+the memory held by all conversations (tracemalloc), are reported.
+
+    python benchmarks/bench_sessions.py --sessions 1000 --turns 20
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+from prompt import History, SQL_SYSTEM_PROMPT, message_tokens
+from bench_e2e import percentiles
+
+# a tokenizer that needs no download, counting words
+MODEL_NAME = "llama3"
+
+
+class ListHistory(list):
+    """The previous `History`: a list of dicts and the token count of each one."""
+
+    def __init__(self, messages=(), model_name=MODEL_NAME):
+        super().__init__(messages)
+        self.model_name = model_name
+        self._counts = [message_tokens(message, model_name) for message in self]
+
+    def append(self, message):
+        super().append(message)
+        self._counts.append(message_tokens(message, self.model_name))
+
+    def copy(self):
+        history = ListHistory.__new__(ListHistory)
+        list.extend(history, self)
+        history.model_name = self.model_name
+        history._counts = list(self._counts)
+        return history
+
+
+def _question(session: int, turn: int) -> dict:
+    return {"role": "user", "content": f"Your task is to answer the user question: `question {turn} of session {session}`."}
+
+
+def _response(session: int, turn: int) -> dict:
+    return {"role": "assistant", "content": f"```sql\nSELECT city, COUNT(*) FROM orders_{session} GROUP BY city LIMIT {turn};\n```"}
+
+
+def build(store: str, schema: str, sessions: int, turns: int) -> tuple[list, list]:
+    """The conversations, and the seconds taken to build the prompt of each question."""
+    conversations, samples = [], []
+    for session in range(sessions):
+        # every session renders its system prompt, as `SQL_question_message` does
+        system = {"role": "system", "content": SQL_SYSTEM_PROMPT + schema}
+        history = None
+        for turn in range(turns):
+            start = time.perf_counter()
+            if history is None:
+                messages = [system, _question(session, turn)]
+                prompt = History(messages, MODEL_NAME) if store == "chain" else (
+                    ListHistory(messages) if store == "list" else messages
+                )
+            elif store == "deepcopy":
+                prompt = copy.deepcopy(history)
+                prompt.append(_question(session, turn))
+            else:
+                prompt = history.copy()
+                prompt.append(_question(session, turn))
+            samples.append(time.perf_counter() - start)
+            prompt.append(_response(session, turn))
+            history = prompt
+        conversations.append(history)
+    return conversations, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--schema_kb", type=int, default=20, help="size of the schema in the system prompt")
+    args = parser.parse_args()
+
+    schema = "\n".join(
+        f"CREATE TABLE table_{i} (id integer PRIMARY KEY, name text, amount numeric, created_at timestamp);"
+        for i in range(args.schema_kb * 1024 // 90)
+    )
+    print(f"{args.sessions} sessions x {args.turns} turns, {len(schema) / 1024:.0f} KB schema")
+    print(f"{'store':<10} {'prompt p50':>11} {'prompt p95':>11} {'last turn':>10} {'memory':>10}")
+    for store in ("deepcopy", "list", "chain"):
+        tracemalloc.start()
+        conversations, samples = build(store, schema, args.sessions, args.turns)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        stats = percentiles(samples)
+        last_turn = percentiles(samples[args.turns - 1::args.turns])["p50"]
+        print(
+            f"{store:<10} {stats['p50'] * 1e6:>9.1f}us {stats['p95'] * 1e6:>9.1f}us "
+            f"{last_turn * 1e6:>8.1f}us {memory / 1024 / 1024:>8.1f}MB"
+        )
+        del conversations
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Serial retries versus speculative SQL candidates.
+
+The stub Ollama server answers every SQL request with a response of random
+length that is either a valid query, a query the server rejects (unknown
+column) or a write statement. The same questions are answered with one
+request at a time (write statements are regenerated up to `max_retry` times)
+and with `--candidates` requests in parallel validated with `EXPLAIN`, and
+the latency of getting a valid query and the share of questions answered
+are reported.
+
+    python benchmarks/bench_speculative.py --db_host localhost --db_password admin --candidates 3
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+import utils
+from stub_ollama import StubOllamaServer
+from bench_e2e import seed, percentiles, FACTS_TABLE
+
+RESPONSES = {
+    "valid": f"```sql\nSELECT name, amount FROM {FACTS_TABLE} WHERE id <= 10;\n```\n",
+    "invalid": f"```sql\nSELECT name, amout FROM {FACTS_TABLE} WHERE id <= 10;\n```\n",
+    "write": f"```sql\nDELETE FROM {FACTS_TABLE} WHERE id <= 10;\n```\n",
+}
+
+
+class Responses:
+    """Random SQL responses of random length, the answer request always gets a short text."""
+
+    def __init__(self, invalid_rate: float, write_rate: float, min_tokens: int, max_tokens: int, seed: int = 1):
+        self.invalid_rate = invalid_rate
+        self.write_rate = write_rate
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self, body: dict) -> str:
+        messages = body.get("messages") or [{"content": body.get("prompt", "")}]
+        if "SQL Result:" in messages[-1]["content"]:
+            return "The answer."
+        with self.lock:
+            draw = self.random.random()
+            length = self.random.randint(self.min_tokens, self.max_tokens)
+        if draw < self.invalid_rate:
+            kind = "invalid"
+        elif draw < self.invalid_rate + self.write_rate:
+            kind = "write"
+        else:
+            kind = "valid"
+        return RESPONSES[kind] + "This query answers the question. " * (length // 5)
+
+
+def run(db_name: str, candidates: int, args) -> dict:
+    import pipeline
+    from pipeline import QAPipeline
+
+    pipeline.SPECULATIVE_CANDIDATES = candidates
+    qa = QAPipeline(args.model_name, db_name)
+    latencies, answered, winners, saved = [], 0, [], []
+    for i in range(args.questions):
+        result = qa.ask(f"What is the amount of the first ten facts, question {i}?")
+        latencies.append(result["timings"]["generate_sql"])
+        answered += result["error"] is None and result["sql"] is not None
+        if "speculative" in result:
+            winners.append(result["speculative"]["winner"])
+            saved.append(result["speculative"]["saved"])
+    qa.close()
+    summary = {"generate_sql": percentiles(latencies), "answered": answered / args.questions}
+    if winners:
+        summary["winners"] = {str(w): winners.count(w) for w in sorted(set(winners), key=str)}
+        summary["saved"] = sum(saved) / len(saved)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db_host", default=utils.DB_HOST)
+    parser.add_argument("--db_port", type=int, default=utils.DB_PORT)
+    parser.add_argument("--db_user", default=utils.DB_USER)
+    parser.add_argument("--db_password", default=utils.DB_PASSWORD)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--invalid_rate", type=float, default=0.25, help="share of queries the server rejects")
+    parser.add_argument("--write_rate", type=float, default=0.15, help="share of write statements")
+    parser.add_argument("--tokens_per_sec", type=float, default=100.0, help="stub generation rate")
+    parser.add_argument("--model_name", default="stub")
+    args = parser.parse_args()
+
+    # settings are read by the modules on import, override them first
+    utils.DB_HOST, utils.DB_PORT = args.db_host, args.db_port
+    utils.DB_USER, utils.DB_PASSWORD = args.db_user, args.db_password
+    utils.SCHEMA_CACHE_DIR = tempfile.mkdtemp(prefix="qa_bench_schema_")
+    utils.SQL_CACHE = utils.RESULT_CACHE = utils.BACKGROUND_SUMMARY = False
+    utils.METRICS_LOG_PATH = ""
+    # one Ollama runner serves several requests of the same model in parallel (OLLAMA_NUM_PARALLEL)
+    utils.OLLAMA_CONCURRENCY = max(utils.OLLAMA_CONCURRENCY, args.candidates)
+    db_name = seed(10, 100, reseed=False)
+
+    server = StubOllamaServer(tokens_per_sec=args.tokens_per_sec, latency=0.05).start()
+    utils.OLLAMA_URL = f"{server.url}/api/chat"
+
+    results = {}
+    for candidates in (1, args.candidates):
+        server.response = Responses(args.invalid_rate, args.write_rate, 20, 120)
+        results[candidates] = run(db_name, candidates, args)
+    server.shutdown()
+
+    for candidates, summary in results.items():
+        latency = summary["generate_sql"]
+        print(f"{candidates} candidate(s): generate_sql p50 {latency['p50'] * 1000:7.0f} ms  "
+              f"p95 {latency['p95'] * 1000:7.0f} ms  answered {summary['answered']:.0%}"
+              + (f"  winners {summary['winners']}  saved {summary['saved'] * 1000:.0f} ms on average"
+                 if "winners" in summary else ""))
+
+
+if __name__ == "__main__":
+    main()
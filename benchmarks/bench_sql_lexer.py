@@ -0,0 +1,108 @@
+"""
+Write detection: keyword regexes versus the SQL lexer.
+
+Every statement of `data/sql_corpus.jsonl` (generated queries, plus writes
+hidden behind comments, in CTEs, after another statement or in function
+calls) is labelled with the operation it performs, if any. The regexes the
+pipeline used before and `sql_lexer.classify` are run over the corpus, and
+their false positives (reads flagged, i.e. needless regenerations), false
+negatives (writes missed) and time per statement are reported.
+
+    python benchmarks/bench_sql_lexer.py --repeat 200
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "QA_sql"))
+sys.path.insert(0, BENCH_DIR)
+
+from sql_lexer import classify, write_keyword
+from bench_e2e import percentiles
+
+CORPUS = os.path.join(BENCH_DIR, "data", "sql_corpus.jsonl")
+
+_QUERY_PATTERN = re.compile(r'^\s*(?:(?:--[^\n]*\n|/\*.*?\*/)\s*)*(SELECT|WITH|VALUES|TABLE)\b', re.IGNORECASE | re.DOTALL)
+
+
+def regex_keyword(sql_statement: str) -> str | None:
+    """`detect_keyword` as it was, compiling its patterns on every call."""
+    KEYWORDS = ['INSERT INTO', 'DELETE FROM', 'CREATE TABLE', 'DROP TABLE', 'ALTER TABLE', 'TRUNCATE TABLE']
+    general_pattern = re.compile(r'\b(' + '|'.join(re.escape(keyword) for keyword in KEYWORDS) + r')\b', re.IGNORECASE)
+    update_pattern = re.compile(r'\bUPDATE\s+\w+\s+SET\b', re.IGNORECASE)
+    if update_pattern.search(sql_statement):
+        return 'UPDATE'
+    match = general_pattern.search(sql_statement)
+    if match:
+        return match.group(0)
+    return None
+
+
+def regex_is_read_query(sql_statement: str) -> bool:
+    return bool(_QUERY_PATTERN.match(sql_statement)) and regex_keyword(sql_statement) is None
+
+
+def lexer_is_read_query(sql_statement: str) -> bool:
+    statements = classify(sql_statement)
+    return len(statements) == 1 and statements[0].is_query
+
+
+def evaluate(name: str, detect, is_read_query, corpus: list[dict], repeat: int):
+    false_positives = [entry["sql"] for entry in corpus if entry["write"] is None and detect(entry["sql"])]
+    false_negatives = [entry["sql"] for entry in corpus if entry["write"] is not None and not detect(entry["sql"])]
+    # statements run on the server as plain queries although they write
+    unsafe = [entry["sql"] for entry in corpus if entry["write"] is not None and is_read_query(entry["sql"])]
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for entry in corpus:
+            detect(entry["sql"])
+        samples.append((time.perf_counter() - start) / len(corpus))
+    stats = percentiles(samples)
+
+    reads = sum(entry["write"] is None for entry in corpus)
+    print(
+        f"{name:<8} {len(false_positives):>3}/{reads} reads flagged   "
+        f"{len(false_negatives):>3}/{len(corpus) - reads} writes missed   "
+        f"{len(unsafe):>3} writes run as queries   "
+        f"p50 {stats['p50'] * 1e6:6.1f} us/statement   p95 {stats['p95'] * 1e6:6.1f}"
+    )
+    return false_positives, false_negatives
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true", help="print the misclassified statements")
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    for name, detect, is_read_query in (
+        ("regex", regex_keyword, regex_is_read_query),
+        ("lexer", write_keyword, lexer_is_read_query),
+    ):
+        false_positives, false_negatives = evaluate(name, detect, is_read_query, corpus, args.repeat)
+        if args.verbose:
+            for sql_statement in false_positives:
+                print(f"  flagged: {sql_statement!r}")
+            for sql_statement in false_negatives:
+                print(f"  missed:  {sql_statement!r}")
+
+    mislabelled = [
+        (entry["sql"], entry["write"], write_keyword(entry["sql"])) for entry in corpus
+        if entry["write"] != write_keyword(entry["sql"])
+    ]
+    for sql_statement, expected, found in mislabelled:
+        print(f"lexer reports {found!r} instead of {expected!r}: {sql_statement!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Ollama-compatible stub server for benchmarks.
+
+Serves `/api/generate` and `/api/chat`, streaming a canned response as
+NDJSON at a configurable token rate after a configurable latency.
+
+With `--prefill_tokens_per_sec`, prompt processing is simulated like
+Ollama's prompt cache: the server remembers the last prompt of each model
+and only the tokens after the prefix shared with it are processed (and
+reported as `prompt_eval_count`). A token is approximated as 4 characters.
+
+    python benchmarks/stub_ollama.py --port 11500 --tokens_per_sec 200 --latency 0.05
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE = (
+    "Here is the query:\n```sql\nSELECT c.city, COUNT(*) AS num_orders\n"
+    "FROM customers c\nJOIN orders o ON o.customer_id = c.id\nGROUP BY c.city\n"
+    "ORDER BY num_orders DESC;\n```\nThe query counts the orders placed by customers of each city."
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into pseudo tokens that concatenate back to the text."""
+    tokens, current = [], ""
+    for char in text:
+        current += char
+        if char in " \n":
+            tokens.append(current)
+            current = ""
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering like Ollama.
+
+    Args:
+        address (tuple): (host, port) to listen on, port 0 picks a free port.
+        tokens_per_sec (float): streaming rate of the response tokens.
+        latency (float): seconds before the first token.
+        handshake_delay (float): seconds added to every new TCP connection,
+            simulating TLS and authentication cost of a remote endpoint.
+        response (str | Callable[[dict], str]): the text to answer with, or a function
+            of the request body returning it.
+        prefill_tokens_per_sec (float): prompt processing rate, 0 to skip prompt processing.
+        error_rate (float): fraction of the requests answered with `503 Service Unavailable`.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), tokens_per_sec=200.0, latency=0.05,
+                 handshake_delay=0.0, response=DEFAULT_RESPONSE, prefill_tokens_per_sec=0.0, error_rate=0.0):
+        super().__init__(address, _Handler)
+        self.tokens_per_sec = tokens_per_sec
+        self.latency = latency
+        self.handshake_delay = handshake_delay
+        self.response = response
+        self.prefill_tokens_per_sec = prefill_tokens_per_sec
+        self.error_rate = error_rate
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._prompt_cache = {}     # model -> last prompt
+        self._cache_lock = threading.Lock()
+
+    def prefill(self, model: str, prompt: str) -> tuple[int, int]:
+        """
+        Process a prompt, reusing the prefix shared with the previous prompt of the model.
+
+        Returns:
+            tuple: (prompt tokens, tokens processed)
+        """
+        total = -(-len(prompt) // 4)
+        if not self.prefill_tokens_per_sec:
+            return total, total
+        # one cache slot per model, requests are processed one at a time like a single Ollama runner
+        with self._cache_lock:
+            cached = len(os.path.commonprefix([self._prompt_cache.get(model, ""), prompt])) // 4
+            processed = total - cached
+            time.sleep(processed / self.prefill_tokens_per_sec)
+            self._prompt_cache[model] = prompt
+        return total, processed
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # clients dropping idle keep-alive connections are expected
+        pass
+
+    def start(self) -> "StubOllamaServer":
+        """Serve on a daemon thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # like Go's net/http (and therefore Ollama), do not delay small writes
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server._lock:
+            self.server.connections += 1
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_chunk(self, payload: dict):
+        data = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        with self.server._lock:
+            self.server.requests += 1
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        chat = self.path.rstrip("/").endswith("/api/chat")
+        if not chat and not self.path.rstrip("/").endswith("/api/generate"):
+            self.send_error(404)
+            return
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            data = json.dumps({"error": "server overloaded"}).encode()
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if "messages" in body:
+            # chat template
+            prompt = "".join(
+                f"<|{message.get('role')}|>\n{message.get('content', '')}<|end|>\n" for message in body["messages"]
+            ) + "<|assistant|>\n"
+        else:
+            prompt = body.get("prompt", "")
+        response = self.server.response(body) if callable(self.server.response) else self.server.response
+        tokens = tokenize(response)
+        start = time.perf_counter()
+        time.sleep(self.server.latency)
+        prompt_tokens, processed = self.server.prefill(body.get("model"), prompt)
+        prefill_duration = time.perf_counter() - start
+
+        def _payload(text, done):
+            payload = {"model": body.get("model"), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": text}
+            else:
+                payload["response"] = text
+            if done:
+                payload["prompt_eval_count"] = processed
+                payload["prompt_eval_duration"] = int(prefill_duration * 1e9)
+                payload["prompt_tokens"] = prompt_tokens
+                payload["eval_count"] = len(tokens)
+                payload["total_duration"] = int((time.perf_counter() - start) * 1e9)
+            return payload
+
+        if not body.get("stream", True):
+            time.sleep(len(tokens) / self.server.tokens_per_sec)
+            data = json.dumps(_payload(response, True)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1 / self.server.tokens_per_sec
+        try:
+            for token in tokens:
+                self._send_chunk(_payload(token, False))
+                time.sleep(interval)
+            self._send_chunk(_payload("", True))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--tokens_per_sec", type=float, default=200.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--handshake_delay", type=float, default=0.0)
+    parser.add_argument("--prefill_tokens_per_sec", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(
+        (args.host, args.port), args.tokens_per_sec, args.latency, args.handshake_delay,
+        prefill_tokens_per_sec=args.prefill_tokens_per_sec, error_rate=args.error_rate
+    )
+    print(f"Stub Ollama listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
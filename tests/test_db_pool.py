@@ -0,0 +1,49 @@
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from cancellation import Cancelled
+from db_pool import ConnectionPool
+
+
+class _Connection:
+    """The parts of a psycopg2 connection the pool uses."""
+
+    def __init__(self):
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(psycopg2, "connect", lambda **kwargs: _Connection())
+    pool = ConnectionPool("shop", max_size=1, checkout_timeout=0.1, health_check_interval=3600)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("error", [ValueError, Cancelled, KeyboardInterrupt, GeneratorExit])
+def test_connection_is_returned_when_the_block_raises(pool, error):
+    with pytest.raises(error):
+        with pool.connection() as conn:
+            conn.status = TRANSACTION_STATUS_INTRANS
+            raise error()
+    assert conn.rollbacks == 1
+    assert pool.stats()["in_use"] == 0
+    # the only connection is available again
+    with pool.connection() as again:
+        assert again is conn
@@ -0,0 +1,103 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2.extensions
+import pytest
+
+import db_utils
+from cancellation import CancelToken, Cancelled, cancellation
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.conn.executed.append(sql)
+        if sql.startswith("SELECT COUNT(*)") and self.conn.block:
+            # a long count, until cancelled on the server
+            self.conn.cancelled.wait(5)
+            raise psycopg2.extensions.QueryCanceledError("canceling statement due to user request")
+
+    def fetchone(self):
+        return (42,)
+
+
+class _Connection:
+    def __init__(self, block=False):
+        self.executed = []
+        self.block = block
+        self.cancelled = threading.Event()
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class _Pool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = _Connection()
+    monkeypatch.setattr(db_utils, "get_pool", lambda database: _Pool(conn))
+    return conn
+
+
+def test_count_sql_wraps_the_query(conn):
+    assert db_utils.count_sql("SELECT id FROM orders; -- all of them\n", "shop") == 42
+    assert conn.executed[-1] == "SELECT COUNT(*) FROM (\nSELECT id FROM orders\n) AS counted"
+
+
+def test_count_sql_only_counts_single_queries(conn):
+    assert db_utils.count_sql("SELECT 1; DROP TABLE orders", "shop") is None
+    assert db_utils.count_sql("DELETE FROM orders", "shop") is None
+    assert conn.executed == []
+
+
+def test_count_sql_is_cancelled_on_the_server(conn):
+    conn.block = True
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel).start()
+    with pytest.raises(Cancelled), cancellation(token):
+        db_utils.count_sql("SELECT id FROM orders", "shop")
+    assert conn.cancelled.is_set()
+
+
+@pytest.mark.parametrize("sql_statement", [
+    "EXPLAIN SELECT 1; COMMIT; DROP TABLE orders",
+    "SELECT 1; COMMIT; DROP TABLE orders",
+    "DELETE FROM orders",
+])
+def test_only_single_queries_are_planned(conn, sql_statement):
+    assert db_utils.explain_sql(sql_statement, "shop") == "not a single read-only query"
+    with pytest.raises(ValueError):
+        db_utils.estimate_sql(sql_statement, "shop")
+    assert conn.executed == []
+
+
+def test_explain_sends_the_query_alone(conn):
+    assert db_utils.explain_sql("SELECT id FROM orders; -- all of them", "shop") is None
+    assert conn.executed == ["SET TRANSACTION READ ONLY", "EXPLAIN SELECT id FROM orders"]
+
+
+def test_limit_sql():
+    assert db_utils.limit_sql("SELECT id FROM orders ORDER BY id; -- all\n", 10) == (
+        "SELECT * FROM (\nSELECT id FROM orders ORDER BY id\n) AS limited LIMIT 10;"
+    )
+    with pytest.raises(ValueError):
+        db_utils.limit_sql("SELECT 1; DROP TABLE orders", 10)
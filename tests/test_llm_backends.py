@@ -0,0 +1,117 @@
+import pytest
+
+import llm_backends
+from cancellation import CancelToken, Cancelled, cancellation
+from llm_backends import CircuitBreaker, LLMRequestError, LLMUnavailable, get_backend
+# registers the backends
+import LLM  # noqa: F401
+
+MESSAGES = [{"role": "user", "content": "How many orders?"}]
+
+
+@pytest.fixture(autouse=True)
+def fresh_backends():
+    llm_backends._backends.clear()
+    yield
+    llm_backends._backends.clear()
+
+
+def _half_open(breaker: CircuitBreaker):
+    breaker.reset_timeout = 0
+    for _ in range(breaker.failure_threshold):
+        breaker.failure()
+    assert breaker.state == "open"
+
+
+def test_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(failures=2, reset_timeout=0)
+    _half_open(breaker)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_abandoned_probe_lets_the_next_request_through():
+    breaker = CircuitBreaker(failures=2, reset_timeout=0)
+    _half_open(breaker)
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize("streamed", [True, False])
+def test_cancelled_probe_does_not_lock_the_backend_out(streamed):
+    breaker = get_backend("stub:probe").breaker
+    _half_open(breaker)
+
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(Cancelled), cancellation(token):
+        if streamed:
+            "".join(llm_backends.stream(MESSAGES, "stub:probe", fallbacks=[]))
+        else:
+            llm_backends.complete(MESSAGES, "stub:probe", fallbacks=[])
+
+    assert breaker.state == "half_open"
+    assert llm_backends.complete(MESSAGES, "stub:probe", fallbacks=[]) == LLM.StubBackend.response
+    assert breaker.state == "closed"
+
+
+def _failing(model_name: str, error: Exception):
+    backend = get_backend(model_name)
+    calls = []
+
+    def complete(messages, temperature=None):
+        calls.append(messages)
+        raise error
+
+    backend.complete = complete
+    return backend, calls
+
+
+def test_request_errors_do_not_open_the_circuit(monkeypatch):
+    monkeypatch.setattr(llm_backends, "LLM_RETRIES", 2)
+    backend, calls = _failing("stub:unknown", LLMRequestError("model not found", "stub:unknown"))
+    backend.breaker.failure_threshold = 2
+    for _ in range(3):
+        with pytest.raises(LLMRequestError):
+            llm_backends.complete(MESSAGES, "stub:unknown", fallbacks=[])
+    # not retried, and the backend still takes requests
+    assert len(calls) == 3
+    assert backend.breaker.state == "closed" and backend.breaker.failures == 0
+
+
+def test_last_request_error_is_raised_rather_than_the_open_circuit(monkeypatch):
+    monkeypatch.setattr(llm_backends, "LLM_RETRIES", 2)
+    monkeypatch.setattr(llm_backends, "_backoff", lambda attempt: None)
+    backend, calls = _failing("stub:down", LLMUnavailable("HTTP 503", "stub:down"))
+    backend.breaker.failure_threshold = 1
+    with pytest.raises(LLMUnavailable) as raised:
+        llm_backends.complete(MESSAGES, "stub:down", fallbacks=[])
+    assert "503" in str(raised.value)
+    assert not isinstance(raised.value, llm_backends.CircuitOpen)
+    assert len(calls) == 1 and backend.breaker.state == "open"
+
+    # once nothing was sent, the open circuit is the error
+    with pytest.raises(llm_backends.CircuitOpen):
+        llm_backends.complete(MESSAGES, "stub:down", fallbacks=[])
+
+
+def test_incomplete_backends_are_refused_when_registered():
+    class _StreamOnly(llm_backends.Backend):
+        kind = "stream_only"
+
+        def stream(self, messages, temperature=None):
+            yield "SELECT 1"
+
+    with pytest.raises(TypeError, match="does not implement complete"):
+        llm_backends.register_backend(_StreamOnly, lambda model_name: False)
+    assert "stream_only" not in llm_backends._registry
+
+    class _NoKind(LLM.StubBackend):
+        kind = None
+
+    with pytest.raises(TypeError, match="has no kind"):
+        llm_backends.register_backend(_NoKind, lambda model_name: False)
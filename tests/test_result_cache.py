@@ -0,0 +1,24 @@
+from result_cache import ResultCache, normalize_sql
+
+
+def test_whitespace_and_semicolons_are_normalized():
+    assert normalize_sql("SELECT  a,\n\tb FROM t ;\n") == "SELECT a, b FROM t"
+    assert normalize_sql("SELECT a FROM t;;") == normalize_sql("SELECT a\nFROM t")
+
+
+def test_comments_are_dropped_without_joining_tokens():
+    assert normalize_sql("SELECT a -- the id\nFROM t") == "SELECT a FROM t"
+    assert normalize_sql("SELECT a/* x */FROM t") == "SELECT a FROM t"
+
+
+def test_literals_and_quoted_identifiers_keep_their_whitespace():
+    assert normalize_sql("SELECT * FROM t WHERE name = 'a  b'") != normalize_sql("SELECT * FROM t WHERE name = 'a b'")
+    assert normalize_sql('SELECT "a  b" FROM t') != normalize_sql('SELECT "a b" FROM t')
+    assert normalize_sql("SELECT $$a\n;$$") == "SELECT $$a\n;$$"
+
+
+def test_cache_keeps_literals_apart():
+    cache = ResultCache()
+    cache.put("shop", "SELECT * FROM t WHERE name = 'a  b'", "two spaces")
+    assert cache.get("shop", "SELECT * FROM t WHERE name = 'a b'") is None
+    assert cache.get("shop", "SELECT *\nFROM t WHERE name = 'a  b';").value == "two spaces"
@@ -0,0 +1,67 @@
+import datetime
+import decimal
+
+from result_summary import ColumnSummary, ResultSummary
+
+
+def test_numbers():
+    column = ColumnSummary("amount")
+    column.add((1, decimal.Decimal("2.5"), None, 4.5))
+    assert column.kind == "number"
+    assert (column.min, column.max, column.count, column.nulls) == (1.0, 4.5, 3, 1)
+    assert column.describe() == "amount: min 1, max 4.5, mean 2.667, 1 null"
+
+
+def test_dates():
+    column = ColumnSummary("day")
+    column.add((datetime.date(2024, 3, 1), datetime.date(2024, 1, 1)))
+    assert column.describe() == "day: min 2024-01-01, max 2024-03-01"
+
+
+def test_categories():
+    column = ColumnSummary("city")
+    column.add(("Paris", "Lyon", "Paris", None))
+    assert column.describe(top_k=1) == "city: 2 distinct values, most frequent 'Paris' (2), 1 null"
+
+
+def test_json_and_array_columns():
+    summary = ResultSummary()
+    summary.add([({"a": 1}, [1, 2]), (None, [3])], ["j", "arr"])
+    summary.add([({"b": [2]}, None)], ["j", "arr"])
+    j, arr = summary.columns
+    assert (j.kind, j.count, j.nulls) == ("other", 2, 1)
+    assert (arr.kind, arr.count, arr.nulls) == ("other", 2, 1)
+    assert summary.describe() == "3 rows:\n- j: 2 values, 1 null\n- arr: 2 values, 1 null"
+
+
+def test_json_column_starting_with_strings():
+    # json scalars come back as str, objects as dict
+    column = ColumnSummary("j")
+    column.add(("a", "b"))
+    column.add(("c", {"a": 1}))
+    assert column.kind == "other"
+    assert column.describe() == "j: 4 values"
+
+
+def test_json_column_starting_with_numbers():
+    # json numbers come back as int or float, then objects and strings
+    column = ColumnSummary("j")
+    column.add((2, 3.5))
+    column.add((None, {"a": 1}))
+    column.add(("x", 4))
+    assert column.kind == "other"
+    assert (column.count, column.nulls) == (5, 1)
+    assert column.describe() == "j: 5 values, 1 null"
+
+
+def test_number_then_text_in_one_batch():
+    summary = ResultSummary()
+    summary.add([(2,), ("x",), (None,)], ["j"])
+    assert summary.describe() == "3 rows:\n- j: 2 values, 1 null"
+
+
+def test_dates_then_other_values():
+    column = ColumnSummary("j")
+    column.add((datetime.date(2024, 1, 1),))
+    column.add((datetime.datetime(2024, 1, 2, 12), "2024-01-03"))
+    assert column.describe() == "j: 3 values"
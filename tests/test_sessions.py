@@ -0,0 +1,61 @@
+from cancellation import CancelToken
+from prompt import History
+from sessions import SessionManager
+
+MODEL_NAME = "llama3"
+
+
+def _manager(tmp_path) -> SessionManager:
+    return SessionManager(MODEL_NAME, ttl=3600, memory_mb=64, spill_dir=str(tmp_path))
+
+
+def _with_history(manager: SessionManager, turns: int = 2):
+    session = manager.create()
+    messages = [{"role": "system", "content": "You write SQL."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn}"})
+        messages.append({"role": "assistant", "content": f"SELECT {turn};"})
+    session.conversation.history = History(messages, MODEL_NAME)
+    manager.release(session)
+    return session
+
+
+def test_idle_sessions_are_spilled_and_restored(tmp_path):
+    manager = _manager(tmp_path)
+    session = _with_history(manager, turns=3)
+    manager.memory_budget = 0
+    manager.release(_with_history(manager))
+
+    assert manager.stats()["sessions_on_disk"] == 2
+    restored = manager.get(session.id)
+    assert restored is not session
+    assert restored.conversation.history.dump() == session.conversation.history.dump()
+
+
+def test_session_of_a_waiting_request_is_not_spilled(tmp_path):
+    manager = _manager(tmp_path)
+    waiting, other = _with_history(manager), _with_history(manager)
+
+    # a request took the session and is reading its body, another one finishes over the budget
+    token = CancelToken()
+    assert manager.get(waiting.id, token) is waiting and waiting.busy
+    manager.get(other.id)
+    manager.memory_budget = 0
+    manager.release(other)
+    assert manager.stats()["sessions_on_disk"] == 1
+
+    # the turn of the request is kept
+    waiting.conversation.history.append({"role": "user", "content": "question 2"})
+    waiting.tokens.discard(token)
+    manager.release(waiting)
+    assert manager.get(waiting.id).conversation.history.dump() == waiting.conversation.history.dump()
+
+
+def test_created_session_is_busy_with_its_request(tmp_path):
+    manager = _manager(tmp_path)
+    token = CancelToken()
+    session = manager.create(token)
+    assert session.busy
+    manager.memory_budget = 0
+    manager.release(_with_history(manager))
+    assert manager.get(session.id) is session
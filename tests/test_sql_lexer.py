@@ -0,0 +1,131 @@
+import json
+import os
+
+import pytest
+
+from sql_lexer import classify, single_query, tokenize, write_keyword
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "data", "sql_corpus.jsonl")
+
+
+def _classified(sql_statement: str) -> list[tuple]:
+    return [(statement.command, statement.write, statement.targets) for statement in classify(sql_statement)]
+
+
+@pytest.mark.parametrize("sql_statement, write, targets", [
+    ("WITH d AS (DELETE FROM orders WHERE id = 1 RETURNING *) SELECT * FROM d", "DELETE", {"orders"}),
+    ("WITH d AS MATERIALIZED (UPDATE orders SET x = 1 RETURNING *) SELECT * FROM d", "UPDATE", {"orders"}),
+    ("WITH d AS NOT MATERIALIZED (DELETE FROM orders RETURNING *) SELECT * FROM d", "DELETE", {"orders"}),
+    ("WITH a AS (SELECT 1), b AS (INSERT INTO logs VALUES (1) RETURNING *) SELECT * FROM a", "INSERT", {"logs"}),
+    ("WITH a AS (SELECT id FROM t) DELETE FROM orders WHERE id IN (SELECT id FROM a)", "DELETE", {"orders"}),
+    ("WITH RECURSIVE r(n) AS (SELECT 1 UNION SELECT n + 1 FROM r) MERGE INTO totals USING r ON true "
+     "WHEN MATCHED THEN DO NOTHING", "MERGE", {"totals"}),
+])
+def test_data_modifying_ctes(sql_statement, write, targets):
+    assert _classified(sql_statement) == [("WITH", write, targets)]
+
+
+def test_select_into():
+    assert _classified("SELECT * INTO backup FROM orders") == [("SELECT", "SELECT INTO", {"backup"})]
+    assert _classified("SELECT * INTO TEMP TABLE backup FROM orders") == [("SELECT", "SELECT INTO", {"backup"})]
+    # INTO of a sub-query or of INSERT is not SELECT INTO
+    assert write_keyword("SELECT * FROM orders WHERE id IN (SELECT id INTO x FROM t)") is None
+    assert write_keyword("INSERT INTO t SELECT 1") == "INSERT"
+
+
+@pytest.mark.parametrize("clause, write", [
+    ("FOR UPDATE", "FOR UPDATE"),
+    ("FOR NO KEY UPDATE", "FOR UPDATE"),
+    ("FOR SHARE", "FOR SHARE"),
+    ("FOR KEY SHARE", "FOR SHARE"),
+    ("FOR UPDATE OF o SKIP LOCKED", "FOR UPDATE"),
+])
+def test_locking_clauses(clause, write):
+    assert write_keyword(f"SELECT * FROM orders o {clause}") == write
+    assert single_query(f"SELECT * FROM orders o {clause}") is None
+
+
+@pytest.mark.parametrize("sql_statement", [
+    "SELECT $$ DROP TABLE orders; $$ AS x",
+    "SELECT $tag$ DELETE FROM orders; $inner$ $$ $tag$ AS x",
+    r"SELECT E'it\'s; DELETE FROM orders' AS x",
+    "SELECT e'\\\\' AS a, 'x; DROP TABLE t' AS b",
+    "SELECT 'a'';DROP TABLE t' AS x",
+    'SELECT "delete;" FROM "drop"',
+    "SELECT 1 /* outer /* DELETE FROM t; */ still a comment; DROP TABLE t */ FROM t",
+    "SELECT 1 -- ; DROP TABLE t\nFROM t",
+])
+def test_keywords_in_literals_and_comments(sql_statement):
+    statements = classify(sql_statement)
+    assert len(statements) == 1
+    assert statements[0].is_query
+
+
+def test_literal_tokens():
+    assert [text for kind, text, _ in tokenize("SELECT $a$ x $b$ y $a$, E'\\'', '' FROM t") if kind == "string"] == [
+        "$a$ x $b$ y $a$", "E'\\''", "''",
+    ]
+    assert list(tokenize("SELECT 1 /* a /* b */ c */", comments=True))[-1] == ("comment", "/* a /* b */ c */", 9)
+    # unterminated literals and comments run to the end of the text
+    assert list(tokenize("SELECT 'a; DROP TABLE t"))[-1] == ("string", "'a; DROP TABLE t", 7)
+    assert len(list(tokenize("SELECT 1 /* DROP TABLE t; /* */", comments=True))) == 3
+
+
+def test_multiple_statements():
+    assert _classified("SELECT 1; DROP TABLE orders;") == [
+        ("SELECT", None, set()), ("DROP", "DROP TABLE", {"orders"}),
+    ]
+    assert _classified(";;SELECT 1;; SELECT 2;") == [("SELECT", None, set()), ("SELECT", None, set())]
+    assert write_keyword("SELECT 1; -- DELETE FROM t\nSELECT 2") is None
+    assert single_query("SELECT 1; SELECT 2") is None
+    assert single_query("SELECT 1 FROM t; -- done") == "SELECT 1 FROM t"
+
+
+@pytest.mark.parametrize("sql_statement, write, targets", [
+    ("EXPLAIN SELECT * FROM orders", None, set()),
+    ("EXPLAIN DELETE FROM orders", None, set()),
+    ("EXPLAIN ANALYZE SELECT * FROM orders ORDER BY set", None, set()),
+    ("EXPLAIN ANALYZE DELETE FROM orders", "DELETE", {"orders"}),
+    ("EXPLAIN ANALYZE VERBOSE INSERT INTO logs SELECT * FROM orders", "INSERT", {"logs"}),
+    ("EXPLAIN (ANALYZE, BUFFERS) UPDATE orders SET x = 1", "UPDATE", {"orders"}),
+    ("EXPLAIN ANALYZE WITH d AS (DELETE FROM orders RETURNING *) SELECT * FROM d", "DELETE", {"orders"}),
+])
+def test_explain_analyze(sql_statement, write, targets):
+    assert _classified(sql_statement) == [("EXPLAIN", write, targets)]
+
+
+@pytest.mark.parametrize("sql_statement", [
+    "SELECT (delete) FROM t",
+    "SELECT delete, update, insert FROM t",
+    "SELECT max(update) FROM t WHERE (insert) > 0",
+    "WITH a AS (SELECT (delete) FROM t) SELECT * FROM a",
+    "SELECT * FROM (SELECT 1) AS t(delete)",
+    "SELECT count(*) FROM orders WHERE note = 'update'",
+])
+def test_column_names_are_not_writes(sql_statement):
+    assert write_keyword(sql_statement) is None
+
+
+def test_write_functions():
+    assert _classified("SELECT nextval('orders_id_seq')") == [("SELECT", "nextval()", None)]
+    assert write_keyword("SELECT pg_terminate_backend(pid) FROM pg_stat_activity") == "pg_terminate_backend()"
+    assert write_keyword("SELECT nextval FROM t") is None
+
+
+def test_write_targets():
+    assert _classified("INSERT INTO public.orders VALUES (1)") == [("INSERT", "INSERT", {"orders"})]
+    assert _classified('UPDATE ONLY "Order Items" SET x = 1') == [("UPDATE", "UPDATE", {"Order Items"})]
+    assert _classified("DROP TABLE IF EXISTS x") == [("DROP", "DROP TABLE", {"x"})]
+    assert _classified("TRUNCATE a, b") == [("TRUNCATE", "TRUNCATE", None)]
+    assert _classified("DROP SCHEMA s CASCADE") == [("DROP", "DROP SCHEMA", None)]
+
+
+def test_corpus_labels():
+    with open(CORPUS) as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    mislabelled = [(entry["sql"], entry["write"]) for entry in corpus if write_keyword(entry["sql"]) != entry["write"]]
+    assert mislabelled == []
+    # a statement run on the server as a plain query never writes
+    for entry in corpus:
+        if entry["write"] is not None:
+            assert single_query(entry["sql"]) is None, entry["sql"]
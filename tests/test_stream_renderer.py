@@ -0,0 +1,74 @@
+from stream_renderer import StreamRenderer
+
+
+class _Root:
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, fn):
+        self.scheduled.append(fn)
+
+
+class _Text:
+    """The parts of a Tk Text widget the renderer uses."""
+
+    def __init__(self):
+        self.text = ""
+
+    def config(self, **options):
+        pass
+
+    def insert(self, index, text):
+        self.text += text
+
+    def delete(self, start, end):
+        self.text = ""
+
+    def yview(self, *args):
+        pass
+
+
+def _renderer() -> tuple[StreamRenderer, _Root, _Text]:
+    root, text = _Root(), _Text()
+    return StreamRenderer(root, text), root, text
+
+
+def test_stream_is_flushed_and_measured():
+    renderer, _, text = _renderer()
+    renderer.write("Answer: ")
+    renderer.begin()
+    for chunk in ("The ", "largest ", "total."):
+        renderer.write(chunk, token=True)
+    renderer.flush()
+    renderer.end()
+    renderer.flush()
+    assert text.text == "Answer: The largest total."
+    assert renderer.last_stats["tokens"] == 3 and renderer.last_stats["flushes"] == 1
+
+
+def test_clear_during_a_stream():
+    renderer, root, text = _renderer()
+    renderer.begin()
+    renderer.write("SELECT", token=True)
+    # e.g. a new session opened while an answer streams
+    renderer.clear()
+    renderer.write(" 1", token=True)
+    renderer.end()
+    root.scheduled.pop()()
+    assert text.text == " 1"
+    assert renderer.last_stats is None
+
+
+def test_failed_flush_keeps_the_timer():
+    renderer, root, _ = _renderer()
+
+    def _fail():
+        raise RuntimeError("widget destroyed")
+
+    renderer.flush = _fail
+    tick = root.scheduled.pop()
+    try:
+        tick()
+    except RuntimeError:
+        pass
+    assert root.scheduled == [tick]
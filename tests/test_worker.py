@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from cancellation import CancelToken, Cancelled, cancellation
+from worker import BackgroundWorker
+
+
+class _Root:
+    """Stands for the Tk root, the callbacks are run by the test calling `_poll`."""
+
+    def after(self, ms, fn):
+        pass
+
+
+def _in_thread(fn) -> tuple[threading.Thread, dict]:
+    outcome = {}
+
+    def _run():
+        try:
+            outcome["result"] = fn()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+def _wait_for_call(worker: BackgroundWorker):
+    while worker._callbacks.empty():
+        threading.Event().wait(0.001)
+
+
+def test_run_on_main_returns_the_result():
+    worker = BackgroundWorker(_Root())
+    thread, outcome = _in_thread(lambda: worker.run_on_main(lambda a, b: a + b, 1, 2))
+    _wait_for_call(worker)
+    worker._poll()
+    thread.join(1)
+    assert outcome == {"result": 3}
+    worker.shutdown()
+
+
+def test_run_on_main_stops_when_cancelled():
+    worker = BackgroundWorker(_Root())
+    token, calls = CancelToken(), []
+
+    def _confirm():
+        with cancellation(token):
+            return worker.run_on_main(calls.append, "shown")
+
+    thread, outcome = _in_thread(_confirm)
+    _wait_for_call(worker)
+    token.cancel()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert isinstance(outcome["error"], Cancelled)
+    # the dialog is not shown once its caller stopped waiting
+    worker._poll()
+    assert calls == []
+    worker.shutdown()
+
+
+def test_run_on_main_stops_on_shutdown():
+    worker = BackgroundWorker(_Root())
+    thread, outcome = _in_thread(lambda: worker.run_on_main(lambda: True))
+    _wait_for_call(worker)
+    worker.shutdown()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert isinstance(outcome["error"], Cancelled)
+    with pytest.raises(Cancelled):
+        worker.run_on_main(lambda: True)